@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Load-testing harness for the Brigada Paulista backend
+Boots server.py in-process against a local mongod (or an in-memory Motor
+stand-in), seeds data, drives concurrent scenarios and reports throughput
+and p50/p95/p99 latency per endpoint
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PASSWORD = "saopaulo1932"
+
+SCENARIOS = {
+    # name -> weights of the operations a virtual user picks from
+    "browse": {"list_threads": 5, "next_page": 1, "thread_page": 4, "replies": 2},
+    "login_burst": {"login": 1},
+    "reply_storm": {"reply_hot": 1},
+    "uploads": {"upload": 1},
+    "mixed": {"list_threads": 30, "thread_page": 30, "replies": 10, "search": 5,
+              "create_thread": 3, "reply": 15, "reply_hot": 3, "login": 2, "upload": 2},
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the forum API")
+    parser.add_argument("--mongo-url", help="MongoDB URL; omit to use the in-memory stand-in")
+    parser.add_argument("--db-name", default=f"bench_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append",
+                        help="Scenario to run (repeatable, default: all)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent virtual users")
+    parser.add_argument("--threads", type=int, default=500, help="Threads to seed")
+    parser.add_argument("--replies", type=int, default=20, help="Replies per seeded thread")
+    parser.add_argument("--hot-replies", type=int, default=2000, help="Replies on the hot thread")
+    parser.add_argument("--users", type=int, default=50, help="Users to seed")
+    parser.add_argument("--images", type=int, default=20, help="Images to seed")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--output", help="Write machine-readable results to this JSON file")
+    return parser.parse_args()
+
+def use_in_memory_mongo():
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    class InMemoryMotorClient(AsyncMongoMockClient):
+        def __init__(self, *args, **kwargs):
+            # mongomock does not understand pool or monitoring options
+            super().__init__(*args, tz_aware=kwargs.get("tz_aware", False))
+
+    motor.motor_asyncio.AsyncIOMotorClient = InMemoryMotorClient
+
+def make_png(size: int) -> bytes:
+    from PIL import Image
+    image = Image.new("RGB", (size, size), color=(random.randrange(256), 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+async def seed(server, args):
+    now = datetime.now(timezone.utc)
+    password_hash = server.hash_password(PASSWORD)
+    await server.db.users.insert_many([
+        {"id": str(uuid.uuid4()), "username": f"bench_user_{i}", "password_hash": password_hash,
+         "created_at": now, "is_active": True}
+        for i in range(args.users)
+    ])
+    
+    image_ids = []
+    for i in range(args.images):
+        data = make_png(64 + i)
+        image_id = server.hashlib.sha256(data).hexdigest()
+        await server.save_image(io.BytesIO(data), image_id, len(data), "image/png")
+        image_ids.append(image_id)
+    
+    thread_ids = []
+    for start in range(0, args.threads, 500):
+        threads = []
+        for i in range(start, min(start + 500, args.threads)):
+            created_at = now - timedelta(minutes=args.threads - i)
+            threads.append(server.Thread(
+                title=f"Tópico de carga {i}",
+                content="Companheiros paulistas, MMDC nunca será esquecido! " * 10,
+                created_at=created_at,
+                last_activity_at=created_at,
+                bumped_at=created_at,
+                reply_count=args.replies,
+                image_id=random.choice(image_ids) if image_ids and i % 3 == 0 else None
+            ).dict())
+        await server.db.threads.insert_many(threads)
+        thread_ids += [thread["id"] for thread in threads]
+    
+    async def seed_replies(thread_id, count):
+        for start in range(0, count, 1000):
+            await server.db.replies.insert_many([
+                server.Reply(
+                    thread_id=thread_id,
+                    content=f"Resposta {i}: viva São Paulo livre!",
+                    created_at=now + timedelta(milliseconds=i)
+                ).dict()
+                for i in range(start, min(start + 1000, count))
+            ])
+    
+    for thread_id in thread_ids:
+        await seed_replies(thread_id, args.replies)
+    hot_thread_id = thread_ids[-1]
+    await seed_replies(hot_thread_id, args.hot_replies)
+    await server.db.threads.update_one({"id": hot_thread_id}, {"$inc": {"reply_count": args.hot_replies}})
+    return {"thread_ids": thread_ids, "hot_thread_id": hot_thread_id}
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name, seconds, ok):
+        self.latencies[name].append(seconds)
+        if not ok:
+            self.errors[name] += 1
+
+    def summary(self, elapsed):
+        results = {}
+        for name, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            def percentile(p):
+                return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+            results[name] = {
+                "requests": len(samples),
+                "errors": self.errors[name],
+                "throughput_rps": len(samples) / elapsed,
+                "p50_ms": percentile(0.50),
+                "p95_ms": percentile(0.95),
+                "p99_ms": percentile(0.99),
+                "max_ms": samples[-1] * 1000,
+            }
+        return results
+
+class VirtualUser:
+    def __init__(self, client, recorder, data, args):
+        self.client = client
+        self.recorder = recorder
+        self.data = data
+        self.args = args
+        self.token = None
+        self.next_cursor = None
+
+    async def timed(self, name, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        self.recorder.record(name, time.perf_counter() - start, ok)
+        return response
+
+    async def list_threads(self):
+        response = await self.timed("GET /threads", "GET", "/api/threads")
+        if response is not None:
+            self.next_cursor = response.headers.get("x-next-cursor")
+
+    async def next_page(self):
+        params = {"before": self.next_cursor} if self.next_cursor else {}
+        response = await self.timed("GET /threads?before", "GET", "/api/threads", params=params)
+        if response is not None:
+            self.next_cursor = response.headers.get("x-next-cursor")
+
+    async def thread_page(self):
+        thread_id = random.choice(self.data["thread_ids"])
+        await self.timed("GET /threads/{id}/page", "GET", f"/api/threads/{thread_id}/page")
+
+    async def replies(self):
+        await self.timed("GET /threads/{id}/replies (hot)", "GET",
+                         f"/api/threads/{self.data['hot_thread_id']}/replies")
+
+    async def search(self):
+        await self.timed("GET /search", "GET", "/api/search", params={"q": "paulistas"})
+
+    async def login(self):
+        username = f"bench_user_{random.randrange(self.args.users)}"
+        response = await self.timed("POST /login", "POST", "/api/login",
+                                    json={"username": username, "password": PASSWORD})
+        if response is not None and response.status_code == 200:
+            self.token = response.json()["access_token"]
+
+    def auth_headers(self):
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+    async def create_thread(self):
+        await self.timed("POST /threads", "POST", "/api/threads", headers=self.auth_headers(),
+                         json={"title": "Novo tópico de carga", "content": "Por São Paulo livre!"})
+
+    async def reply(self):
+        thread_id = random.choice(self.data["thread_ids"])
+        await self.timed("POST /threads/{id}/replies", "POST", f"/api/threads/{thread_id}/replies",
+                         headers=self.auth_headers(), json={"content": "Apoiado!"})
+
+    async def reply_hot(self):
+        await self.timed("POST /threads/{id}/replies (hot)", "POST",
+                         f"/api/threads/{self.data['hot_thread_id']}/replies",
+                         headers=self.auth_headers(), json={"content": "Apoiado!"})
+
+    async def upload(self):
+        files = {"file": ("carga.png", make_png(random.randint(32, 256)), "image/png")}
+        await self.timed("POST /upload-image", "POST", "/api/upload-image", files=files)
+
+    async def run(self, weights, deadline):
+        operations = list(weights)
+        operation_weights = [weights[name] for name in operations]
+        while time.perf_counter() < deadline:
+            operation = random.choices(operations, operation_weights)[0]
+            await getattr(self, operation)()
+
+async def run_scenario(base_url, name, data, args):
+    import httpx
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        users = [VirtualUser(client, recorder, data, args) for _ in range(args.concurrency)]
+        start = time.perf_counter()
+        deadline = start + args.duration
+        # mongomock has no $text operator, so search only runs against a real mongod
+        weights = {op: weight for op, weight in SCENARIOS[name].items() if args.mongo_url or op != "search"}
+        await asyncio.gather(*[user.run(weights, deadline) for user in users])
+        elapsed = time.perf_counter() - start
+    return recorder.summary(elapsed)
+
+def print_results(name, results):
+    print(f"\n📊 {name}")
+    print(f"  {'endpoint':<36} {'reqs':>7} {'err':>5} {'rps':>9} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for endpoint, stats in results.items():
+        print(f"  {endpoint:<36} {stats['requests']:>7} {stats['errors']:>5} {stats['throughput_rps']:>9.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def main():
+    args = parse_args()
+    scenarios = args.scenario or list(SCENARIOS)
+    
+    # server.py reads its configuration at import time
+    os.environ["MONGO_URL"] = args.mongo_url or "mongodb://in-memory"
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    os.environ.setdefault("IMAGE_STORE", "local")
+    os.environ.setdefault("IMAGE_STORE_PATH", tempfile.mkdtemp(prefix="bench_images_"))
+    # Every virtual user shares one IP; set RATE_LIMIT_BACKEND to measure the limiter itself
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "off")
+    if not args.mongo_url:
+        use_in_memory_mongo()
+    sys.path.insert(0, str(BACKEND_DIR))
+    import uvicorn
+    import server
+    # server.py configures INFO logging for everything, httpx included
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    
+    port = free_port()
+    uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning"))
+    serve_task = asyncio.create_task(uvicorn_server.serve())
+    while not uvicorn_server.started:
+        await asyncio.sleep(0.05)
+    
+    try:
+        print(f"🌱 Seeding {args.threads} threads, {args.replies} replies each, "
+              f"{args.hot_replies} on the hot thread, {args.users} users, {args.images} images")
+        data = await seed(server, args)
+        # The catalog was built at startup, before seeding
+        await server.thread_catalog.load()
+        
+        report = {
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "backend": "mongod" if args.mongo_url else "in-memory",
+            "config": {key: value for key, value in vars(args).items() if key not in ("mongo_url", "output")},
+            "scenarios": {},
+        }
+        for name in scenarios:
+            results = await run_scenario(f"http://127.0.0.1:{port}", name, data, args)
+            report["scenarios"][name] = results
+            print_results(name, results)
+    finally:
+        if args.mongo_url:
+            await server.client.drop_database(args.db_name)
+        uvicorn_server.should_exit = True
+        await serve_task
+    
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"\n💾 Results written to {args.output}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
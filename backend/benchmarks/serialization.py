@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Serialization benchmark for the forum read endpoints
+Encodes the same documents, shaped the same way, through the old per-document
+Pydantic rebuild + response_model validation + stdlib JSON path and through
+the orjson path, and checks that both produce the same JSON
+"""
+
+import json
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import List
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from server import Reply, ThreadSummary, json_bytes, public_reply, thread_summary_from_mongo
+
+ROUNDS = 50
+
+def make_threads(count):
+    now = datetime.now(timezone.utc)
+    return [{
+        "id": str(uuid.uuid4()),
+        "title": f"Tópico {i} sobre a Revolução Constitucionalista",
+        "content": "Companheiros paulistas, MMDC nunca será esquecido! " * 20,
+        "author_username": "paulista_revolucionario",
+        "created_at": now - timedelta(minutes=i),
+        "last_activity_at": now - timedelta(minutes=i),
+        "reply_count": i,
+        "image_id": uuid.uuid4().hex * 2,
+        "image_data": None,
+        "image_filename": "bandeira.png"
+    } for i in range(count)]
+
+def make_replies(count):
+    now = datetime.now(timezone.utc)
+    thread_id = str(uuid.uuid4())
+    return [{
+        "id": str(uuid.uuid4()),
+        "thread_id": thread_id,
+        "content": "Concordo plenamente! Viva São Paulo livre! " * 5,
+        "author_username": None if i % 3 else "bandeirante_livre",
+        "created_at": now + timedelta(seconds=i),
+        "image_id": None,
+        "image_data": None,
+        "image_filename": None
+    } for i in range(count)]
+
+def old_path(model, shape, docs):
+    # Model(**doc) per row, response_model validation, stdlib JSON
+    adapter = TypeAdapter(List[model])
+    models = [model(**shape(dict(doc))) for doc in docs]
+    validated = adapter.validate_python([m.model_dump() for m in models])
+    content = jsonable_encoder(adapter.dump_python(validated, mode="json"))
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def new_path(shape, docs):
+    return json_bytes([shape(dict(doc)) for doc in docs])
+
+def compare(label, model, shape, docs):
+    print(f"📊 {label}")
+    if orjson.loads(old_path(model, shape, docs)) != orjson.loads(new_path(shape, docs)):
+        raise SystemExit("  the two paths disagree on the JSON they produce")
+    old = measure("pydantic + json", lambda: old_path(model, shape, docs))
+    new = measure("orjson", lambda: new_path(shape, docs))
+    print(f"  saved {(old - new) * 1000:.3f} ms/request ({old / new:.1f}x faster)")
+
+def measure(label, fn):
+    seconds = min(timeit.repeat(fn, number=ROUNDS, repeat=5)) / ROUNDS
+    print(f"  {label:<28} {seconds * 1000:8.3f} ms/request")
+    return seconds
+
+def main():
+    compare("100-thread list", ThreadSummary, thread_summary_from_mongo, make_threads(100))
+    print()
+    compare("1000-reply page", Reply, public_reply, make_replies(1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Bulk export and import of forum data
+Moves users (without password hashes), threads and replies between
+environments as gzip-compressed NDJSON, one file per collection, talking to
+MongoDB directly through the server's own streaming code. Imports keep a
+checkpoint next to each file and resume from it after an interruption.
+Archived threads are exported with their replies and archived again on
+import.
+
+Imported users cannot log in until they get a new password, which
+set-password gives them one account at a time.
+
+  python forum_data.py export --dir dump/
+  python forum_data.py import --dir dump/ [--restart] [collection ...]
+  python forum_data.py set-password --user USERNAME
+"""
+
+import argparse
+import asyncio
+import getpass
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+COLLECTIONS = ("users", "threads", "replies")
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Export or import forum data as NDJSON",
+        epilog="Password hashes are never exported: imported users cannot log in until "
+               "set-password gives them a new password."
+    )
+    parser.add_argument("command", choices=["export", "import", "set-password"])
+    parser.add_argument("collections", nargs="*", metavar="collection",
+                        help=f"One of {', '.join(COLLECTIONS)} (default: all)")
+    parser.add_argument("--dir", type=Path, default=Path("."), help="Directory holding the .ndjson.gz files")
+    parser.add_argument("--mongo-url", help="Overrides MONGO_URL")
+    parser.add_argument("--db-name", help="Overrides DB_NAME")
+    parser.add_argument("--restart", action="store_true", help="Ignore import checkpoints and start over")
+    parser.add_argument("--user", help="Account whose password set-password replaces")
+    args = parser.parse_args()
+    unknown = set(args.collections) - set(COLLECTIONS)
+    if unknown:
+        parser.error(f"unknown collections: {', '.join(sorted(unknown))}")
+    if args.command == "set-password" and not args.user:
+        parser.error("set-password needs --user")
+    return args
+
+def data_path(directory: Path, name: str) -> Path:
+    return directory / f"{name}.ndjson.gz"
+
+def checkpoint_path(path: Path) -> Path:
+    return path.with_name(path.name + ".checkpoint")
+
+# A checkpoint only applies to the exact file it was taken from
+def file_identity(path: Path) -> dict:
+    stat_result = path.stat()
+    return {"size": stat_result.st_size, "mtime_ns": stat_result.st_mtime_ns}
+
+def read_checkpoint(path: Path) -> int:
+    try:
+        saved = json.loads(checkpoint_path(path).read_text())
+    except (FileNotFoundError, ValueError):
+        return 0
+    if saved.get("file") != file_identity(path):
+        return 0
+    return saved["lines"]
+
+async def read_chunks(path: Path, size: int = 1 << 20):
+    with open(path, "rb") as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, size)
+            if not chunk:
+                return
+            yield chunk
+
+async def export_collection(server, name: str, directory: Path):
+    path = data_path(directory, name)
+    partial = path.with_name(path.name + ".partial")
+    start = time.perf_counter()
+    with open(partial, "wb") as f:
+        async for chunk in server.export_ndjson_gz(name):
+            f.write(chunk)
+    os.replace(partial, path)
+    print(f"  {name}: {path.stat().st_size / 1e6:.1f} MB in {time.perf_counter() - start:.1f}s -> {path}")
+
+async def import_collection(server, name: str, directory: Path, restart: bool) -> bool:
+    path = data_path(directory, name)
+    if not path.is_file():
+        print(f"  {name}: no {path}, skipped")
+        return True
+    identity = file_identity(path)
+    skip = 0 if restart else read_checkpoint(path)
+    if skip:
+        print(f"  {name}: resuming after line {skip}")
+
+    async def checkpoint(lines: int):
+        server.write_file_atomic(checkpoint_path(path), json.dumps({"file": identity, "lines": lines}).encode())
+
+    start = time.perf_counter()
+    try:
+        result = await server.import_documents(name, read_chunks(path), skip=skip, checkpoint=checkpoint)
+    except server.DataImportError as e:
+        print(f"  {name}: stopped at line {e.line}: {e.reason}")
+        print(f"  while the file is unchanged, the next run resumes after line {e.resume_from}")
+        return False
+    finally:
+        await server.finish_import(name)
+    checkpoint_path(path).unlink(missing_ok=True)
+    elapsed = time.perf_counter() - start
+    print(f"  {name}: {result['imported']} documents in {elapsed:.1f}s ({result['imported'] / max(elapsed, 1e-9):.0f}/s)")
+    return True
+
+async def set_password(server, username: str, password: str) -> bool:
+    password_hash = await asyncio.to_thread(server.hash_password, password)
+    result = await server.db.users.update_one({"username": username}, {"$set": {"password_hash": password_hash}})
+    return result.matched_count == 1
+
+def prompt_password() -> str:
+    while True:
+        password = getpass.getpass("New password: ")
+        if not password:
+            print("  the password cannot be empty")
+        elif getpass.getpass("Repeat it: ") != password:
+            print("  the passwords differ")
+        else:
+            return password
+
+async def main():
+    args = parse_args()
+    if args.mongo_url:
+        os.environ["MONGO_URL"] = args.mongo_url
+    if args.db_name:
+        os.environ["DB_NAME"] = args.db_name
+
+    import server
+
+    collections = args.collections or list(COLLECTIONS)
+    ok = True
+    try:
+        if args.command == "set-password":
+            if not await set_password(server, args.user, prompt_password()):
+                print(f"  no user {args.user} in {server.db.name}")
+                ok = False
+        elif args.command == "export":
+            args.dir.mkdir(parents=True, exist_ok=True)
+            print(f"📦 Exporting {', '.join(collections)} from {server.db.name}")
+            for name in collections:
+                await export_collection(server, name, args.dir)
+        else:
+            # Upserts look documents up by key, so the indexes must exist first
+            await server.ensure_indexes()
+            print(f"📥 Importing into {server.db.name}")
+            for name in server.IMPORT_ORDER:
+                if name in collections and not await import_collection(server, name, args.dir, args.restart):
+                    ok = False
+                    break
+            if ok and not server.CATALOG_SHARED:
+                print("  running servers keep their front page until restarted")
+            if ok and "users" in collections:
+                print("  imported users need a new password: forum_data.py set-password --user USERNAME")
+    finally:
+        server.client.close()
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
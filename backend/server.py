@@ -1,8 +1,26 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Form, Request, Response, Query, Header
+from fastapi.responses import FileResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from motor.frameworks import asyncio as motor_asyncio_framework
+from bson import CodecOptions, ObjectId
+from gridfs.errors import FileExists
+from python_multipart.multipart import MultipartParser, parse_options_header
+from pymongo import IndexModel, ReplaceOne, ReturnDocument, TEXT, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+import asyncio
+import bisect
+import contextvars
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image, ImageOps
 import os
 import logging
 from pathlib import Path
@@ -11,33 +29,476 @@ from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
+import orjson
 import bcrypt
 import base64
+import bson
+import gzip
+import hashlib
+import html
+import ipaddress
+import json
+import math
+import multiprocessing
+import re
+import shutil
+import tempfile
+import threading
+import unicodedata
+import zlib
 from io import BytesIO
 
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # request profiling unavailable
+    Profiler = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Metrics, exported in Prometheus text format from /metrics. Values are per
+# worker process.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self.lock:
+            self.values[label_values] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_values, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Gauge(Counter):
+    def set(self, *label_values, value: float):
+        with self.lock:
+            self.values[label_values] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, *label_values, value: float):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self.lock:
+            for label_values, series in self.series.items():
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels(names, label_values + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(names, label_values + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {series[-2]}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+http_requests_total = Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+)
+http_requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests being served")
+mongo_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("collection", "command")
+)
+mongo_command_failures = Counter(
+    "mongodb_command_failures_total", "Failed MongoDB commands", ("collection", "command")
+)
+mongo_connections_open = Gauge("mongodb_connections_open", "Open connections in the MongoDB pool")
+mongo_checkout_failures = Counter(
+    "mongodb_checkout_failures_total", "Connection checkouts that failed, e.g. on wait-queue timeout", ("reason",)
+)
+rate_limited_total = Counter("rate_limited_total", "Requests rejected by the rate limiter", ("route_class",))
+upload_bytes_total = Counter("upload_bytes_total", "Bytes received by the image upload endpoint")
+event_loop_lag = Histogram("event_loop_lag_seconds", "Event loop scheduling delay")
+
+# PyMongo calls these from Motor's executor threads
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self.pending = {}  # (connection, request_id) -> (collection, command)
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = "-"
+        self.pending[(event.connection_id, event.request_id)] = (collection, event.command_name)
+
+    def succeeded(self, event):
+        labels = self.pending.pop((event.connection_id, event.request_id), None)
+        if labels:
+            mongo_command_duration.observe(*labels, value=event.duration_micros / 1e6)
+
+    def failed(self, event):
+        labels = self.pending.pop((event.connection_id, event.request_id), None)
+        if labels:
+            mongo_command_duration.observe(*labels, value=event.duration_micros / 1e6)
+            mongo_command_failures.inc(*labels)
+
+# Slow request log: requests slower than SLOW_REQUEST_MS are recorded with
+# the Mongo commands they issued and an explain() summary of the slowest.
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', '0'))  # 0 disables the log
+SLOW_REQUEST_MAX_COMMANDS = 50
+SLOW_REQUEST_RETENTION_DAYS = int(os.environ.get('SLOW_REQUEST_RETENTION_DAYS', '7'))
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# Driver fields that must not be sent back inside an explain
+DRIVER_COMMAND_FIELDS = {"lsid", "$clusterTime", "$db", "$readPreference", "txnNumber", "signature"}
+
+class RequestTrace:
+    def __init__(self):
+        self.pending = {}  # (connection, request_id) -> (collection, command name, command)
+        self.commands = []  # dicts, in completion order, capped
+        self.command_count = 0
+        self.slowest = None  # (duration, database, command) of the slowest explainable command
+
+request_trace = contextvars.ContextVar("request_trace", default=None)
+
+# Motor runs PyMongo calls on its own thread pool without copying contextvars,
+# so a command listener could not tell which request issued a command.
+# Wrapping Motor's framework hook, which every call goes through in the
+# pinned motor 3.3, runs each call in a copy of the calling task's context.
+# Returns False when the hook is missing, and traces then lack commands.
+def propagate_context_to_motor() -> bool:
+    run_on_executor = getattr(motor_asyncio_framework, "run_on_executor", None)
+    if run_on_executor is None:
+        return False
+
+    def run_in_context(loop, fn, *args, **kwargs):
+        return run_on_executor(loop, contextvars.copy_context().run, fn, *args, **kwargs)
+
+    motor_asyncio_framework.run_on_executor = run_in_context
+    return True
+
+class SlowRequestTracer(monitoring.CommandListener):
+    def started(self, event):
+        trace = request_trace.get()
+        if trace is not None:
+            collection = event.command.get(event.command_name)
+            trace.pending[(event.connection_id, event.request_id)] = (
+                collection if isinstance(collection, str) else "-",
+                event.database_name,
+                event.command if event.command_name in EXPLAINABLE_COMMANDS else None
+            )
+
+    def _finish(self, event, ok: bool):
+        trace = request_trace.get()
+        if trace is None:
+            return
+        started = trace.pending.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        collection, database, command = started
+        duration = event.duration_micros / 1000
+        trace.command_count += 1
+        if len(trace.commands) < SLOW_REQUEST_MAX_COMMANDS:
+            trace.commands.append({
+                "collection": collection, "command": event.command_name,
+                "duration_ms": round(duration, 3), "ok": ok
+            })
+        if command is not None and (trace.slowest is None or duration > trace.slowest[0]):
+            trace.slowest = (duration, database, command)
+
+    def succeeded(self, event):
+        self._finish(event, True)
+
+    def failed(self, event):
+        self._finish(event, False)
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    def connection_created(self, event):
+        mongo_connections_open.inc(amount=1)
+
+    def connection_closed(self, event):
+        mongo_connections_open.inc(amount=-1)
+
+    def connection_check_out_failed(self, event):
+        mongo_checkout_failures.inc(event.reason)
+
+    # The listener interface requires every event; these are not measured
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+# MongoDB connection. Every uvicorn worker has its own pool, so a deployment
+# opens up to workers x MONGO_MAX_POOL_SIZE connections per server.
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '20'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '2'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+# Read preference for the public read routes: primary, primaryPreferred,
+# secondary, secondaryPreferred or nearest. Writes always go to the primary.
+MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+MONGO_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', '90'))  # server minimum is 90
+MONGO_WARM_CONNECTIONS = int(os.environ.get('MONGO_WARM_CONNECTIONS', str(MONGO_MIN_POOL_SIZE)))
+
+def read_preference(mode: str):
+    if mode == 'primary':
+        return Primary()
+    modes = {
+        'primaryPreferred': PrimaryPreferred,
+        'secondary': Secondary,
+        'secondaryPreferred': SecondaryPreferred,
+        'nearest': Nearest,
+    }
+    if mode not in modes:
+        raise ValueError(f"Unknown MONGO_READ_PREFERENCE: {mode}")
+    return modes[mode](max_staleness=MONGO_MAX_STALENESS_SECONDS)
+
+if SLOW_REQUEST_MS > 0 and not propagate_context_to_motor():
+    logging.getLogger(__name__).warning("This Motor has no run_on_executor; slow request logs will not list Mongo commands")
+
+client = AsyncIOMotorClient(
+    mongo_url,
+    tz_aware=True,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    event_listeners=[MongoCommandMetrics(), MongoPoolMetrics()] + ([SlowRequestTracer()] if SLOW_REQUEST_MS > 0 else [])
+)
 db = client[os.environ['DB_NAME']]
+# Routes that only read published content use read_db and may see data up to
+# MONGO_MAX_STALENESS_SECONDS old. Writes, and reads that must observe them
+# (existence checks, catalog, event resume), stay on db.
+read_db = client.get_database(os.environ['DB_NAME'], read_preference=read_preference(MONGO_READ_PREFERENCE))
+
+# With secondaries, two reads can land on different members. A causally
+# consistent session makes the second read wait until its member has caught
+# up with the first, so a payload is never older than the version it is
+# tagged with. The primary alone already guarantees that.
+@asynccontextmanager
+async def read_session():
+    if MONGO_READ_PREFERENCE == 'primary':
+        yield None
+        return
+    async with await client.start_session(causal_consistency=True) as session:
+        yield session
+
+# Opens connections to every server the routes will use before the worker
+# takes traffic, so the first requests do not pay for TCP/TLS handshakes and
+# a wrong MONGO_URL fails startup instead of the first request
+async def warm_mongo_connections():
+    warm_reads = MONGO_READ_PREFERENCE != 'primary'
+    await asyncio.gather(*[db.command("ping") for _ in range(max(1, MONGO_WARM_CONNECTIONS))])
+    if warm_reads:
+        await asyncio.gather(*[
+            read_db.command("ping", read_preference=read_db.read_preference)
+            for _ in range(max(1, MONGO_WARM_CONNECTIONS))
+        ])
 
 # JWT Configuration
 JWT_SECRET = "brigada_paulista_secret_key_2025"
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# Password hashing
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', '4'))
+BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', '64'))
+
+# Verified-token cache. Cached tokens are checked against the shared
+# revocation list again once their check is this many seconds old.
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+TOKEN_REVOCATION_CHECK_SECONDS = float(os.environ.get('TOKEN_REVOCATION_CHECK_SECONDS', '5'))
+
+# Write rate limits per client: route class -> "requests/seconds". A client
+# may burst up to the request count and regains it evenly over the period.
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # "memory", "mongo" or "off"
+RATE_LIMITS = {
+    "thread": os.environ.get('RATE_LIMIT_THREAD', '5/300'),
+    "reply": os.environ.get('RATE_LIMIT_REPLY', '20/60'),
+    "upload": os.environ.get('RATE_LIMIT_UPLOAD', '10/300'),
+    "auth": os.environ.get('RATE_LIMIT_AUTH', '10/60'),
+}
+RATE_LIMIT_MAX_KEYS = 100000
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() == 'true'
+
+# Front page catalog
+# Only a single-worker deployment may keep the catalog in process memory
+CATALOG_SHARED = os.environ.get('CATALOG_SHARED', 'true').lower() == 'true'
+CATALOG_SYNC_INTERVAL = float(os.environ.get('CATALOG_SYNC_INTERVAL', '1.0'))
+
+# Live thread events
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'local')  # "local" or "changestream"
+EVENT_BUFFER_SIZE = int(os.environ.get('EVENT_BUFFER_SIZE', '100'))
+SSE_KEEPALIVE_SECONDS = 15
+
+# Reply write pipeline
+REPLY_WRITE_MODE = os.environ.get('REPLY_WRITE_MODE', 'direct')  # "direct" or "batched"
+REPLY_BATCH_WINDOW_MS = int(os.environ.get('REPLY_BATCH_WINDOW_MS', '5'))
+REPLY_BATCH_MAX_SIZE = int(os.environ.get('REPLY_BATCH_MAX_SIZE', '500'))
+REPLY_DURABILITY = os.environ.get('REPLY_DURABILITY', 'flush')  # "flush" or "enqueue"
+KNOWN_THREADS_CACHE_SIZE = 10000
+
+# Search
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+SEARCH_SNIPPET_LENGTH = 160
+
+# Image store configuration
+IMAGE_STORE = os.environ.get('IMAGE_STORE', 'gridfs')  # "gridfs" or "local"
+IMAGE_STORE_PATH = Path(os.environ.get('IMAGE_STORE_PATH', ROOT_DIR / 'images'))
+IMAGE_CHUNK_SIZE = 256 * 1024
+IMAGE_ID_PATTERN = r'^[0-9a-f]{64}$'
+
+# Uploads
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
+UPLOAD_SPOOL_THRESHOLD = int(os.environ.get('UPLOAD_SPOOL_THRESHOLD', str(1024 * 1024)))
+UPLOAD_MULTIPART_OVERHEAD = 16 * 1024  # boundaries and part headers
+UPLOAD_PART_HEADER_MAX_BYTES = 8 * 1024
+
+# Image derivatives: name -> (max side in pixels, Pillow format, quality)
+IMAGE_VARIANTS = {
+    "thumb": (320, "WEBP", 75),
+    "display": (1600, "WEBP", 85),
+}
+IMAGE_VARIANT_CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '2'))
+# Larger sources are refused rather than decoded. The image workers are
+# started fresh (forkserver or spawn) and import this module, so the limit
+# is set there as well.
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', str(50_000_000)))
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+# Thread ordering: replies past BUMP_LIMIT no longer move a thread up (0 = no limit)
+BUMP_LIMIT = int(os.environ.get('BUMP_LIMIT', '0'))
+THREAD_SORT_FIELDS = {"activity": "bumped_at", "created": "created_at"}
+
+# Archive of inactive threads
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '0'))  # 0 disables automatic archival
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', '3600'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '100'))
+ARCHIVE_MAX_BYTES = 15 * 1024 * 1024  # under Mongo's 16 MB document limit
+ARCHIVE_COMPRESSION_LEVEL = 6
+ARCHIVE_CACHE_SIZE = 64
+
+# Static snapshots of the front page and the hottest threads
+SNAPSHOTS_ENABLED = os.environ.get('SNAPSHOTS_ENABLED', 'false').lower() == 'true'
+SNAPSHOT_DIR = Path(os.environ.get('SNAPSHOT_DIR', ROOT_DIR / 'snapshots'))
+SNAPSHOT_TOP_THREADS = int(os.environ.get('SNAPSHOT_TOP_THREADS', '50'))
+SNAPSHOT_DEBOUNCE_SECONDS = float(os.environ.get('SNAPSHOT_DEBOUNCE_SECONDS', '1.0'))
+SNAPSHOT_MAX_AGE_SECONDS = int(os.environ.get('SNAPSHOT_MAX_AGE_SECONDS', '300'))
+SNAPSHOT_HTML = os.environ.get('SNAPSHOT_HTML', 'false').lower() == 'true'
+
+# Bulk export and import
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_GZIP_LEVEL = 6
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '1000'))
+IMPORT_CONCURRENCY = int(os.environ.get('IMPORT_CONCURRENCY', '4'))  # batches written at once
+IMPORT_MAX_LINE_BYTES = 16 * 1024 * 1024  # Mongo's document limit
+
+# Per-request profiles, captured for admins sending X-Profile: 1 or ?profile=1
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', ROOT_DIR / 'profiles'))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.001'))
+
+# Administration
+ADMIN_USERNAMES = {name.strip() for name in os.environ.get('ADMIN_USERNAMES', '').split(',') if name.strip()}
+
+# Pagination
+THREADS_PAGE_SIZE = 50
+THREADS_MAX_PAGE_SIZE = 100
+THREAD_SNIPPET_LENGTH = 200
+REPLIES_PAGE_SIZE = 100
+REPLIES_MAX_PAGE_SIZE = 1000
+
+# Quotes: ">>reply_id" in a reply links to an earlier reply of the thread
+QUOTE_PATTERN = re.compile(r">>([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})")
+MAX_QUOTES_PER_REPLY = 10
+PREVIEWS_MAX_IDS = 50
+
+# Response compression
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+# Sent as they are produced, or already compressed
+STREAMED_TYPES = ("text/event-stream", "application/x-ndjson", "application/gzip")
+
+# Schema migrations
+MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', '1000'))
+MIGRATION_RETRY_SECONDS = 60
+
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 security = HTTPBearer(auto_error=False)
 
+# BSON dates keep milliseconds, so new documents are stamped at that
+# precision: the copy in memory, e.g. a live event's id, then matches what a
+# read from Mongo returns
+def mongo_now() -> datetime:
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
 # Models
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     username: str
     password_hash: str
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=mongo_now)
     is_active: bool = True
 
 class UserCreate(BaseModel):
@@ -53,72 +514,1789 @@ class Thread(BaseModel):
     title: str
     content: str
     author_username: Optional[str] = None  # None for anonymous posts
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=mongo_now)
+    last_activity_at: Optional[datetime] = None
+    bumped_at: Optional[datetime] = None  # board position; stops moving past BUMP_LIMIT replies
     reply_count: int = 0
-    image_data: Optional[str] = None  # base64 encoded image
+    version: int = 1  # bumped by every reply write, see thread_validators
+    image_id: Optional[str] = None  # SHA-256 of the image in the image store
+    image_data: Optional[str] = None  # legacy inline base64 image
     image_filename: Optional[str] = None
 
 class ThreadCreate(BaseModel):
     title: str
     content: str
     author_username: Optional[str] = None
-    image_data: Optional[str] = None
+    image_id: Optional[str] = Field(default=None, pattern=IMAGE_ID_PATTERN)
     image_filename: Optional[str] = None
 
+class ThreadSummary(BaseModel):
+    id: str
+    title: str
+    snippet: str
+    author_username: Optional[str] = None
+    created_at: datetime
+    last_activity_at: Optional[datetime] = None
+    bumped_at: Optional[datetime] = None
+    reply_count: int = 0
+    image_id: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+
 class Reply(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     thread_id: str
     content: str
     author_username: Optional[str] = None  # None for anonymous posts
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    image_data: Optional[str] = None  # base64 encoded image
+    created_at: datetime = Field(default_factory=mongo_now)
+    image_id: Optional[str] = None  # SHA-256 of the image in the image store
+    image_data: Optional[str] = None  # legacy inline base64 image
     image_filename: Optional[str] = None
+    quotes: List[str] = []  # replies of the thread this one quotes, parsed once at write time
+    backlinks: List[str] = []  # replies quoting this one, added by their writes
+
+class ReplyPreview(BaseModel):
+    id: str
+    thread_id: str
+    snippet: str
+    author_username: Optional[str] = None
+    created_at: datetime
+    thumbnail_url: Optional[str] = None
+
+class ThreadWithReplies(BaseModel):
+    thread: Thread
+    replies: List[Reply]
+    next_cursor: Optional[str] = None
+
+class SearchResult(BaseModel):
+    type: str  # "thread" or "reply"
+    id: str
+    thread_id: str
+    title: Optional[str] = None
+    snippet: str
+    highlights: List[List[int]] = []  # [start, end) offsets into snippet
+    author_username: Optional[str] = None
+    created_at: datetime
+    score: float
+
+class SearchResults(BaseModel):
+    results: List[SearchResult]
+    next_cursor: Optional[str] = None
 
 class ReplyCreate(BaseModel):
     content: str
     author_username: Optional[str] = None
-    image_data: Optional[str] = None
+    image_id: Optional[str] = Field(default=None, pattern=IMAGE_ID_PATTERN)
     image_filename: Optional[str] = None
 
 # Helper functions
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
 
 def verify_password(password: str, password_hash: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
 
+def password_needs_rehash(password_hash: str) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(password_hash.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+# bcrypt releases the GIL, so a small thread pool hashes in parallel while the
+# event loop keeps serving other requests
+password_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+password_jobs_pending = 0
+
+async def run_password_job(fn, *args):
+    global password_jobs_pending
+    # Shed load instead of queueing an unbounded login burst
+    if password_jobs_pending >= BCRYPT_MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado, tente novamente",
+            headers={"Retry-After": "1"}
+        )
+    password_jobs_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, fn, *args)
+    finally:
+        password_jobs_pending -= 1
+
 def create_access_token(username: str) -> str:
     expire = datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
     payload = {
         "username": username,
-        "exp": expire
+        "exp": expire,
+        # Tokens from the same second differ, so a logout revokes only its own
+        "jti": uuid.uuid4().hex
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+# LRU of tokens whose signature was already verified; entries expire with
+# the token, and go stale after TOKEN_REVOCATION_CHECK_SECONDS so a logout on
+# another worker is noticed. revoked only holds this worker's recent finds.
+class TokenCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # token -> (username, exp timestamp, monotonic check time)
+        self.revoked = {}  # token -> exp timestamp
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[str]:
+        entry = self.entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        username, expires_at, checked_at = entry
+        if expires_at <= time.time() or time.monotonic() - checked_at > TOKEN_REVOCATION_CHECK_SECONDS:
+            del self.entries[token]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(token)
+        self.hits += 1
+        return username
+
+    def put(self, token: str, username: str, expires_at: float):
+        if self.maxsize <= 0 or token in self.revoked:
+            return
+        self.entries[token] = (username, expires_at, time.monotonic())
+        self.entries.move_to_end(token)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def revoke(self, token: str, expires_at: float):
+        self.entries.pop(token, None)
+        now = time.time()
+        # Revocations only matter until the token would have expired anyway
+        for revoked_token in [t for t, exp in self.revoked.items() if exp <= now]:
+            del self.revoked[revoked_token]
+        self.revoked[token] = expires_at
+
+    def is_revoked(self, token: str) -> bool:
+        return token in self.revoked
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revoked": len(self.revoked)
+        }
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+# Revocations are shared through Mongo, so a logout holds on every worker.
+# Documents are keyed by the token's hash and expire with the token through
+# the TTL index, like rate limit windows.
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+async def revoke_token(token: str, expires_at: float):
+    token_cache.revoke(token, expires_at)
+    await db.revoked_tokens.update_one(
+        {"_id": token_key(token)},
+        {"$setOnInsert": {"expires_at": datetime.fromtimestamp(expires_at, timezone.utc)}},
+        upsert=True
+    )
+
+def decode_access_token(token: str):
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM], options={"require": ["exp"]})
+    except jwt.ExpiredSignatureError:
+        return None
+    except jwt.InvalidTokenError:
+        return None
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Optional[str]:
     if not credentials:
         return None
-    try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        username = payload.get("username")
+    return await username_for_token(credentials.credentials)
+
+async def username_for_token(token: str) -> Optional[str]:
+    if token_cache.is_revoked(token):
+        return None
+    username = token_cache.get(token)
+    if username is not None:
         return username
-    except jwt.ExpiredSignatureError:
+    
+    payload = decode_access_token(token)
+    if not payload:
         return None
-    except jwt.InvalidTokenError:
+    username = payload.get("username")
+    if not username:
+        return None
+    if await db.revoked_tokens.find_one({"_id": token_key(token)}, {"_id": 1}):
+        token_cache.revoke(token, payload["exp"])
         return None
+    token_cache.put(token, username, payload["exp"])
+    return username
 
-def prepare_for_mongo(data):
-    if isinstance(data, dict):
-        if 'created_at' in data and isinstance(data['created_at'], datetime):
-            data['created_at'] = data['created_at'].isoformat()
-    return data
+async def require_admin(current_user: Optional[str] = Depends(get_current_user)) -> str:
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    if current_user not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
+    return current_user
 
+# Only needed for documents written before created_at became a BSON date
 def parse_from_mongo(item):
     if isinstance(item, dict):
         if 'created_at' in item and isinstance(item['created_at'], str):
             item['created_at'] = datetime.fromisoformat(item['created_at'])
     return item
 
+# Opaque keyset cursors over (created_at, id)
+def encode_cursor(created_at, item_id: str) -> str:
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    raw = json.dumps([created_at, item_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, item_id = json.loads(raw)
+        if not isinstance(item_id, str):
+            raise ValueError(cursor)
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return created_at, item_id
+
+# Migrations this worker has seen finished; see run_migrations
+finished_migrations = set()
+
+# Filter for documents strictly after ("$gt") or before ("$lt") the cursor
+# on the (field, id) ordering
+def keyset_filter(cursor: str, op: str, field: str = "created_at"):
+    # A date cursor never matches created_at values still stored as strings,
+    # and an activity cursor skips threads the backfill has not given a
+    # bumped_at yet
+    required = {MIGRATION_CREATED_AT, MIGRATION_BUMPED_AT} if field == "bumped_at" else {MIGRATION_CREATED_AT}
+    if not required <= finished_migrations:
+        raise HTTPException(
+            status_code=503,
+            detail="Paginação indisponível durante uma migração de dados",
+            headers={"Retry-After": "30"}
+        )
+    position, item_id = decode_cursor(cursor)
+    return {"$or": [
+        {field: {op: position}},
+        {field: position, "id": {op: item_id}}
+    ]}
+
+# Conditional requests. Read responses carry validators and "no-cache", so
+# clients revalidate every view and get an empty 304 when nothing changed.
+def content_validators(body: bytes) -> dict:
+    etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    return {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+
+def thread_validators(thread_data) -> dict:
+    # version moves with every reply write, so it covers the thread, its
+    # counters and its replies. Documents from before it existed count as 0.
+    # There is no Last-Modified: two replies within one second would share
+    # it, and the second would be answered with a 304. Archiving keeps the
+    # version but changes the body, so it changes the tag too.
+    state = ".a" if thread_data.get("archived") else ""
+    return {"ETag": f'"{thread_data["id"]}.{thread_data.get("version", 0)}{state}"', "Cache-Control": "no-cache"}
+
+def is_not_modified(request: Request, headers: dict) -> bool:
+    # Tags compare weakly since compression weakens them
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return headers["ETag"].removeprefix("W/") in tags
+
+# Projection for the thread list: heavy fields stay in the database
+THREAD_LIST_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "title": 1,
+    "content": 1,
+    "author_username": 1,
+    "created_at": 1,
+    "last_activity_at": 1,
+    "bumped_at": 1,
+    "reply_count": 1,
+    "image_id": 1
+}
+
+# Public shapes of the read endpoints: field -> value for documents written
+# before the field existed, as the models' defaults. Only these fields leave
+# the database, and every one of them is present in the response.
+THREAD_FIELDS = {
+    "id": None,
+    "title": None,
+    "content": None,
+    "author_username": None,
+    "created_at": None,
+    "last_activity_at": None,
+    "bumped_at": None,
+    "reply_count": 0,
+    "version": 1,
+    "image_id": None,
+    "image_data": None,  # legacy inline images, still rendered by the frontend
+    "image_filename": None,
+}
+REPLY_FIELDS = {
+    "id": None,
+    "thread_id": None,
+    "content": None,
+    "author_username": None,
+    "created_at": None,
+    "image_id": None,
+    "image_data": None,
+    "image_filename": None,
+    "quotes": (),
+    "backlinks": (),
+}
+THREAD_PROJECTION = {"_id": 0, **dict.fromkeys(THREAD_FIELDS, 1)}
+REPLY_PROJECTION = {"_id": 0, **dict.fromkeys(REPLY_FIELDS, 1)}
+# Covered by the (thread_id, created_at, id) index
+REPLY_KEY_PROJECTION = {"_id": 0, "id": 1, "created_at": 1}
+
+def public_thread(item) -> dict:
+    item = parse_from_mongo(item)
+    return {field: item.get(field, default) for field, default in THREAD_FIELDS.items()}
+
+def public_reply(item) -> dict:
+    item = parse_from_mongo(item)
+    return {field: item.get(field, default) for field, default in REPLY_FIELDS.items()}
+
+# The models' JSON format: UTC datetimes end in "Z", as Pydantic writes them
+JSON_OPTIONS = orjson.OPT_UTC_Z
+
+def json_bytes(content) -> bytes:
+    return orjson.dumps(content, option=JSON_OPTIONS)
+
+class APIJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        return json_bytes(content)
+
+# Just enough of a thread to answer a conditional request
+THREAD_VERSION_PROJECTION = {"_id": 0, "id": 1, "version": 1, "created_at": 1, "last_activity_at": 1}
+
+# Builds the ThreadSummary shape as a plain dict, without model validation
+def thread_summary_from_mongo(item) -> dict:
+    item = parse_from_mongo(item)
+    image_id = item.get("image_id")
+    return {
+        "id": item["id"],
+        "title": item["title"],
+        "snippet": item.get("content", "")[:THREAD_SNIPPET_LENGTH],
+        "author_username": item.get("author_username"),
+        "created_at": item["created_at"],
+        "last_activity_at": item.get("last_activity_at"),
+        "bumped_at": item.get("bumped_at"),
+        "reply_count": item.get("reply_count", 0),
+        "image_id": image_id,
+        "thumbnail_url": f"/api/images/{image_id}/thumb" if image_id else None
+    }
+
+REPLY_PREVIEW_PROJECTION = {"_id": 0, "id": 1, "thread_id": 1, "content": 1, "author_username": 1, "created_at": 1, "image_id": 1}
+
+def reply_preview_from_mongo(item) -> dict:
+    item = parse_from_mongo(item)
+    image_id = item.get("image_id")
+    return {
+        "id": item["id"],
+        "thread_id": item["thread_id"],
+        "snippet": item.get("content", "")[:THREAD_SNIPPET_LENGTH],
+        "author_username": item.get("author_username"),
+        "created_at": item["created_at"],
+        "thumbnail_url": f"/api/images/{image_id}/thumb" if image_id else None
+    }
+
+# Indexes each route relies on, created and verified at startup
+INDEXES = {
+    "users": [
+        IndexModel([("username", 1)], unique=True, name="username_unique"),
+    ],
+    "threads": [
+        IndexModel([("id", 1)], unique=True, name="id_unique"),
+        IndexModel([("created_at", -1), ("id", -1)], name="created_at_id"),
+        IndexModel([("bumped_at", -1), ("id", -1)], name="bumped_at_id"),
+        IndexModel(
+            [("title", TEXT), ("content", TEXT)],
+            weights={"title": 3, "content": 1},
+            default_language="portuguese",
+            name="text_search"
+        ),
+    ],
+    "replies": [
+        IndexModel([("id", 1)], unique=True, name="id_unique"),
+        IndexModel([("thread_id", 1), ("created_at", 1), ("id", 1)], name="thread_created_at_id"),
+        IndexModel([("content", TEXT)], default_language="portuguese", name="text_search"),
+    ],
+    "images": [
+        IndexModel([("id", 1)], unique=True, name="id_unique"),
+    ],
+    "threads_archive": [
+        IndexModel([("id", 1)], unique=True, name="id_unique"),
+        IndexModel([("replies_purged", 1)], name="replies_purged"),
+    ],
+    "slow_requests": [
+        IndexModel([("recorded_at", 1)], expireAfterSeconds=SLOW_REQUEST_RETENTION_DAYS * 86400, name="recorded_at_ttl"),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", 1)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "revoked_tokens": [
+        IndexModel([("expires_at", 1)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+}
+if IMAGE_STORE != 'local':
+    # GridFS files of the image store are named by SHA-256; one copy each
+    INDEXES["images.files"] = [IndexModel([("filename", 1)], unique=True, name="filename_unique")]
+
+async def ensure_indexes():
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        try:
+            await collection.create_indexes(indexes)
+        except OperationFailure as e:
+            # e.g. duplicate usernames left over from before the unique index
+            logger.error(f"Could not create indexes on {collection_name}: {e}")
+        existing = await collection.index_information()
+        missing = [index.document["name"] for index in indexes if index.document["name"] not in existing]
+        if missing:
+            logger.error(f"Missing indexes on {collection_name}: {', '.join(missing)}")
+
+# created_at for a string that does not parse: the ObjectId's creation time
+# if there is one. The original string is kept in created_at_raw.
+def fallback_created_at(doc) -> datetime:
+    if isinstance(doc["_id"], ObjectId):
+        return doc["_id"].generation_time
+    return datetime.fromtimestamp(0, timezone.utc)
+
+# Resumable: each batch only selects documents that still hold a string, and
+# progress is recorded so an interrupted run picks up where it stopped
+MIGRATION_CREATED_AT = "created_at_to_date"
+
+async def migrate_created_at_to_dates():
+    migration_id = MIGRATION_CREATED_AT
+    state = await db.migrations.find_one({"_id": migration_id})
+    if state and state.get("done"):
+        return
+    
+    for collection_name in ("users", "threads", "replies", "images"):
+        collection = db[collection_name]
+        while True:
+            batch = await collection.find(
+                {"created_at": {"$type": "string"}},
+                {"_id": 1, "created_at": 1}
+            ).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
+            if not batch:
+                break
+            updates = []
+            malformed = 0
+            for doc in batch:
+                update = {"$set": {}}
+                try:
+                    update["$set"]["created_at"] = datetime.fromisoformat(doc["created_at"])
+                except ValueError:
+                    logger.error(f"Unparseable created_at {doc['created_at']!r} on {collection_name} {doc['_id']}")
+                    update["$set"]["created_at"] = fallback_created_at(doc)
+                    update["$set"]["created_at_raw"] = doc["created_at"]
+                    malformed += 1
+                updates.append(UpdateOne({"_id": doc["_id"], "created_at": doc["created_at"]}, update))
+            await collection.bulk_write(updates, ordered=False)
+            await db.migrations.update_one(
+                {"_id": migration_id},
+                {"$inc": {f"converted.{collection_name}": len(batch), f"malformed.{collection_name}": malformed}},
+                upsert=True
+            )
+    
+    await db.migrations.update_one(
+        {"_id": migration_id},
+        {"$set": {"done": True, "finished_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    logger.info("Migrated created_at fields to BSON dates")
+
+# Threads from before bump ordering get their last activity as board position.
+# Runs after the date migration so created_at is always a date here.
+MIGRATION_BUMPED_AT = "bumped_at_backfill"
+
+async def backfill_bumped_at() -> bool:
+    migration_id = MIGRATION_BUMPED_AT
+    state = await db.migrations.find_one({"_id": migration_id})
+    if state and state.get("done"):
+        return False
+    await fill_missing_bumped_at(migration_id)
+    await db.migrations.update_one(
+        {"_id": migration_id},
+        {"$set": {"done": True, "finished_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    logger.info("Backfilled bumped_at on threads")
+    return True
+
+# Also run after an import, which can bring in threads from before bumped_at
+async def fill_missing_bumped_at(migration_id: str = MIGRATION_BUMPED_AT):
+    while True:
+        batch = await db.threads.find(
+            {"bumped_at": {"$exists": False}},
+            {"_id": 1, "created_at": 1, "last_activity_at": 1}
+        ).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
+        if not batch:
+            break
+        await db.threads.bulk_write([
+            UpdateOne(
+                {"_id": doc["_id"], "bumped_at": {"$exists": False}},
+                {"$set": {
+                    "last_activity_at": doc.get("last_activity_at") or doc["created_at"],
+                    "bumped_at": doc.get("last_activity_at") or doc["created_at"]
+                }}
+            )
+            for doc in batch
+        ], ordered=False)
+        await db.migrations.update_one(
+            {"_id": migration_id},
+            {"$inc": {"converted.threads": len(batch)}},
+            upsert=True
+        )
+
+# Every step is resumable, so a failed run is retried from where it stopped
+async def run_migrations():
+    while True:
+        try:
+            await migrate_created_at_to_dates()
+            finished_migrations.add(MIGRATION_CREATED_AT)
+            if await backfill_bumped_at():
+                # The catalog was loaded before old threads had a board position
+                await thread_catalog.load()
+            finished_migrations.add(MIGRATION_BUMPED_AT)
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"Migrations failed, retrying in {MIGRATION_RETRY_SECONDS}s")
+            await asyncio.sleep(MIGRATION_RETRY_SECONDS)
+
+# Pre-serialized front page in board order (most recently bumped first).
+# Writes patch it in place so a front page read is a memory lookup. With
+# CATALOG_SHARED the entries are mirrored in one Mongo document and other
+# workers resync when its version moves.
+def board_position(entry):
+    return (entry.get("bumped_at") or entry["created_at"], entry["id"])
+
+class ThreadCatalog:
+    def __init__(self, size: int, shared: bool):
+        self.size = size
+        self.shared = shared
+        self.entries = []  # ThreadSummary dicts
+        self.encoded = []  # JSON bytes, parallel to entries
+        self.pages = {}  # limit -> (encoded JSON array, validators)
+        self.version = 0
+        self.last_sync = 0.0
+
+    def _set_entries(self, entries, version: int):
+        self.entries = entries
+        self.encoded = [json_bytes(entry) for entry in entries]
+        self.pages = {}
+        self.version = version
+
+    def _entry_index(self, thread_id: str) -> Optional[int]:
+        for index, entry in enumerate(self.entries):
+            if entry["id"] == thread_id:
+                return index
+        return None
+
+    # Moves or inserts an entry at its board position; returns the position,
+    # or None when it falls off the end
+    def _place(self, entry) -> Optional[int]:
+        index = self._entry_index(entry["id"])
+        if index is not None:
+            del self.entries[index], self.encoded[index]
+        position = 0
+        while position < len(self.entries) and board_position(self.entries[position]) > board_position(entry):
+            position += 1
+        self.pages = {}
+        self.version += 1
+        if position >= self.size:
+            return None
+        self.entries.insert(position, entry)
+        self.encoded.insert(position, json_bytes(entry))
+        del self.entries[self.size:], self.encoded[self.size:]
+        return position
+
+    async def load(self, rebuild: bool = False):
+        threads_data = await db.threads.find({}, THREAD_LIST_PROJECTION).sort(
+            [("bumped_at", -1), ("id", -1)]
+        ).limit(self.size).to_list(self.size)
+        entries = [thread_summary_from_mongo(thread_data) for thread_data in threads_data]
+        if not self.shared:
+            self._set_entries(entries, self.version + 1)
+            self.last_sync = time.monotonic()
+            return
+        # An existing catalog document is only trusted while it matches
+        # threads; one left stale by a crashed writer or a restored database
+        # is rebuilt
+        doc = await db.catalog.find_one({"_id": "front_page"})
+        if doc and not rebuild and doc["entries"] == entries:
+            self._set_entries(doc["entries"], doc["version"])
+        else:
+            result = await db.catalog.find_one_and_update(
+                {"_id": "front_page"},
+                {"$set": {"entries": entries}, "$inc": {"version": 1}},
+                projection={"version": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            self._set_entries(entries, result["version"])
+        self.last_sync = time.monotonic()
+
+    # Adopts the shared document as written by another worker
+    async def reload(self):
+        doc = await db.catalog.find_one({"_id": "front_page"})
+        if doc:
+            self._set_entries(doc["entries"], doc["version"])
+        else:
+            await self.load()
+        self.last_sync = time.monotonic()
+
+    async def sync(self):
+        # Cheap version probe at most once per interval
+        if not self.shared or time.monotonic() - self.last_sync < CATALOG_SYNC_INTERVAL:
+            return
+        self.last_sync = time.monotonic()
+        doc = await db.catalog.find_one({"_id": "front_page"}, {"version": 1})
+        if doc and doc["version"] != self.version:
+            await self.reload()
+
+    async def add_thread(self, thread: Thread):
+        entry = thread_summary_from_mongo(thread.dict())
+        self._place(entry)
+        if self.shared:
+            result = await db.catalog.find_one_and_update(
+                {"_id": "front_page"},
+                {"$push": {"entries": {"$each": [entry], "$position": 0, "$slice": self.size}}, "$inc": {"version": 1}},
+                projection={"version": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            self.version = result["version"]
+
+    # The threads below the catalog are only in Mongo, so a removal refills
+    # the catalog from there instead of leaving it a thread short
+    async def remove_thread(self, thread_id: str):
+        if self.shared or self._entry_index(thread_id) is not None:
+            await self.load()
+
+    # entry is the thread's summary as it now stands, e.g. after a reply write
+    async def update_thread(self, entry):
+        position = self._place(entry)
+        if not self.shared:
+            return
+        if position == 0:
+            # A bump: move the entry to the front in one atomic pipeline update
+            query = {"_id": "front_page"}
+            update = [{"$set": {
+                "entries": {"$slice": [
+                    {"$concatArrays": [
+                        {"$literal": [entry]},
+                        {"$filter": {"input": "$entries", "cond": {"$ne": ["$$this.id", entry["id"]]}}}
+                    ]},
+                    self.size
+                ]},
+                "version": {"$add": ["$version", 1]}
+            }}]
+        else:
+            # Past the bump limit the entry only changes where it is
+            query = {"_id": "front_page", "entries.id": entry["id"]}
+            update = {"$set": {"entries.$": entry}, "$inc": {"version": 1}}
+        result = await db.catalog.find_one_and_update(
+            query, update, projection={"version": 1}, return_document=ReturnDocument.AFTER
+        )
+        if not result and position is not None:
+            # Not on the shared front page yet, e.g. a thread another worker
+            # trimmed off: insert it in board order and trim
+            result = await db.catalog.find_one_and_update(
+                {"_id": "front_page", "entries.id": {"$ne": entry["id"]}},
+                {"$push": {"entries": {
+                    "$each": [entry], "$sort": {"bumped_at": -1, "id": -1}, "$slice": self.size
+                }}, "$inc": {"version": 1}},
+                projection={"version": 1},
+                return_document=ReturnDocument.AFTER
+            )
+        if result:
+            self.version = result["version"]
+
+    def page(self, limit: int):
+        cached = self.pages.get(limit)
+        if cached is None:
+            body = b"[" + b",".join(self.encoded[:limit]) + b"]"
+            cached = self.pages[limit] = (body, content_validators(body))
+        body, validators = cached
+        last = self.entries[limit - 1] if len(self.entries) >= limit else None
+        next_cursor = encode_cursor(*board_position(last)) if last else None
+        return body, next_cursor, validators
+
+thread_catalog = ThreadCatalog(THREADS_MAX_PAGE_SIZE, CATALOG_SHARED)
+
+# In-process fan-out of new replies to open event streams. Each subscriber
+# has a bounded queue; a subscriber that falls behind is disconnected and
+# resumes from Mongo with its Last-Event-ID.
+class ThreadEventBroker:
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self.subscribers = {}  # thread_id -> set of queues
+
+    def subscribe(self, thread_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.buffer_size)
+        self.subscribers.setdefault(thread_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, thread_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(thread_id)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[thread_id]
+
+    def has_subscribers(self, thread_id: str) -> bool:
+        return thread_id in self.subscribers
+
+    def publish(self, thread_id: str, reply: dict, reply_count: int):
+        queues = self.subscribers.get(thread_id)
+        if not queues:
+            return
+        event = (reply, reply_count)
+        for queue in list(queues):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Drop the backlog and tell the stream to close
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                queues.discard(queue)
+        if not queues:
+            del self.subscribers[thread_id]
+
+thread_events = ThreadEventBroker(EVENT_BUFFER_SIZE)
+
+def format_reply_event(reply: dict, reply_count: int) -> str:
+    data = json_bytes({"reply": reply, "reply_count": reply_count}).decode('utf-8')
+    return f"id: {encode_cursor(reply['created_at'], reply['id'])}\nevent: reply\ndata: {data}\n\n"
+
+# Multi-worker fan-out: every worker tails reply inserts and feeds its own broker
+async def watch_reply_inserts():
+    resume_token = None
+    while True:
+        try:
+            async with db.replies.watch(
+                [{"$match": {"operationType": "insert"}}],
+                resume_after=resume_token
+            ) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    reply_data = change["fullDocument"]
+                    thread_id = reply_data["thread_id"]
+                    if not thread_events.has_subscribers(thread_id):
+                        continue
+                    thread_data = await db.threads.find_one({"id": thread_id}, {"_id": 0, "reply_count": 1})
+                    reply_count = thread_data["reply_count"] if thread_data else 0
+                    thread_events.publish(thread_id, public_reply(reply_data), reply_count)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Reply change stream failed, retrying: {e}")
+            await asyncio.sleep(1)
+
+# Thread update for count replies written up to replied_at. Past BUMP_LIMIT
+# replies the thread still records activity but keeps its board position.
+def reply_counter_update(count: int, replied_at: datetime):
+    if not BUMP_LIMIT:
+        return {
+            "$inc": {"reply_count": count, "version": 1},
+            "$max": {"last_activity_at": replied_at, "bumped_at": replied_at}
+        }
+    # Pipeline form, so the bump can depend on the count before this write
+    reply_count = {"$ifNull": ["$reply_count", 0]}
+    return [{"$set": {
+        "reply_count": {"$add": [reply_count, count]},
+        "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+        "last_activity_at": {"$max": ["$last_activity_at", replied_at]},
+        "bumped_at": {"$cond": [
+            {"$lt": [reply_count, BUMP_LIMIT]},
+            {"$max": ["$bumped_at", replied_at]},
+            "$bumped_at"
+        ]}
+    }}]
+
+# Quoted ids that name existing replies of the thread, in order of first use
+async def resolve_quotes(thread_id: str, content: str) -> List[str]:
+    quoted = list(dict.fromkeys(QUOTE_PATTERN.findall(content)))[:MAX_QUOTES_PER_REPLY]
+    if not quoted:
+        return []
+    found = set(await db.replies.distinct("id", {"thread_id": thread_id, "id": {"$in": quoted}}))
+    return [reply_id for reply_id in quoted if reply_id in found]
+
+# Backlinks are kept on the quoted replies, so reads need no extra work.
+# Like the reply itself they are written before the thread's version moves.
+# They are best-effort: a failed update is logged and never fails the
+# replies whose writes already succeeded.
+async def link_quotes(replies: List[Reply], remove: bool = False):
+    operator = "$pull" if remove else "$addToSet"
+    updates = [
+        UpdateOne({"id": quoted_id, "thread_id": reply.thread_id}, {operator: {"backlinks": reply.id}})
+        for reply in replies for quoted_id in reply.quotes
+    ]
+    if not updates:
+        return
+    try:
+        await db.replies.bulk_write(updates, ordered=False)
+    except Exception:
+        logger.exception(f"Could not {'remove' if remove else 'add'} {len(updates)} backlinks")
+
+# Everything that follows a successful reply write, for one or more replies
+# of the same thread; thread_data is the thread as the write left it, in
+# THREAD_LIST_PROJECTION
+async def after_replies_written(thread_data, replies: List[Reply]):
+    thread_id = thread_data["id"]
+    reply_count = thread_data["reply_count"]
+    await thread_catalog.update_thread(thread_summary_from_mongo(thread_data))
+    snapshot_writer.invalidate(thread_id)
+    if EVENTS_BACKEND == 'local':
+        first_count = reply_count - len(replies) + 1
+        for offset, reply in enumerate(replies):
+            thread_events.publish(thread_id, reply.dict(), first_count + offset)
+
+# Collects replies for a short window and writes them with one insert_many
+# plus one $inc per thread, so a reply storm on a hot thread does not turn
+# into one contended update per reply
+class ReplyWriteBatcher:
+    def __init__(self, window_ms: int, max_size: int):
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.pending = []  # (Reply, future)
+        self.timer = None
+        self.flushes = set()  # running flush tasks
+        self.known_threads = OrderedDict()
+
+    async def thread_exists(self, thread_id: str) -> bool:
+        if thread_id in self.known_threads:
+            self.known_threads.move_to_end(thread_id)
+            return True
+        if not await db.threads.find_one({"id": thread_id}, {"_id": 0, "id": 1}):
+            return False
+        self.known_threads[thread_id] = True
+        if len(self.known_threads) > KNOWN_THREADS_CACHE_SIZE:
+            self.known_threads.popitem(last=False)
+        return True
+
+    def submit(self, reply: Reply) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        # Under enqueue durability nobody awaits the future; flush logs failures
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.pending.append((reply, future))
+        if len(self.pending) >= self.max_size:
+            self._start_flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self._start_flush)
+        return future
+
+    def _start_flush(self):
+        task = asyncio.create_task(self.flush())
+        self.flushes.add(task)
+        task.add_done_callback(self.flushes.discard)
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        
+        # Unordered inserts go on past a failed document, so only the replies
+        # named in writeErrors fail and the rest are counted as usual
+        failures = {}  # batch index -> exception
+        try:
+            await db.replies.insert_many([reply.dict() for reply, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failures[write_error["index"]] = e
+            if not failures:
+                failures = dict.fromkeys(range(len(batch)), e)
+        except Exception as e:
+            failures = dict.fromkeys(range(len(batch)), e)
+        if failures:
+            logger.error(f"{len(failures)} of {len(batch)} batched replies failed: {next(iter(failures.values()))}")
+            for index, error in failures.items():
+                future = batch[index][1]
+                if not future.done():
+                    future.set_exception(error)
+            batch = [item for index, item in enumerate(batch) if index not in failures]
+            if not batch:
+                return
+        
+        try:
+            await link_quotes([reply for reply, _ in batch])
+            by_thread = defaultdict(list)
+            for reply, _ in batch:
+                by_thread[reply.thread_id].append(reply)
+            # One coalesced counter update per thread in the batch
+            updated = await asyncio.gather(*[
+                db.threads.find_one_and_update(
+                    {"id": thread_id},
+                    reply_counter_update(len(replies), replies[-1].created_at),
+                    projection=THREAD_LIST_PROJECTION,
+                    return_document=ReturnDocument.AFTER
+                )
+                for thread_id, replies in by_thread.items()
+            ])
+            # Threads archived since thread_exists cached them take their replies back out
+            gone = {thread_id for thread_id, thread_data in zip(by_thread, updated) if not thread_data}
+            if gone:
+                orphans = [reply for reply, _ in batch if reply.thread_id in gone]
+                await db.replies.delete_many({"id": {"$in": [reply.id for reply in orphans]}})
+                await link_quotes(orphans, remove=True)
+                for thread_id in gone:
+                    self.known_threads.pop(thread_id, None)
+        except Exception as e:
+            logger.error(f"Reply batch of {len(batch)} failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for reply, future in batch:
+            if not future.done():
+                if reply.thread_id in gone:
+                    future.set_exception(HTTPException(status_code=404, detail="Tópico não encontrado"))
+                else:
+                    future.set_result(None)
+        for replies, thread_data in zip(by_thread.values(), updated):
+            if thread_data:
+                await after_replies_written(thread_data, replies)
+
+reply_batcher = ReplyWriteBatcher(REPLY_BATCH_WINDOW_MS, REPLY_BATCH_MAX_SIZE)
+
+# Archive. Threads inactive for ARCHIVE_AFTER_DAYS move with their replies
+# into threads_archive, one zlib-compressed BSON document per thread, which
+# keeps the hot collections and their indexes small. Archived threads stay
+# readable through the normal routes and an admin can restore them.
+ARCHIVE_CODEC_OPTIONS = CodecOptions(tz_aware=True)
+
+def pack_archive(thread_data, replies) -> bytes:
+    return zlib.compress(bson.encode({"thread": thread_data, "replies": replies}), ARCHIVE_COMPRESSION_LEVEL)
+
+def unpack_archive(data: bytes):
+    doc = bson.decode(zlib.decompress(data), codec_options=ARCHIVE_CODEC_OPTIONS)
+    return doc["thread"], doc["replies"]
+
+# Decoded archives stay in a small LRU per worker. A restore or re-archive
+# on any worker changes the archive document, so every read probes its
+# version and archived_at first and only decodes when they moved.
+ARCHIVE_VERSION_PROJECTION = {"_id": 0, "version": 1, "archived_at": 1}
+
+class ArchiveReader:
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = OrderedDict()  # thread id -> ((version, archived_at), (thread, replies, reply sort keys))
+
+    async def get(self, thread_id: str):
+        doc = await read_db.threads_archive.find_one({"id": thread_id}, ARCHIVE_VERSION_PROJECTION)
+        if not doc:
+            self.forget(thread_id)
+            return None
+        key = (doc.get("version"), doc["archived_at"])
+        cached = self.entries.get(thread_id)
+        if cached is not None and cached[0] == key:
+            self.entries.move_to_end(thread_id)
+            return cached[1]
+        doc = await read_db.threads_archive.find_one({"id": thread_id}, {"_id": 0, "data": 1, **ARCHIVE_VERSION_PROJECTION})
+        if not doc:
+            self.forget(thread_id)
+            return None
+        thread_data, replies = await run_in_threadpool(unpack_archive, doc["data"])
+        thread_data = {**public_thread(thread_data), "archived": True}
+        replies = [public_reply(reply_data) for reply_data in replies]
+        entry = (thread_data, replies, [(reply["created_at"], reply["id"]) for reply in replies])
+        self.entries[thread_id] = ((doc.get("version"), doc["archived_at"]), entry)
+        self.entries.move_to_end(thread_id)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return entry
+
+    def forget(self, thread_id: str):
+        self.entries.pop(thread_id, None)
+
+archive_reader = ArchiveReader(ARCHIVE_CACHE_SIZE)
+
+async def purge_archived_replies(thread_id: str):
+    await db.replies.delete_many({"thread_id": thread_id})
+    await db.threads_archive.update_one({"id": thread_id}, {"$set": {"replies_purged": True}})
+
+async def archive_thread(thread_id: str) -> bool:
+    thread_data = await db.threads.find_one({"id": thread_id}, {"_id": 0})
+    if not thread_data:
+        return False
+    replies = await db.replies.find({"thread_id": thread_id}, {"_id": 0}).sort(
+        [("created_at", 1), ("id", 1)]
+    ).to_list(None)
+    data = await run_in_threadpool(pack_archive, thread_data, replies)
+    if len(data) > ARCHIVE_MAX_BYTES:
+        logger.warning(f"Thread {thread_id} is too large to archive ({len(data)} bytes compressed)")
+        return False
+    
+    version = thread_data.get("version")
+    await db.threads_archive.replace_one({"id": thread_id}, {
+        "id": thread_id,
+        "title": thread_data["title"],
+        "created_at": thread_data["created_at"],
+        "last_activity_at": thread_data.get("last_activity_at"),
+        "reply_count": len(replies),
+        "version": version,
+        "archived_at": datetime.now(timezone.utc),
+        "replies_purged": False,
+        "data": data
+    }, upsert=True)
+    
+    # A reply written since the read moved the version: the thread stays hot.
+    # Reply writes that lose the race find no thread and undo themselves.
+    deleted = await db.threads.delete_one({"id": thread_id, "version": version})
+    if not deleted.deleted_count:
+        if await db.threads.find_one({"id": thread_id}, {"_id": 1}):
+            await db.threads_archive.delete_one({"id": thread_id, "version": version})
+        return False
+    
+    await purge_archived_replies(thread_id)
+    await thread_catalog.remove_thread(thread_id)
+    reply_batcher.known_threads.pop(thread_id, None)
+    snapshot_writer.invalidate(thread_id)
+    return True
+
+async def restore_thread(thread_id: str) -> bool:
+    doc = await db.threads_archive.find_one({"id": thread_id}, {"_id": 0, "data": 1})
+    if not doc:
+        return False
+    thread_data, replies = await run_in_threadpool(unpack_archive, doc["data"])
+    # Replies first, so the thread never shows up without them
+    for start in range(0, len(replies), MIGRATION_BATCH_SIZE):
+        await db.replies.bulk_write([
+            ReplaceOne({"id": reply["id"]}, reply, upsert=True)
+            for reply in replies[start:start + MIGRATION_BATCH_SIZE]
+        ], ordered=False)
+    await db.threads.replace_one({"id": thread_id}, thread_data, upsert=True)
+    await db.threads_archive.delete_one({"id": thread_id})
+    archive_reader.forget(thread_id)
+    await thread_catalog.update_thread(thread_summary_from_mongo(thread_data))
+    snapshot_writer.schedule(thread_id, SNAPSHOT_FRONT)
+    return True
+
+# Archives written before a restart interrupted the purge of their replies.
+# One whose thread is still hot lost the race to a reply and is dropped.
+async def finish_interrupted_archives():
+    async for doc in db.threads_archive.find({"replies_purged": False}, {"_id": 0, "id": 1}):
+        if await db.threads.find_one({"id": doc["id"]}, {"_id": 1}):
+            await db.threads_archive.delete_one({"id": doc["id"], "replies_purged": False})
+        else:
+            await purge_archived_replies(doc["id"])
+
+async def archive_inactive_threads() -> int:
+    # Both fields, since bumped_at stops moving past BUMP_LIMIT; the
+    # bumped_at_id index narrows the scan
+    cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    threads_data = await db.threads.find(
+        {"bumped_at": {"$lt": cutoff}, "last_activity_at": {"$lt": cutoff}},
+        {"_id": 0, "id": 1}
+    ).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+    archived = 0
+    for thread_data in threads_data:
+        if await archive_thread(thread_data["id"]):
+            archived += 1
+    return archived
+
+async def run_archiver():
+    while True:
+        try:
+            await finish_interrupted_archives()
+            # Keep going while there is a backlog, then idle until the next pass
+            while await archive_inactive_threads() == ARCHIVE_BATCH_SIZE:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Archive pass failed: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+# Bulk export and import. Collections move as NDJSON (gzip-compressed on
+# export, either way on import) streamed straight from and into Motor
+# cursors, so memory stays flat however large the board is. Imports upsert
+# by key, which makes replaying part of a file harmless: progress is
+# reported as a line count to resume from.
+EXPORT_COLLECTIONS = {
+    # name -> (key field, projection, datetime fields)
+    "users": ("username", {"_id": 0, "password_hash": 0}, ("created_at",)),
+    "threads": ("id", {"_id": 0}, ("created_at", "last_activity_at", "bumped_at")),
+    "replies": ("id", {"_id": 0}, ("created_at",)),
+}
+# Replies before threads, so a thread never shows up without them
+IMPORT_ORDER = ("users", "replies", "threads")
+
+class DataImportError(Exception):
+    def __init__(self, line: int, resume_from: int, reason: str):
+        super().__init__(f"line {line}: {reason}")
+        self.line = line
+        self.resume_from = resume_from
+        self.reason = reason
+
+async def export_documents(name: str):
+    _, projection, _ = EXPORT_COLLECTIONS[name]
+    async for doc in db[name].find({}, projection).batch_size(EXPORT_BATCH_SIZE):
+        yield doc
+    if name == "users":
+        return
+    # Archived threads go out unpacked, flagged so the import archives them
+    # again. Reading the archive after the live collection also catches
+    # threads archived meanwhile.
+    async for archived in db.threads_archive.find({}, {"_id": 0, "data": 1}).batch_size(16):
+        thread_data, replies = await run_in_threadpool(unpack_archive, archived["data"])
+        if name == "threads":
+            yield {**thread_data, "archived": True}
+        else:
+            for reply_data in replies:
+                yield reply_data
+
+async def export_ndjson_gz(name: str):
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    async for doc in export_documents(name):
+        chunk = compressor.compress(orjson.dumps(doc) + b"\n")
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+async def ndjson_lines(chunks):
+    decompressor = None
+    pending = b""
+    first = True
+    async for chunk in chunks:
+        if first and chunk:
+            first = False
+            if chunk.startswith(b"\x1f\x8b"):
+                decompressor = zlib.decompressobj(31)
+        if decompressor is not None:
+            data = decompressor.decompress(chunk)
+            # Concatenated gzip files hold one member each
+            while decompressor.eof and decompressor.unused_data:
+                rest = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+                data += decompressor.decompress(rest)
+            chunk = data
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        if len(pending) > IMPORT_MAX_LINE_BYTES:
+            raise ValueError("line too long")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+def decode_import_document(name: str, line: bytes) -> dict:
+    key, _, datetime_fields = EXPORT_COLLECTIONS[name]
+    doc = orjson.loads(line)
+    if not isinstance(doc, dict) or not isinstance(doc.get(key), str):
+        raise ValueError(f"missing {key}")
+    doc.pop("_id", None)
+    if name == "users":
+        doc.pop("password_hash", None)
+    for field in datetime_fields:
+        if isinstance(doc.get(field), str):
+            doc[field] = datetime.fromisoformat(doc[field])
+    return doc
+
+async def write_import_batch(name: str, docs):
+    key = EXPORT_COLLECTIONS[name][0]
+    # The export's flag for archived threads is not a stored field
+    archived_ids = {doc["id"] for doc in docs if doc.pop("archived", False)}
+    # $set keeps fields the export leaves out, like password hashes
+    await db[name].bulk_write(
+        [UpdateOne({key: doc[key]}, {"$set": doc}, upsert=True) for doc in docs],
+        ordered=False
+    )
+    if name == "threads":
+        # A live thread drops any archived copy of it. An archived one goes
+        # back into the archive with the replies imported before it; a rerun
+        # after an interruption in between archives it again.
+        live_ids = [doc["id"] for doc in docs if doc["id"] not in archived_ids]
+        await db.threads_archive.delete_many({"id": {"$in": live_ids}})
+        for thread_id in live_ids:
+            archive_reader.forget(thread_id)
+            reply_batcher.known_threads.pop(thread_id, None)
+        for thread_id in archived_ids:
+            if not await archive_thread(thread_id):
+                logger.warning(f"Imported thread {thread_id} could not be archived again and stays live")
+
+# Imports the NDJSON lines of an async byte stream, skipping the first
+# `skip` lines. IMPORT_CONCURRENCY batches are written at once and reading
+# waits for a free slot. `checkpoint` is awaited with the number of lines
+# known to be written, so a rerun can skip them.
+async def import_documents(name: str, chunks, skip: int = 0, checkpoint=None) -> dict:
+    slots = asyncio.Semaphore(IMPORT_CONCURRENCY)
+    in_flight = deque()  # (lines up to the end of the batch, task), in file order
+    committed = skip
+    imported = 0
+    
+    async def write(docs):
+        try:
+            await write_import_batch(name, docs)
+        finally:
+            slots.release()
+    
+    async def settle(wait: bool):
+        nonlocal committed
+        while in_flight and (wait or in_flight[0][1].done()):
+            end, task = in_flight.popleft()
+            try:
+                await task
+            except Exception as exc:
+                raise DataImportError(end, committed, str(exc)) from exc
+            committed = end
+            if checkpoint is not None:
+                await checkpoint(committed)
+    
+    async def submit(docs, end: int):
+        await slots.acquire()
+        in_flight.append((end, asyncio.create_task(write(docs))))
+        await settle(wait=False)
+    
+    line_number = 0
+    batch = []
+    failure = None  # (line, reason) for the first line that could not be read
+    try:
+        try:
+            async for line in ndjson_lines(chunks):
+                line_number += 1
+                if line_number <= skip or not line.strip():
+                    continue
+                try:
+                    batch.append(decode_import_document(name, line))
+                except ValueError as exc:
+                    failure = (line_number, str(exc))
+                    break
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    imported += len(batch)
+                    await submit(batch, line_number)
+                    batch = []
+        except (ValueError, zlib.error) as exc:
+            # Unreadable stream: corrupt compression or an overlong line
+            failure = (line_number + 1, str(exc))
+        if batch:
+            imported += len(batch)
+            await submit(batch, failure[0] - 1 if failure else line_number)
+        # Started batches land first, so the resume point covers them
+        await settle(wait=True)
+    except BaseException:
+        await asyncio.gather(*(task for _, task in in_flight), return_exceptions=True)
+        raise
+    if failure is not None:
+        raise DataImportError(failure[0], committed, failure[1])
+    return {"collection": name, "imported": imported, "lines": max(line_number, committed)}
+
+async def finish_import(name: str):
+    if name == "users":
+        return
+    if name == "threads":
+        await fill_missing_bumped_at()
+    await thread_catalog.load(rebuild=True)
+    for entry in thread_catalog.entries[:SNAPSHOT_TOP_THREADS]:
+        snapshot_writer.invalidate(entry["id"])
+    snapshot_writer.schedule_all()
+
+# Static snapshots. The front page and the SNAPSHOT_TOP_THREADS hottest
+# threads are pre-rendered to SNAPSHOT_DIR (JSON, plus HTML with
+# SNAPSHOT_HTML) so a web server or the thread page route can send them
+# without reading the thread's replies. Files are replaced atomically and
+# re-rendered a debounce window after a write. A thread's JSON is gzipped
+# and named after the thread version it was rendered from, so the page
+# route only sends it after the version probe agrees, whichever worker or
+# host wrote since.
+SNAPSHOT_FRONT = "front"
+SNAPSHOT_ID_PATTERN = re.compile(r"^[0-9a-f-]{36}$")
+
+def write_file_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", delete=False) as tmp:
+        tmp.write(data)
+    os.replace(tmp.name, path)
+
+SNAPSHOT_HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="pt-BR">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>{title} - Brigada Paulista</title>
+<style>
+body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; max-width: 900px; margin: 0 auto; padding: 1rem; color: #212529; line-height: 1.6; }}
+h1 {{ border-bottom: 3px solid #dc143c; padding-bottom: 0.5rem; }}
+article {{ border: 1px solid #ced4da; border-radius: 8px; padding: 1rem; margin-bottom: 1rem; }}
+.meta {{ color: #495057; font-size: 0.9rem; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+def render_snapshot_post(author, created_at, content) -> str:
+    created_at = created_at.isoformat() if isinstance(created_at, datetime) else created_at
+    return (
+        f'<article><p class="meta">{html.escape(author or "Anônimo")} · {html.escape(str(created_at))}</p>'
+        f'<p>{html.escape(content)}</p></article>'
+    )
+
+def render_thread_html(page) -> bytes:
+    thread = page["thread"]
+    posts = [render_snapshot_post(thread.get("author_username"), thread["created_at"], thread["content"])]
+    posts += [
+        render_snapshot_post(reply.get("author_username"), reply["created_at"], reply["content"])
+        for reply in page["replies"]
+    ]
+    return SNAPSHOT_HTML_TEMPLATE.format(title=html.escape(thread["title"]), body="\n".join(posts)).encode("utf-8")
+
+def render_front_html(entries) -> bytes:
+    items = [
+        f'<article><a href="threads/{entry["id"]}.html">{html.escape(entry["title"])}</a>'
+        f'<p class="meta">{entry["reply_count"]} respostas</p><p>{html.escape(entry["snippet"])}</p></article>'
+        for entry in entries
+    ]
+    return SNAPSHOT_HTML_TEMPLATE.format(title="Fórum da Brigada Paulista", body="\n".join(items)).encode("utf-8")
+
+class SnapshotWriter:
+    def __init__(self, directory: Path, debounce: float):
+        self.directory = directory
+        self.debounce = debounce
+        self.pending = set()  # thread ids and SNAPSHOT_FRONT
+        self.timer = None
+
+    def thread_path(self, thread_id: str, suffix: str = "json") -> Path:
+        return self.directory / "threads" / f"{thread_id}.{suffix}"
+
+    def version_path(self, thread_id: str, version: int) -> Path:
+        return self.thread_path(thread_id, f"{version}.json.gz")
+
+    # Paths of a thread's JSON snapshots, oldest version first
+    def version_paths(self, thread_id: str) -> List[Path]:
+        versions = []
+        for path in (self.directory / "threads").glob(f"{thread_id}.*.json.gz"):
+            version = path.name[len(thread_id) + 1:-len(".json.gz")]
+            if version.isdigit():
+                versions.append((int(version), path))
+        return [path for _, path in sorted(versions)]
+
+    def thread_snapshot(self, thread_id: str, version: int):
+        if not SNAPSHOTS_ENABLED or not SNAPSHOT_ID_PATTERN.match(thread_id):
+            return None
+        path = self.version_path(thread_id, version)
+        try:
+            return path, path.stat()
+        except FileNotFoundError:
+            return None
+
+    def invalidate(self, thread_id: str):
+        # The write moved the thread's version, which has no snapshot until
+        # this re-render, so readers go to Mongo meanwhile
+        self.schedule(thread_id, SNAPSHOT_FRONT)
+
+    def schedule(self, *keys):
+        if not SNAPSHOTS_ENABLED:
+            return
+        self.pending.update(keys)
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.debounce, self._start_flush)
+
+    def _start_flush(self):
+        task = asyncio.create_task(self.flush())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    # Drops renders that have not started; the next start renders everything
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.pending.clear()
+
+    def schedule_all(self):
+        self.schedule(SNAPSHOT_FRONT, *[entry["id"] for entry in thread_catalog.entries[:SNAPSHOT_TOP_THREADS]])
+
+    async def flush(self):
+        self.timer = None
+        keys, self.pending = self.pending, set()
+        hot = {entry["id"] for entry in thread_catalog.entries[:SNAPSHOT_TOP_THREADS]}
+        for key in keys:
+            try:
+                if key == SNAPSHOT_FRONT:
+                    await self.write_front()
+                elif key in hot:
+                    await self.write_thread(key)
+                else:
+                    await run_in_threadpool(self.remove_thread, key)
+            except Exception as e:
+                logger.error(f"Snapshot of {key} failed: {e}")
+
+    async def write_front(self):
+        body, _, _ = thread_catalog.page(THREADS_PAGE_SIZE)
+        await run_in_threadpool(write_file_atomic, self.directory / "front.json", body)
+        if SNAPSHOT_HTML:
+            html_body = render_front_html(thread_catalog.entries[:THREADS_PAGE_SIZE])
+            await run_in_threadpool(write_file_atomic, self.directory / "index.html", html_body)
+
+    async def write_thread(self, thread_id: str):
+        thread_data = await db.threads.find_one({"id": thread_id}, THREAD_PROJECTION)
+        if not thread_data:
+            await run_in_threadpool(self.remove_thread, thread_id)
+            return
+        # Read after the thread, so the replies are at least as new as the
+        # version the file is named after
+        replies, next_cursor, _ = await fetch_replies_page(thread_id, limit=REPLIES_PAGE_SIZE)
+        page = {"thread": public_thread(thread_data), "replies": replies, "next_cursor": next_cursor}
+        if SNAPSHOT_HTML:
+            await run_in_threadpool(write_file_atomic, self.thread_path(thread_id, "html"), render_thread_html(page))
+        await run_in_threadpool(self.write_version, thread_id, thread_data.get("version", 0), json_bytes(page))
+
+    def write_version(self, thread_id: str, version: int, body: bytes):
+        write_file_atomic(self.version_path(thread_id, version), gzip.compress(body, compresslevel=GZIP_LEVEL))
+        # The previous version stays for requests that probed just before
+        for path in self.version_paths(thread_id)[:-2]:
+            path.unlink(missing_ok=True)
+
+    def remove_thread(self, thread_id: str):
+        self.thread_path(thread_id, "html").unlink(missing_ok=True)
+        for path in self.version_paths(thread_id):
+            path.unlink(missing_ok=True)
+
+snapshot_writer = SnapshotWriter(SNAPSHOT_DIR, SNAPSHOT_DEBOUNCE_SECONDS)
+
+# Re-renders the hot set every SNAPSHOT_MAX_AGE_SECONDS / 2, picking up
+# threads that moved into it and writes a debounce missed
+async def refresh_snapshots():
+    while True:
+        snapshot_writer.schedule_all()
+        await asyncio.sleep(SNAPSHOT_MAX_AGE_SECONDS / 2)
+
+# Image store
+class GridFSImageStore:
+    def __init__(self, database):
+        self.database = database
+        self.bucket = AsyncIOMotorGridFSBucket(database, bucket_name="images")
+
+    async def put(self, image_id: str, source):
+        # File names are unique (see INDEXES), so the loser of a concurrent
+        # duplicate upload only has its own chunks to clean up
+        file_id = ObjectId()
+        try:
+            await self.bucket.upload_from_stream_with_id(file_id, image_id, source)
+        except FileExists:
+            # Raised for the duplicate key on filename; file_id is always new
+            await self.database["images.chunks"].delete_many({"files_id": file_id})
+
+    async def read_range(self, image_id: str, start: int, end: int):
+        stream = await self.bucket.open_download_stream_by_name(image_id)
+        stream.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await stream.read(min(IMAGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+class LocalImageStore:
+    def __init__(self, root: Path):
+        self.root = root
+
+    def _path(self, image_id: str) -> Path:
+        return self.root / image_id[:2] / image_id
+
+    def _write(self, image_id: str, source):
+        path = self._path(image_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{image_id}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(source, f, IMAGE_CHUNK_SIZE)
+        os.replace(tmp_path, path)
+
+    async def put(self, image_id: str, source):
+        await run_in_threadpool(self._write, image_id, source)
+
+    async def read_range(self, image_id: str, start: int, end: int):
+        f = await run_in_threadpool(open, self._path(image_id), 'rb')
+        try:
+            await run_in_threadpool(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await run_in_threadpool(f.read, min(IMAGE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+if IMAGE_STORE == 'local':
+    image_store = LocalImageStore(IMAGE_STORE_PATH)
+else:
+    image_store = GridFSImageStore(db)
+
+# source is a binary file object positioned anywhere; image_id is its SHA-256
+async def save_image(source, image_id: str, size: int, content_type: str) -> str:
+    # Identical uploads share one blob
+    if await db.images.find_one({"id": image_id}, {"_id": 0, "id": 1}):
+        return image_id
+    source.seek(0)
+    await image_store.put(image_id, source)
+    await db.images.update_one(
+        {"id": image_id},
+        {"$setOnInsert": {
+            "id": image_id,
+            "content_type": content_type,
+            "size": size,
+            "created_at": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+    return image_id
+
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+
+# Trust the magic bytes, not the client-supplied content type
+def sniff_image_type(header: bytes) -> Optional[str]:
+    for signature, content_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+# Receives the "file" part of a multipart upload chunk by chunk: hashes it
+# incrementally and spools it to a temp file once it outgrows memory
+class ImageUploadSink:
+    def __init__(self):
+        self.hasher = hashlib.sha256()
+        self.spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD)
+        self.size = 0
+        self.header = b''
+        self.filename = None
+        self.found = False
+        self.too_large = False
+        self._in_file = False
+        self._headers = {}
+        self._header_size = 0
+        self._field = b''
+        self._value = b''
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._header_size = 0
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._field += data[start:end]
+        self._count_header_bytes(end - start)
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+        self._count_header_bytes(end - start)
+
+    # A part's headers are buffered whole, so they get a cap of their own
+    def _count_header_bytes(self, size: int):
+        self._header_size += size
+        if self._header_size > UPLOAD_PART_HEADER_MAX_BYTES:
+            raise ValueError("multipart headers too large")
+
+    def on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = self._value = b''
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        # Only the first "file" part is taken
+        self._in_file = options.get(b'name') == b'file' and not self.found
+        if self._in_file:
+            self.found = True
+            self.filename = options.get(b'filename', b'').decode('utf-8', 'replace')
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if not self._in_file or self.too_large:
+            return
+        chunk = data[start:end]
+        self.size += len(chunk)
+        if self.size > UPLOAD_MAX_BYTES:
+            self.too_large = True
+            return
+        if len(self.header) < 16:
+            self.header += chunk[:16 - len(self.header)]
+        self.hasher.update(chunk)
+        self.spool.write(chunk)
+
+    def on_part_end(self):
+        self._in_file = False
+
+async def receive_image_upload(request: Request) -> ImageUploadSink:
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    boundary = params.get(b'boundary')
+    if content_type != b'multipart/form-data' or not boundary:
+        raise HTTPException(status_code=400, detail="Envie a imagem como multipart/form-data")
+    
+    # Refuse oversized bodies before reading any of them
+    body_limit = UPLOAD_MAX_BYTES + UPLOAD_MULTIPART_OVERHEAD
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > body_limit:
+        raise HTTPException(status_code=413, detail="Imagem muito grande")
+    
+    sink = ImageUploadSink()
+    parser = MultipartParser(boundary, callbacks={
+        'on_part_begin': sink.on_part_begin,
+        'on_header_field': sink.on_header_field,
+        'on_header_value': sink.on_header_value,
+        'on_header_end': sink.on_header_end,
+        'on_headers_finished': sink.on_headers_finished,
+        'on_part_data': sink.on_part_data,
+        'on_part_end': sink.on_part_end,
+    })
+    received = 0
+    try:
+        async for chunk in request.stream():
+            upload_bytes_total.inc(amount=len(chunk))
+            # Stop reading as soon as the cap is crossed. The whole body
+            # counts, since a chunked one has no Content-Length to check and
+            # its other parts would otherwise be read without a limit.
+            received += len(chunk)
+            if received > body_limit:
+                raise HTTPException(status_code=413, detail="Imagem muito grande")
+            parser.write(chunk)
+            if sink.too_large:
+                raise HTTPException(status_code=413, detail="Imagem muito grande")
+        parser.finalize()
+    except HTTPException:
+        sink.spool.close()
+        raise
+    except Exception:
+        sink.spool.close()
+        raise HTTPException(status_code=400, detail="Upload inválido")
+    return sink
+
+# Runs in a worker process: decode, apply EXIF orientation, shrink and
+# re-encode. Metadata such as EXIF is not carried over to the output.
+def render_image_variant(data: bytes, max_side: int, image_format: str, quality: int) -> bytes:
+    with Image.open(BytesIO(data)) as image:
+        # Pillow itself only refuses twice MAX_IMAGE_PIXELS
+        if image.width * image.height > IMAGE_MAX_PIXELS:
+            raise Image.DecompressionBombError(f"{image.width}x{image.height} exceeds {IMAGE_MAX_PIXELS} pixels")
+        image = ImageOps.exif_transpose(image)
+        if image_format == "JPEG":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image.thumbnail((max_side, max_side))
+        output = BytesIO()
+        image.save(output, format=image_format, quality=quality)
+        return output.getvalue()
+
+# Created lazily so importing the module never starts processes. Workers
+# are not forked from this process, which by then runs Motor's and bcrypt's
+# threads: forking a threaded process can leave a lock held in the child.
+image_pool = None
+variant_jobs = {}  # (image_id, variant) -> running task
+background_tasks = set()
+
+async def read_image_bytes(image_id: str, size: int) -> bytes:
+    return b"".join([chunk async for chunk in image_store.read_range(image_id, 0, size - 1)])
+
+async def _generate_variant(image: dict, variant: str) -> Optional[str]:
+    global image_pool
+    if image_pool is None:
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context(start_method))
+    max_side, image_format, quality = IMAGE_VARIANTS[variant]
+    data = await read_image_bytes(image["id"], image["size"])
+    try:
+        output = await asyncio.get_running_loop().run_in_executor(
+            image_pool, render_image_variant, data, max_side, image_format, quality
+        )
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        # Pillow cannot decode this source; remember that instead of retrying
+        # the render on every request
+        logger.warning(f"Could not render {variant} for image {image['id']}: {e}")
+        await db.images.update_one({"id": image["id"]}, {"$set": {f"variants.{variant}": {"error": True}}})
+        return None
+    variant_id = hashlib.sha256(output).hexdigest()
+    await save_image(BytesIO(output), variant_id, len(output), IMAGE_VARIANT_CONTENT_TYPES[image_format])
+    await db.images.update_one({"id": variant_id}, {"$set": {"variant_of": image["id"]}})
+    await db.images.update_one({"id": image["id"]}, {"$set": {f"variants.{variant}": variant_id}})
+    return variant_id
+
+# Derivatives are cached per source hash in the image document, as the
+# variant's image id or {"error": True} for a source that cannot be rendered.
+# Returns None for the latter.
+async def ensure_image_variant(image: dict, variant: str) -> Optional[str]:
+    variant_id = image.get("variants", {}).get(variant)
+    if isinstance(variant_id, dict):
+        return None
+    if variant_id:
+        return variant_id
+    key = (image["id"], variant)
+    # Concurrent requests for the same derivative share one render
+    job = variant_jobs.get(key)
+    if job is None:
+        job = asyncio.ensure_future(_generate_variant(image, variant))
+        variant_jobs[key] = job
+        job.add_done_callback(lambda _: variant_jobs.pop(key, None))
+    return await asyncio.shield(job)
+
+async def generate_image_variants(image_id: str):
+    image = await db.images.find_one({"id": image_id}, {"_id": 0})
+    if image:
+        for variant in IMAGE_VARIANTS:
+            try:
+                await ensure_image_variant(image, variant)
+            except Exception:
+                # The next request for the variant retries the render
+                logger.exception(f"Rendering {variant} for image {image_id} failed")
+
+# Returns (start, end) for a single byte range, None for the full body
+def parse_range_header(range_header: Optional[str], size: int):
+    if not range_header or not range_header.startswith('bytes='):
+        return None
+    spec = range_header[len('bytes='):].strip()
+    if ',' in spec:
+        return None  # multipart ranges are not supported, serve the full body
+    start_str, _, end_str = spec.partition('-')
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+        else:
+            start = size - int(end_str)
+            end = size - 1
+    except ValueError:
+        return None
+    start = max(start, 0)
+    end = min(end, size - 1)
+    if start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Intervalo inválido",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
 # Routes
 @api_router.get("/")
 async def root():
@@ -133,10 +2311,14 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Usuário já existe")
     
     # Create new user
-    password_hash = hash_password(user_data.password)
+    password_hash = await run_password_job(hash_password, user_data.password)
     user = User(username=user_data.username, password_hash=password_hash)
-    user_dict = prepare_for_mongo(user.dict())
-    await db.users.insert_one(user_dict)
+    user_dict = user.dict()
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        # Lost a concurrent registration race on the unique username index
+        raise HTTPException(status_code=400, detail="Usuário já existe")
     
     # Create access token
     access_token = create_access_token(user.username)
@@ -151,16 +2333,28 @@ async def register(user_data: UserCreate):
 async def login(credentials: UserLogin):
     # Find user
     user_data = await db.users.find_one({"username": credentials.username})
-    if not user_data:
+    # Users brought in by a data import have no password until one is set
+    if not user_data or not user_data.get("password_hash"):
         raise HTTPException(status_code=401, detail="Credenciais inválidas")
     
     user_data = parse_from_mongo(user_data)
     user = User(**user_data)
     
     # Verify password
-    if not verify_password(credentials.password, user.password_hash):
+    if not await run_password_job(verify_password, credentials.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Credenciais inválidas")
     
+    # Upgrade the stored hash when the configured cost has changed
+    if password_needs_rehash(user.password_hash):
+        try:
+            new_hash = await run_password_job(hash_password, credentials.password)
+            await db.users.update_one(
+                {"username": user.username, "password_hash": user.password_hash},
+                {"$set": {"password_hash": new_hash}}
+            )
+        except HTTPException:
+            pass  # Busy; try again on the next login
+    
     # Create access token
     access_token = create_access_token(user.username)
     
@@ -170,6 +2364,19 @@ async def login(credentials: UserLogin):
         "username": user.username
     }
 
+@api_router.post("/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = decode_access_token(credentials.credentials) if credentials else None
+    if not payload:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    
+    await revoke_token(credentials.credentials, payload["exp"])
+    return {"message": "Logout realizado com sucesso"}
+
+@api_router.get("/token-cache/stats")
+async def get_token_cache_stats(admin: str = Depends(require_admin)):
+    return token_cache.stats()
+
 @api_router.get("/me")
 async def get_current_user_info(current_user: Optional[str] = Depends(get_current_user)):
     if not current_user:
@@ -185,83 +2392,1029 @@ async def create_thread(thread_data: ThreadCreate, current_user: Optional[str] =
         thread_data.author_username = current_user
     
     thread = Thread(**thread_data.dict())
-    thread_dict = prepare_for_mongo(thread.dict())
+    thread.last_activity_at = thread.bumped_at = thread.created_at
+    thread_dict = thread.dict()
     await db.threads.insert_one(thread_dict)
+    await thread_catalog.add_thread(thread)
+    snapshot_writer.schedule(thread.id, SNAPSHOT_FRONT)
     
     return {"message": "Tópico criado com sucesso", "thread_id": thread.id}
 
-@api_router.get("/threads", response_model=List[Thread])
-async def get_threads():
-    threads_data = await db.threads.find().sort("created_at", -1).to_list(100)
-    threads = []
-    for thread_data in threads_data:
-        thread_data = parse_from_mongo(thread_data)
-        threads.append(Thread(**thread_data))
-    return threads
+@api_router.get("/threads", response_model=List[ThreadSummary])
+async def get_threads(
+    request: Request,
+    before: Optional[str] = None,
+    limit: int = Query(THREADS_PAGE_SIZE, ge=1, le=THREADS_MAX_PAGE_SIZE),
+    sort: str = Query("activity", pattern="^(activity|created)$")
+):
+    # The bump-ordered front page comes straight from the materialized catalog, validators included
+    if not before and sort == "activity":
+        await thread_catalog.sync()
+        body, next_cursor, headers = thread_catalog.page(limit)
+        if next_cursor:
+            headers = {**headers, "X-Next-Cursor": next_cursor}
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+    
+    # Seek past the cursor on the (bumped_at, id) or (created_at, id) index
+    # instead of skipping; cursors are only valid for the sort they came from
+    field = THREAD_SORT_FIELDS[sort]
+    query = keyset_filter(before, "$lt", field) if before else {}
+    
+    threads_data = await read_db.threads.find(query, THREAD_LIST_PROJECTION).sort(
+        [(field, -1), ("id", -1)]
+    ).limit(limit).to_list(limit)
+    threads = [thread_summary_from_mongo(thread_data) for thread_data in threads_data]
+    
+    # Older pages have no cheap version to check, so they only save the transfer
+    body = json_bytes(threads)
+    headers = content_validators(body)
+    if len(threads) == limit:
+        last = threads[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last[field] or last["created_at"], last["id"])
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @api_router.get("/threads/{thread_id}", response_model=Thread)
-async def get_thread(thread_id: str):
-    thread_data = await db.threads.find_one({"id": thread_id})
+async def get_thread(thread_id: str, request: Request):
+    # Probe the version first; the full document is only read when it changed
+    thread_version = await read_db.threads.find_one({"id": thread_id}, THREAD_VERSION_PROJECTION)
+    if not thread_version:
+        # Archived threads are served from the archive, read-only
+        archived = await archive_reader.get(thread_id)
+        if not archived:
+            raise HTTPException(status_code=404, detail="Tópico não encontrado")
+        headers = thread_validators(archived[0])
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        return APIJSONResponse(archived[0], headers=headers)
+    headers = thread_validators(thread_version)
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    
+    thread_data = await read_db.threads.find_one({"id": thread_id}, THREAD_PROJECTION)
     if not thread_data:
         raise HTTPException(status_code=404, detail="Tópico não encontrado")
     
-    thread_data = parse_from_mongo(thread_data)
-    return Thread(**thread_data)
+    return APIJSONResponse(public_thread(thread_data), headers=thread_validators(thread_data))
 
 @api_router.post("/threads/{thread_id}/replies")
 async def create_reply(thread_id: str, reply_data: ReplyCreate, current_user: Optional[str] = Depends(get_current_user)):
-    # Check if thread exists
-    thread_data = await db.threads.find_one({"id": thread_id})
-    if not thread_data:
-        raise HTTPException(status_code=404, detail="Tópico não encontrado")
-    
     # If user is logged in, use their username, otherwise allow anonymous
     if current_user:
         reply_data.author_username = current_user
     
     reply = Reply(thread_id=thread_id, **reply_data.dict())
-    reply_dict = prepare_for_mongo(reply.dict())
-    await db.replies.insert_one(reply_dict)
+    if ">>" in reply.content:
+        reply.quotes = await resolve_quotes(thread_id, reply.content)
+    
+    if REPLY_WRITE_MODE == 'batched':
+        if not await reply_batcher.thread_exists(thread_id):
+            raise await missing_thread_error(thread_id)
+        written = reply_batcher.submit(reply)
+        if REPLY_DURABILITY == 'flush':
+            await written
+        return {"message": "Resposta criada com sucesso", "reply_id": reply.id, "reply": reply}
     
-    # Update thread reply count
-    await db.threads.update_one(
+    # The reply goes in before the thread's version moves, so a reader never
+    # caches a version without its reply. Checking that the thread exists and
+    # bumping its counters is one conditional update.
+    reply_dict = reply.dict()
+    await db.replies.insert_one(reply_dict)
+    await link_quotes([reply])
+    updated_thread = await db.threads.find_one_and_update(
         {"id": thread_id},
-        {"$inc": {"reply_count": 1}}
+        reply_counter_update(1, reply.created_at),
+        projection=THREAD_LIST_PROJECTION,
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_thread:
+        await db.replies.delete_one({"id": reply.id})
+        await link_quotes([reply], remove=True)
+        raise await missing_thread_error(thread_id)
+    
+    await after_replies_written(updated_thread, [reply])
+    
+    return {"message": "Resposta criada com sucesso", "reply_id": reply.id, "reply": reply}
+
+async def fetch_replies_page(
+    thread_id: str,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = REPLIES_PAGE_SIZE,
+    database=db,
+    session=None,
+    projection=REPLY_PROJECTION
+):
+    query = {"thread_id": thread_id}
+    if before:
+        query.update(keyset_filter(before, "$lt"))
+        sort_order = -1
+    else:
+        if after:
+            query.update(keyset_filter(after, "$gt"))
+        sort_order = 1
     
-    return {"message": "Resposta criada com sucesso", "reply_id": reply.id}
+    # One extra row tells whether another page exists in the direction of travel
+    replies = await database.replies.find(query, projection, session=session).sort(
+        [("created_at", sort_order), ("id", sort_order)]
+    ).limit(limit + 1).to_list(limit + 1)
+    has_more = len(replies) > limit
+    replies = [public_reply(reply_data) for reply_data in replies[:limit]]
+    if before:
+        replies.reverse()
+    return (replies,) + reply_page_cursors(replies, after, before, has_more)
+
+def reply_page_cursors(replies, after: Optional[str], before: Optional[str], has_more: bool):
+    next_cursor = prev_cursor = None
+    if replies:
+        first, last = replies[0], replies[-1]
+        if before or has_more:
+            next_cursor = encode_cursor(last["created_at"], last["id"])
+        if after or (before and has_more):
+            prev_cursor = encode_cursor(first["created_at"], first["id"])
+    return next_cursor, prev_cursor
+
+# Same paging over an archived thread's replies, held in memory in order
+def archived_replies_page(archived, after: Optional[str] = None, before: Optional[str] = None, limit: int = REPLIES_PAGE_SIZE):
+    _, all_replies, keys = archived
+    if before:
+        end = bisect.bisect_left(keys, decode_cursor(before))
+        start = max(0, end - limit)
+        has_more = start > 0
+    else:
+        start = bisect.bisect_right(keys, decode_cursor(after)) if after else 0
+        end = start + limit
+        has_more = end < len(all_replies)
+    replies = all_replies[start:end]
+    return (replies,) + reply_page_cursors(replies, after, before, has_more)
+
+async def missing_thread_error(thread_id: str) -> HTTPException:
+    if await db.threads_archive.find_one({"id": thread_id}, {"_id": 1}):
+        return HTTPException(status_code=409, detail="Tópico arquivado")
+    return HTTPException(status_code=404, detail="Tópico não encontrado")
+
+async def stream_archived_replies_ndjson(archived, after: Optional[str], limit: Optional[int]):
+    replies, _, _ = archived_replies_page(archived, after=after, limit=limit or len(archived[1]))
+    for reply_data in replies:
+        yield json_bytes(reply_data) + b"\n"
+
+async def stream_replies_ndjson(query, limit: Optional[int]):
+    cursor = read_db.replies.find(query, REPLY_PROJECTION).sort([("created_at", 1), ("id", 1)])
+    if limit:
+        cursor = cursor.limit(limit)
+    async for reply_data in cursor:
+        yield json_bytes(public_reply(reply_data)) + b"\n"
 
 @api_router.get("/threads/{thread_id}/replies", response_model=List[Reply])
-async def get_replies(thread_id: str):
-    replies_data = await db.replies.find({"thread_id": thread_id}).sort("created_at", 1).to_list(1000)
-    replies = []
+async def get_replies(
+    thread_id: str,
+    request: Request,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=REPLIES_MAX_PAGE_SIZE),
+    stream: bool = False
+):
+    if after and before:
+        raise HTTPException(status_code=400, detail="Use apenas um cursor")
+    
+    # NDJSON mode writes replies as the cursor yields them, without a page cap
+    if stream:
+        if before:
+            raise HTTPException(status_code=400, detail="Streaming só avança a partir de 'after'")
+        if after:
+            decode_cursor(after)
+        if not await read_db.threads.find_one({"id": thread_id}, {"_id": 1}):
+            archived = await archive_reader.get(thread_id)
+            if archived:
+                return StreamingResponse(
+                    stream_archived_replies_ndjson(archived, after, limit), media_type="application/x-ndjson"
+                )
+        # Built before the response starts, so a cursor the migrations cannot
+        # serve yet is still answered with a 503
+        query = {"thread_id": thread_id}
+        if after:
+            query.update(keyset_filter(after, "$gt"))
+        return StreamingResponse(stream_replies_ndjson(query, limit), media_type="application/x-ndjson")
+    
+    # Any page of replies is unchanged while the thread version is. The
+    # version is read first, so the page is at least as new as its tag.
+    headers = {}
+    async with read_session() as session:
+        thread_version = await read_db.threads.find_one({"id": thread_id}, THREAD_VERSION_PROJECTION, session=session)
+        archived = None if thread_version else await archive_reader.get(thread_id)
+        if archived:
+            thread_version = archived[0]
+        if thread_version:
+            headers = thread_validators(thread_version)
+        # A 304 still carries the page's cursors, which then only need the
+        # index keys of its replies
+        not_modified = bool(headers) and is_not_modified(request, headers)
+        
+        if archived:
+            replies, next_cursor, prev_cursor = archived_replies_page(
+                archived, after=after, before=before, limit=limit or REPLIES_PAGE_SIZE
+            )
+        else:
+            replies, next_cursor, prev_cursor = await fetch_replies_page(
+                thread_id, after=after, before=before, limit=limit or REPLIES_PAGE_SIZE,
+                database=read_db, session=session,
+                projection=REPLY_KEY_PROJECTION if not_modified else REPLY_PROJECTION
+            )
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if prev_cursor:
+        headers["X-Prev-Cursor"] = prev_cursor
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return APIJSONResponse(replies, headers=headers)
+
+async def archived_thread_page(thread_id: str, request: Request, limit: int):
+    archived = await archive_reader.get(thread_id)
+    if not archived:
+        raise HTTPException(status_code=404, detail="Tópico não encontrado")
+    thread_data = archived[0]
+    headers = thread_validators(thread_data)
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    replies, next_cursor, _ = archived_replies_page(archived, limit=limit)
+    return APIJSONResponse(
+        {"thread": thread_data, "replies": replies, "next_cursor": next_cursor},
+        headers=headers
+    )
+
+# Hover previews for quoted replies, any number in one request. Replies of
+# an archived thread are found through thread_id.
+@api_router.get("/replies/previews", response_model=List[ReplyPreview])
+async def get_reply_previews(
+    ids: List[str] = Query([], max_length=PREVIEWS_MAX_IDS),
+    thread_id: Optional[str] = None
+):
+    wanted = list(dict.fromkeys(ids))
+    found = {
+        reply_data["id"]: reply_data
+        async for reply_data in read_db.replies.find({"id": {"$in": wanted}}, REPLY_PREVIEW_PROJECTION)
+    }
+    if thread_id and len(found) < len(wanted):
+        archived = await archive_reader.get(thread_id)
+        if archived:
+            for reply_data in archived[1]:
+                if reply_data["id"] in wanted:
+                    found.setdefault(reply_data["id"], reply_data)
+    previews = [reply_preview_from_mongo(found[reply_id]) for reply_id in wanted if reply_id in found]
+    # Hot replies never change once written, but the archived fallback can
+    # answer differently after a restore or a re-archive, so shared caches
+    # keep previews only briefly
+    return APIJSONResponse(previews, headers={"Cache-Control": "public, max-age=60"})
+
+@api_router.get("/threads/{thread_id}/page", response_model=ThreadWithReplies)
+async def get_thread_page(
+    thread_id: str,
+    request: Request,
+    limit: int = Query(REPLIES_PAGE_SIZE, ge=1, le=REPLIES_MAX_PAGE_SIZE)
+):
+    async with read_session() as session:
+        thread_version = await read_db.threads.find_one({"id": thread_id}, THREAD_VERSION_PROJECTION, session=session)
+        if not thread_version:
+            return await archived_thread_page(thread_id, request, limit)
+        headers = thread_validators(thread_version)
+        if is_not_modified(request, headers):
+            return Response(status_code=304, headers=headers)
+        
+        # Hot threads are sent from the gzipped snapshot of this version as
+        # is; CompressionMiddleware leaves encoded bodies alone
+        snapshot = None
+        if limit == REPLIES_PAGE_SIZE and accepts_encoding(request.headers.get("accept-encoding", ""), "gzip"):
+            snapshot = snapshot_writer.thread_snapshot(thread_id, thread_version.get("version", 0))
+        if snapshot:
+            path, stat_result = snapshot
+            headers = {**headers, "ETag": "W/" + headers["ETag"], "Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+            return FileResponse(path, media_type="application/json", headers=headers, stat_result=stat_result)
+        
+        # Both reads start after the probe, so the body is at least as new as
+        # its tag even when a reply lands in between
+        thread_query = read_db.threads.find_one({"id": thread_id}, THREAD_PROJECTION, session=session)
+        replies_query = fetch_replies_page(thread_id, limit=limit, database=read_db, session=session)
+        if session is None:
+            # Thread and first page of replies queried concurrently
+            thread_data, (replies, next_cursor, _) = await asyncio.gather(thread_query, replies_query)
+        else:
+            # A session runs one operation at a time
+            thread_data = await thread_query
+            replies, next_cursor, _ = await replies_query
+    if not thread_data:
+        raise HTTPException(status_code=404, detail="Tópico não encontrado")
+    
+    return APIJSONResponse(
+        {"thread": public_thread(thread_data), "replies": replies, "next_cursor": next_cursor},
+        headers=headers
+    )
+
+@api_router.get("/threads/{thread_id}/events")
+async def get_thread_events(thread_id: str, request: Request, last_event_id: Optional[str] = Header(None)):
+    if not await db.threads.find_one({"id": thread_id}, {"_id": 1}):
+        # Archived threads get no new replies; a 204 tells EventSource to
+        # stop reconnecting
+        if await db.threads_archive.find_one({"id": thread_id}, {"_id": 1}):
+            return Response(status_code=204)
+        raise HTTPException(status_code=404, detail="Tópico não encontrado")
+    # The resume filter is built before the response starts, so an invalid
+    # cursor or a running migration still gets its error status
+    replay_query = None
+    if last_event_id:
+        replay_query = {"thread_id": thread_id, **keyset_filter(last_event_id, "$gt")}
+    
+    # Subscribe before backfilling so nothing published in between is lost
+    queue = thread_events.subscribe(thread_id)
+    
+    async def event_stream():
+        try:
+            last_key = None
+            if replay_query:
+                # Resume: replay what was missed, then dedupe against the queue
+                thread_data = await db.threads.find_one({"id": thread_id}, {"_id": 0, "reply_count": 1})
+                reply_count = thread_data["reply_count"] if thread_data else 0
+                async for reply_data in db.replies.find(replay_query, REPLY_PROJECTION).sort(
+                    [("created_at", 1), ("id", 1)]
+                ).batch_size(REPLIES_MAX_PAGE_SIZE):
+                    reply = public_reply(reply_data)
+                    yield format_reply_event(reply, reply_count)
+                    last_key = (reply["created_at"], reply["id"])
+            
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break  # fell behind; the client reconnects with Last-Event-ID
+                reply, reply_count = event
+                if last_key and (reply["created_at"], reply["id"]) <= last_key:
+                    continue
+                yield format_reply_event(reply, reply_count)
+        finally:
+            thread_events.unsubscribe(thread_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Search
+def fold_text(text: str) -> str:
+    # Lowercase and strip accents so "revolução" matches "Revolucao"
+    return ''.join(
+        c for c in unicodedata.normalize('NFKD', text.lower())
+        if not unicodedata.combining(c)
+    )
+
+def search_terms(q: str) -> List[str]:
+    # Negated terms are excluded by Mongo, so they are never highlighted
+    words = re.findall(r'-?\w+', q)
+    return [fold_text(word) for word in words if not word.startswith('-')]
+
+def highlight_snippet(text: str, terms: List[str]):
+    # Mongo stems Portuguese words, so match on a short prefix of each term
+    prefixes = [term[:max(3, len(term) - 2)] for term in terms]
+    matches = []
+    for match in re.finditer(r'\w+', text):
+        word = fold_text(match.group())
+        if any(word.startswith(prefix) for prefix in prefixes):
+            matches.append((match.start(), match.end()))
+    
+    start = 0
+    if matches and matches[0][0] > SEARCH_SNIPPET_LENGTH // 3:
+        start = matches[0][0] - SEARCH_SNIPPET_LENGTH // 3
+    end = start + SEARCH_SNIPPET_LENGTH
+    highlights = [[s - start, e - start] for s, e in matches if s >= start and e <= end]
+    return text[start:end], highlights
+
+def encode_search_cursor(score: float, item_id: str) -> str:
+    raw = json.dumps([score, item_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_search_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        score, item_id = json.loads(raw)
+        if not isinstance(score, (int, float)) or not isinstance(item_id, str):
+            raise ValueError(cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return score, item_id
+
+async def search_collection(collection, q: str, cursor, limit: int, projection):
+    pipeline = [
+        {"$match": {"$text": {"$search": q}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if cursor:
+        score, item_id = cursor
+        pipeline.append({"$match": {"$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "id": {"$lt": item_id}}
+        ]}})
+    pipeline += [
+        {"$sort": {"score": -1, "id": -1}},
+        {"$limit": limit},
+        {"$project": projection},
+    ]
+    return await collection.aggregate(pipeline).to_list(limit)
+
+@api_router.get("/search", response_model=SearchResults)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    cursor: Optional[str] = None,
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE)
+):
+    position = decode_search_cursor(cursor) if cursor else None
+    
+    # Rank threads and replies by text score, then merge the two lists
+    threads_data, replies_data = await asyncio.gather(
+        search_collection(read_db.threads, q, position, limit, {
+            "_id": 0, "id": 1, "title": 1, "content": 1,
+            "author_username": 1, "created_at": 1, "score": 1
+        }),
+        search_collection(read_db.replies, q, position, limit, {
+            "_id": 0, "id": 1, "thread_id": 1, "content": 1,
+            "author_username": 1, "created_at": 1, "score": 1
+        })
+    )
+    for thread_data in threads_data:
+        thread_data["type"] = "thread"
+        thread_data["thread_id"] = thread_data["id"]
     for reply_data in replies_data:
-        reply_data = parse_from_mongo(reply_data)
-        replies.append(Reply(**reply_data))
-    return replies
+        reply_data["type"] = "reply"
+    hits = sorted(threads_data + replies_data, key=lambda hit: (hit["score"], hit["id"]), reverse=True)[:limit]
+    
+    terms = search_terms(q)
+    results = []
+    for hit in hits:
+        hit = parse_from_mongo(hit)
+        hit["snippet"], hit["highlights"] = highlight_snippet(hit.pop("content"), terms)
+        results.append(SearchResult(**hit))
+    
+    next_cursor = None
+    if len(results) == limit:
+        next_cursor = encode_search_cursor(results[-1].score, results[-1].id)
+    return SearchResults(results=results, next_cursor=next_cursor)
 
 # Image upload route
 @api_router.post("/upload-image")
-async def upload_image(file: UploadFile = File(...)):
-    # Validate file type
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="Arquivo deve ser uma imagem")
+async def upload_image(request: Request):
+    # Stream the body instead of buffering it, with memory bounded by the spool threshold
+    upload = await receive_image_upload(request)
+    try:
+        if not upload.found:
+            raise HTTPException(status_code=400, detail="Nenhum arquivo enviado")
+        
+        # Validate file type
+        content_type = sniff_image_type(upload.header)
+        if not content_type:
+            raise HTTPException(status_code=400, detail="Arquivo deve ser uma imagem")
+        
+        # Store content-addressed blob
+        image_id = await save_image(upload.spool, upload.hasher.hexdigest(), upload.size, content_type)
+    finally:
+        upload.spool.close()
+    
+    # Thumbnails are rendered off the request path
+    task = asyncio.create_task(generate_image_variants(image_id))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    
+    return {
+        "image_id": image_id,
+        "filename": upload.filename,
+        "content_type": content_type
+    }
+
+def stream_image(image: dict, request: Request, headers: dict):
+    headers = {**headers, "ETag": f'"{image["id"]}"', "Accept-Ranges": "bytes"}
+    
+    size = image["size"]
+    byte_range = parse_range_header(request.headers.get("range"), size)
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    else:
+        start, end = 0, size - 1
+        status_code = 200
+    headers["Content-Length"] = str(end - start + 1)
     
-    # Read file content
-    content = await file.read()
+    return StreamingResponse(
+        image_store.read_range(image["id"], start, end),
+        status_code=status_code,
+        media_type=image["content_type"],
+        headers=headers
+    )
+
+@api_router.get("/images/{image_id}")
+async def get_image(image_id: str, request: Request):
+    if not re.match(IMAGE_ID_PATTERN, image_id):
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
     
-    # Convert to base64
-    base64_image = base64.b64encode(content).decode('utf-8')
+    image = await db.images.find_one({"id": image_id}, {"_id": 0})
+    if not image:
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    
+    # Content never changes for a given hash, so the hash is a strong ETag
+    headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+    if is_not_modified(request, {"ETag": f'"{image_id}"'}):
+        return Response(status_code=304, headers={"ETag": f'"{image_id}"', **headers})
+    return stream_image(image, request, headers)
+
+@api_router.get("/images/{image_id}/{variant}")
+async def get_image_variant(image_id: str, variant: str, request: Request):
+    if variant not in IMAGE_VARIANTS or not re.match(IMAGE_ID_PATTERN, image_id):
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    
+    image = await db.images.find_one({"id": image_id}, {"_id": 0})
+    # Derivatives are not sources themselves
+    if not image or image.get("variant_of"):
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    # Rendered on demand if the upload-time job has not finished yet
+    variant_id = await ensure_image_variant(image, variant)
+    if not variant_id:
+        raise HTTPException(status_code=415, detail="Formato de imagem não suportado")
+    image = await db.images.find_one({"id": variant_id}, {"_id": 0})
+    if not image:
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    
+    # The URL outlives a change to IMAGE_VARIANTS, so revalidate daily
+    headers = {"Cache-Control": "public, max-age=86400"}
+    if is_not_modified(request, {"ETag": f'"{image["id"]}"'}):
+        return Response(status_code=304, headers={"ETag": f'"{image["id"]}"', **headers})
+    return stream_image(image, request, headers)
+
+# Administration
+@api_router.post("/admin/threads/{thread_id}/archive")
+async def archive_thread_now(thread_id: str, admin: str = Depends(require_admin)):
+    if not await archive_thread(thread_id):
+        if await db.threads_archive.find_one({"id": thread_id}, {"_id": 1}):
+            raise HTTPException(status_code=409, detail="Tópico já arquivado")
+        if await db.threads.find_one({"id": thread_id}, {"_id": 1}):
+            raise HTTPException(status_code=409, detail="Tópico recebeu respostas durante o arquivamento ou é grande demais")
+        raise HTTPException(status_code=404, detail="Tópico não encontrado")
+    logger.info(f"Thread {thread_id} archived by {admin}")
+    return {"message": "Tópico arquivado", "thread_id": thread_id}
+
+@api_router.post("/admin/threads/{thread_id}/restore")
+async def restore_archived_thread(thread_id: str, admin: str = Depends(require_admin)):
+    if not await restore_thread(thread_id):
+        raise HTTPException(status_code=404, detail="Tópico arquivado não encontrado")
+    logger.info(f"Thread {thread_id} restored by {admin}")
+    return {"message": "Tópico restaurado", "thread_id": thread_id}
+
+@api_router.get("/admin/export/{collection}")
+async def export_collection(collection: str, admin: str = Depends(require_admin)):
+    if collection not in EXPORT_COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Coleção desconhecida")
+    logger.info(f"Export of {collection} started by {admin}")
+    return StreamingResponse(
+        export_ndjson_gz(collection),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{collection}.ndjson.gz"'}
+    )
+
+# The body is NDJSON, gzip-compressed or not. After a failure, send the same
+# file again with skip set to the returned resume_from.
+@api_router.post("/admin/import/{collection}")
+async def import_collection(
+    collection: str,
+    request: Request,
+    skip: int = Query(0, ge=0),
+    admin: str = Depends(require_admin)
+):
+    if collection not in EXPORT_COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Coleção desconhecida")
+    try:
+        result = await import_documents(collection, request.stream(), skip=skip)
+    except DataImportError as e:
+        raise HTTPException(status_code=400, detail={
+            "message": f"Importação interrompida na linha {e.line}: {e.reason}",
+            "resume_from": e.resume_from,
+        })
+    finally:
+        await finish_import(collection)
+    logger.info(f"Imported {result['imported']} documents into {collection} for {admin}")
+    return result
+
+@api_router.get("/admin/slow-requests")
+async def get_slow_requests(
+    limit: int = Query(50, ge=1, le=500),
+    min_ms: float = Query(0, ge=0),
+    admin: str = Depends(require_admin)
+):
+    cursor = db.slow_requests.find(
+        {"duration_ms": {"$gte": min_ms}}, {"_id": 0}
+    ).sort("recorded_at", -1).limit(limit)
+    return await cursor.to_list(length=limit)
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, admin: str = Depends(require_admin)):
+    path = PROFILE_DIR / f"{profile_id}.speedscope.json"
+    if not PROFILE_ID_PATTERN.match(profile_id) or not path.is_file():
+        raise HTTPException(status_code=404, detail="Perfil não encontrado")
+    # Open it at https://www.speedscope.app
+    return FileResponse(path, media_type="application/json", filename=path.name)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    lines = []
+    for metric in (http_requests_total, http_request_duration, http_requests_in_flight,
+                   mongo_command_duration, mongo_command_failures, mongo_connections_open,
+                   mongo_checkout_failures, rate_limited_total, upload_bytes_total, event_loop_lag):
+        lines += metric.render()
+    cache_stats = token_cache.stats()
+    lines += [
+        "# HELP bcrypt_queue_depth Password hashing jobs queued or running",
+        "# TYPE bcrypt_queue_depth gauge",
+        f"bcrypt_queue_depth {password_jobs_pending}",
+        "# HELP token_cache_hits_total Verified-token cache hits",
+        "# TYPE token_cache_hits_total counter",
+        f"token_cache_hits_total {cache_stats['hits']}",
+        "# HELP token_cache_misses_total Verified-token cache misses",
+        "# TYPE token_cache_misses_total counter",
+        f"token_cache_misses_total {cache_stats['misses']}",
+    ]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+# Records per-route counts and latency. Pure ASGI so streaming responses are
+# timed until their last byte and no extra buffering is added.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        start = time.perf_counter()
+        status = [500]
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+        
+        http_requests_in_flight.inc(amount=1)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.inc(amount=-1)
+            # Route templates keep label cardinality bounded
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            http_requests_total.inc(scope["method"], route_path, status[0])
+            http_request_duration.observe(scope["method"], route_path, value=time.perf_counter() - start)
+
+# Rate limiting. Buckets are keyed by route class and client: the username
+# for a valid token, otherwise the IP address (the /64 for IPv6).
+def parse_rate_limit(value: str):
+    requests, seconds = value.split("/")
+    return int(requests), float(seconds)
+
+RATE_LIMIT_RULES = {route_class: parse_rate_limit(value) for route_class, value in RATE_LIMITS.items()}
+RATE_LIMITED_ROUTES = [
+    ("POST", re.compile(r"^/api/threads$"), "thread"),
+    ("POST", re.compile(r"^/api/threads/[^/]+/replies$"), "reply"),
+    ("POST", re.compile(r"^/api/upload-image$"), "upload"),
+    ("POST", re.compile(r"^/api/(login|register)$"), "auth"),
+]
+
+# Token buckets in process memory; least recently used clients are dropped
+# past RATE_LIMIT_MAX_KEYS, which only ever refills them early
+class MemoryRateLimiter:
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> (tokens, last refill)
+
+    async def take(self, key: str, capacity: int, period: float) -> float:
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * capacity / period)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) * period / capacity
+        self.buckets[key] = (tokens - 1, now)
+        self.buckets.move_to_end(key)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return 0.0
+
+# Fixed windows counted in Mongo, shared by every worker. A window document
+# expires through the TTL index once its period is over. Coarser than a
+# token bucket: a client can spend two budgets around a window boundary.
+class MongoRateLimiter:
+    async def take(self, key: str, capacity: int, period: float) -> float:
+        now = time.time()
+        window_start = now - now % period
+        window_end = datetime.fromtimestamp(window_start + period, timezone.utc)
+        try:
+            window = await db.rate_limits.find_one_and_update(
+                {"_id": f"{key}:{int(window_start)}"},
+                {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": window_end}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            # A limiter outage must not take posting down with it
+            logger.error(f"Rate limiter unavailable: {e}")
+            return 0.0
+        if window["count"] > capacity:
+            return window_start + period - now
+        return 0.0
+
+rate_limiter = MongoRateLimiter() if RATE_LIMIT_BACKEND == 'mongo' else MemoryRateLimiter(RATE_LIMIT_MAX_KEYS)
+
+async def rate_limit_client(scope) -> str:
+    headers = Headers(scope=scope)
+    authorization = headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        username = await username_for_token(authorization[7:].strip())
+        if username:
+            return f"user:{username}"
     
+    client_ip = scope["client"][0] if scope.get("client") else "unknown"
+    forwarded_for = headers.get("x-forwarded-for")
+    if RATE_LIMIT_TRUST_FORWARDED and forwarded_for:
+        # The last hop is the one our own proxy appended
+        client_ip = forwarded_for.split(",")[-1].strip()
+    try:
+        address = ipaddress.ip_address(client_ip)
+    except ValueError:
+        return f"ip:{client_ip}"
+    if address.version == 6:
+        # One subscriber usually holds a whole /64
+        return f"ip:{ipaddress.ip_network(f'{address}/64', strict=False)}"
+    return f"ip:{address}"
+
+# Throttles the write routes before routing, so a rejected request never has
+# its body read, parsed or decoded
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or RATE_LIMIT_BACKEND == 'off':
+            return await self.app(scope, receive, send)
+        
+        for method, pattern, route_class in RATE_LIMITED_ROUTES:
+            if scope["method"] == method and pattern.match(scope["path"]):
+                break
+        else:
+            return await self.app(scope, receive, send)
+        
+        capacity, period = RATE_LIMIT_RULES[route_class]
+        client_key = await rate_limit_client(scope)
+        retry_after = await rate_limiter.take(f"{route_class}:{client_key}", capacity, period)
+        if retry_after <= 0:
+            return await self.app(scope, receive, send)
+        
+        rate_limited_total.inc(route_class)
+        response = ORJSONResponse(
+            {"detail": "Muitas requisições. Tente novamente mais tarde."},
+            status_code=429,
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+        await response(scope, receive, send)
+
+def encoding_qualities(accept_encoding: str) -> dict:
+    qualities = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip()] = quality
+    return qualities
+
+def accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    qualities = encoding_qualities(accept_encoding)
+    return qualities.get(coding, qualities.get("*", 0.0)) > 0
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    qualities = encoding_qualities(accept_encoding)
+    for coding in ("br", "gzip"):
+        if coding == "br" and brotli is None:
+            continue
+        if qualities.get(coding, qualities.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+def compress_body(body: bytes, coding: str) -> bytes:
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+# Compresses complete JSON and text responses with brotli or gzip. Streamed
+# responses (NDJSON, SSE, images) pass through untouched, so nothing that
+# relies on incremental delivery gets buffered.
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        coding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if coding is None:
+            return await self.app(scope, receive, send)
+        
+        start_message = None
+        
+        async def send_wrapper(message):
+            nonlocal start_message
+            # Hold the headers until the first body chunk shows whether the
+            # body is complete, except for streams that must start right away
+            if message["type"] == "http.response.start":
+                if Headers(raw=message["headers"]).get("content-type", "").startswith(STREAMED_TYPES):
+                    return await send(message)
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                return await send(message)
+            
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start["headers"])
+            compressible = (
+                start["status"] == 200
+                and not message.get("more_body", False)
+                and "content-encoding" not in headers
+                and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            )
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+            if compressible and len(body) >= COMPRESSION_MIN_SIZE:
+                body = compress_body(body, coding)
+                headers["Content-Encoding"] = coding
+                headers["Content-Length"] = str(len(body))
+                # The bytes differ per encoding, so the tag can only be weak
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                message = {**message, "body": body}
+            await send(start)
+            await send(message)
+        
+        await self.app(scope, receive, send_wrapper)
+
+# On-demand profiling and the slow request log. Both cost a header check per
+# request when unused: profiles are only taken for admins who ask, and Mongo
+# commands are only traced while SLOW_REQUEST_MS is set.
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+profile_running = False  # the sampler profiles one request per worker at a time
+
+async def profile_requested(scope) -> bool:
+    headers = Headers(scope=scope)
+    if headers.get("x-profile") != "1" and QueryParams(scope.get("query_string", b"")).get("profile") != "1":
+        return False
+    authorization = headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return False
+    return await username_for_token(authorization[7:].strip()) in ADMIN_USERNAMES
+
+def save_profile(profiler, profile_id: str):
+    output = profiler.output(renderer=SpeedscopeRenderer())
+    write_file_atomic(PROFILE_DIR / f"{profile_id}.speedscope.json", output.encode())
+
+def summarize_explain(explain: dict) -> dict:
+    planner = explain.get("queryPlanner")
+    if planner is None:
+        # Aggregations nest the planner under their $cursor stage
+        for stage in explain.get("stages", []):
+            if "$cursor" in stage:
+                planner = stage["$cursor"].get("queryPlanner")
+                break
+    planner = planner or {}
+    plan = planner.get("winningPlan", {})
+    plan = plan.get("queryPlan", plan)  # slot-based engine
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if plan.get("indexName"):
+            stage += f"({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get("inputStage") or next(iter(plan.get("inputStages", [])), None)
     return {
-        "image_data": base64_image,
-        "filename": file.filename,
-        "content_type": file.content_type
+        "namespace": planner.get("namespace"),
+        "plan": " > ".join(stages),
+        "collection_scan": any(stage.startswith("COLLSCAN") for stage in stages),
+        "rejected_plans": len(planner.get("rejectedPlans", [])),
+    }
+
+async def explain_command(database: str, command) -> dict:
+    command = {key: value for key, value in command.items() if key not in DRIVER_COMMAND_FIELDS}
+    try:
+        explain = await client[database].command({"explain": command, "verbosity": "queryPlanner"})
+    except Exception as exc:
+        return {"error": str(exc)}
+    return summarize_explain(explain)
+
+async def record_slow_request(scope, status: int, duration_ms: float, trace: RequestTrace):
+    route = scope.get("route")
+    entry = {
+        "id": uuid.uuid4().hex,
+        "method": scope["method"],
+        # The query string is left out, it can carry tokens
+        "path": scope["path"],
+        "route": route.path if route is not None else "unmatched",
+        "status": status,
+        "duration_ms": round(duration_ms, 3),
+        "command_count": trace.command_count,
+        "commands": trace.commands,
+        "recorded_at": datetime.now(timezone.utc),
     }
+    if trace.slowest is not None:
+        duration, database, command = trace.slowest
+        entry["slowest_command"] = {
+            "command": next(iter(command)),
+            "duration_ms": round(duration, 3),
+            "explain": await explain_command(database, command),
+        }
+    logger.warning(f"Slow request {entry['method']} {entry['path']}: {entry['duration_ms']:.0f}ms, {trace.command_count} Mongo commands")
+    try:
+        await db.slow_requests.insert_one(entry)
+    except Exception:
+        logger.exception("Failed to record slow request")
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global profile_running
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        profile = Profiler is not None and not profile_running and await profile_requested(scope)
+        if not profile and SLOW_REQUEST_MS <= 0:
+            return await self.app(scope, receive, send)
+        
+        profile_id = uuid.uuid4().hex
+        status = [500]
+        streaming = [False]
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = MutableHeaders(raw=message["headers"])
+                # Event streams stay open by design and would always look slow
+                streaming[0] = headers.get("content-type", "").startswith("text/event-stream")
+                if profile:
+                    headers["X-Profile-Id"] = profile_id
+            await send(message)
+        
+        trace = RequestTrace() if SLOW_REQUEST_MS > 0 else None
+        token = request_trace.set(trace)
+        profiler = None
+        if profile:
+            profile_running = True
+            profiler = Profiler(interval=PROFILE_INTERVAL, async_mode="enabled")
+            profiler.start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            request_trace.reset(token)
+            jobs = []
+            if profiler is not None:
+                profiler.stop()
+                profile_running = False
+                jobs.append(run_in_threadpool(save_profile, profiler, profile_id))
+            if trace is not None and duration_ms >= SLOW_REQUEST_MS and not streaming[0]:
+                jobs.append(record_slow_request(scope, status[0], duration_ms, trace))
+            for job in jobs:
+                # Written after the response, off the request's latency
+                task = asyncio.create_task(job)
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(value=max(0.0, time.perf_counter() - start - interval))
 
 # Include router
 app.include_router(api_router)
 
+# Inside CORS, so browsers can read the 429
+app.add_middleware(RateLimitMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -269,8 +3422,13 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor", "X-Profile-Id"],
 )
 
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -278,6 +3436,40 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def init_database():
+    # uvicorn and gunicorn both read WEB_CONCURRENCY for their worker count
+    if not CATALOG_SHARED and int(os.environ.get('WEB_CONCURRENCY', '1')) > 1:
+        raise RuntimeError("CATALOG_SHARED=false requires a single worker (WEB_CONCURRENCY=1)")
+    await warm_mongo_connections()
+    await ensure_indexes()
+    await thread_catalog.load()
+    app.state.loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+    # Old documents stay readable through parse_from_mongo while this runs
+    app.state.migration_task = asyncio.create_task(run_migrations())
+    if EVENTS_BACKEND == 'changestream':
+        app.state.reply_watch_task = asyncio.create_task(watch_reply_inserts())
+    if ARCHIVE_AFTER_DAYS > 0:
+        app.state.archive_task = asyncio.create_task(run_archiver())
+    if SNAPSHOTS_ENABLED:
+        app.state.snapshot_task = asyncio.create_task(refresh_snapshots())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await asyncio.gather(*reply_batcher.flushes)
+    await reply_batcher.flush()
+    if getattr(app.state, 'reply_watch_task', None):
+        app.state.reply_watch_task.cancel()
+    if getattr(app.state, 'loop_lag_task', None):
+        app.state.loop_lag_task.cancel()
+    if getattr(app.state, 'migration_task', None):
+        app.state.migration_task.cancel()
+    if getattr(app.state, 'archive_task', None):
+        app.state.archive_task.cancel()
+    if getattr(app.state, 'snapshot_task', None):
+        app.state.snapshot_task.cancel()
+    snapshot_writer.cancel()
+    client.close()
+    password_executor.shutdown(wait=False)
+    if image_pool is not None:
+        image_pool.shutdown(wait=False)
\ No newline at end of file
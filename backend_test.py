@@ -366,13 +366,13 @@ class BrigadaPaulistaAPITester:
             
             if response.status_code == 200:
                 data = response.json()
-                if "image_data" in data and "filename" in data:
-                    # Verify base64 data is valid
-                    try:
-                        base64.b64decode(data["image_data"])
-                        self.log_result("image_upload", "upload_image", True, "Image upload and base64 conversion successful")
-                    except Exception:
-                        self.log_result("image_upload", "upload_image", False, "Invalid base64 data returned", data)
+                if "image_id" in data and "filename" in data:
+                    # Verify the stored image can be fetched back
+                    image_response = requests.get(f"{self.base_url}/images/{data['image_id']}")
+                    if image_response.status_code == 200 and image_response.content == img_buffer.getvalue():
+                        self.log_result("image_upload", "upload_image", True, "Image upload and retrieval successful")
+                    else:
+                        self.log_result("image_upload", "upload_image", False, f"Stored image retrieval failed: {image_response.status_code}", data)
                 else:
                     self.log_result("image_upload", "upload_image", False, "Image upload response missing required fields", data)
             else:
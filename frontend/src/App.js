@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { BrowserRouter, Routes, Route, Link, useParams, useNavigate } from "react-router-dom";
 import axios from "axios";
 import "./App.css";
@@ -6,6 +6,15 @@ import "./App.css";
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Posts reference images in the image store; older posts still carry inline base64
+const imageSrc = (post) => (
+  post.image_id ? `${API}/images/${post.image_id}/display` : `data:image/png;base64,${post.image_data}`
+);
+
+// ">>reply_id" quotes an earlier reply of the same thread
+const QUOTE_PATTERN = />>([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})/g;
+const shortId = (id) => id.slice(0, 8);
+
 // Auth Context
 const AuthContext = React.createContext();
 
@@ -58,6 +67,7 @@ const AuthProvider = ({ children }) => {
   };
 
   const logout = () => {
+    axios.post(`${API}/logout`).catch(() => {});
     setToken(null);
     setUser(null);
     localStorage.removeItem('token');
@@ -273,16 +283,20 @@ const AuthPage = () => {
 // Forum Page
 const ForumPage = () => {
   const [threads, setThreads] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [sort, setSort] = useState('activity');
   const [showCreateForm, setShowCreateForm] = useState(false);
   
   useEffect(() => {
     fetchThreads();
-  }, []);
+  }, [sort]);
 
-  const fetchThreads = async () => {
+  const fetchThreads = async (before = null) => {
     try {
-      const response = await axios.get(`${API}/threads`);
-      setThreads(response.data);
+      const params = before ? { sort, before } : { sort };
+      const response = await axios.get(`${API}/threads`, { params });
+      setThreads(before ? [...threads, ...response.data] : response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Error fetching threads:', error);
     }
@@ -296,6 +310,10 @@ const ForumPage = () => {
     <div className="forum-page">
       <div className="forum-header">
         <h2>Fórum da Brigada Paulista</h2>
+        <select value={sort} onChange={(e) => setSort(e.target.value)} className="thread-sort">
+          <option value="activity">Mais ativos</option>
+          <option value="created">Mais recentes</option>
+        </select>
         <button 
           onClick={() => setShowCreateForm(!showCreateForm)}
           className="btn btn-primary"
@@ -327,16 +345,22 @@ const ForumPage = () => {
                 <span className="date">{formatDate(thread.created_at)}</span>
                 <span className="replies">{thread.reply_count} respostas</span>
               </div>
-              <p className="thread-preview">{thread.content.substring(0, 200)}...</p>
+              <p className="thread-preview">{thread.snippet}...</p>
             </div>
-            {thread.image_data && (
+            {thread.thumbnail_url && (
               <div className="thread-image">
-                <img src={`data:image/png;base64,${thread.image_data}`} alt="Thread image" />
+                <img src={`${BACKEND_URL}${thread.thumbnail_url}`} alt="Thread image" loading="lazy" />
               </div>
             )}
           </div>
         ))}
       </div>
+
+      {nextCursor && (
+        <button onClick={() => fetchThreads(nextCursor)} className="btn btn-secondary">
+          Carregar mais
+        </button>
+      )}
     </div>
   );
 };
@@ -353,21 +377,21 @@ const CreateThreadForm = ({ onThreadCreated }) => {
     e.preventDefault();
     
     try {
-      let imageData = null;
+      let imageId = null;
       let imageFilename = null;
 
       if (imageFile) {
         const formData = new FormData();
         formData.append('file', imageFile);
         const uploadResponse = await axios.post(`${API}/upload-image`, formData);
-        imageData = uploadResponse.data.image_data;
+        imageId = uploadResponse.data.image_id;
         imageFilename = uploadResponse.data.filename;
       }
 
       const threadData = {
         title,
         content,
-        image_data: imageData,
+        image_id: imageId,
         image_filename: imageFilename
       };
 
@@ -442,52 +466,142 @@ const ThreadPage = () => {
   const { threadId } = useParams();
   const [thread, setThread] = useState(null);
   const [replies, setReplies] = useState([]);
+  const [nextRepliesCursor, setNextRepliesCursor] = useState(null);
+  // Read by the event handler, which outlives the render it was created in
+  const nextRepliesCursorRef = useRef(null);
   const [replyContent, setReplyContent] = useState('');
   const [replyImageFile, setReplyImageFile] = useState(null);
   const [isAnonymous, setIsAnonymous] = useState(false);
+  const [previews, setPreviews] = useState({});
+  const [hovered, setHovered] = useState(null);
   const { user } = React.useContext(AuthContext);
 
   useEffect(() => {
-    fetchThread();
-    fetchReplies();
+    fetchThreadPage();
+
+    // New replies are pushed by the server; EventSource resumes with Last-Event-ID
+    const events = new EventSource(`${API}/threads/${threadId}/events`);
+    events.addEventListener('reply', (e) => {
+      const { reply, reply_count } = JSON.parse(e.data);
+      setThread(current => current && { ...current, reply_count });
+      appendReply(reply);
+    });
+    return () => events.close();
   }, [threadId]);
 
-  const fetchThread = async () => {
+  // Pushed and posted replies only show on the last page; earlier pages
+  // reach them through "load more"
+  const appendReply = (reply) => {
+    if (nextRepliesCursorRef.current) return;
+    setReplies(current => current.some(r => r.id === reply.id) ? current : [
+      // Backlinks are stored at write time; mirror them for the new reply
+      ...current.map(r => (reply.quotes || []).includes(r.id)
+        ? { ...r, backlinks: [...(r.backlinks || []), reply.id] }
+        : r),
+      reply
+    ]);
+  };
+
+  const updateRepliesCursor = (cursor) => {
+    nextRepliesCursorRef.current = cursor;
+    setNextRepliesCursor(cursor);
+  };
+
+  const fetchThreadPage = async () => {
     try {
-      const response = await axios.get(`${API}/threads/${threadId}`);
-      setThread(response.data);
+      const response = await axios.get(`${API}/threads/${threadId}/page`);
+      setThread(response.data.thread);
+      setReplies(response.data.replies);
+      updateRepliesCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error fetching thread:', error);
     }
   };
 
-  const fetchReplies = async () => {
+  const fetchReplies = async (after = null) => {
     try {
-      const response = await axios.get(`${API}/threads/${threadId}/replies`);
-      setReplies(response.data);
+      const response = await axios.get(`${API}/threads/${threadId}/replies`, { params: after ? { after } : {} });
+      setReplies(after ? [...replies, ...response.data] : response.data);
+      updateRepliesCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Error fetching replies:', error);
     }
   };
 
+  // Quoted replies that are not on screen come in one batched request
+  useEffect(() => {
+    const loaded = new Set(replies.map(r => r.id));
+    const missing = [...new Set(replies.flatMap(r => r.quotes || []))]
+      .filter(id => !loaded.has(id) && !(id in previews))
+      .slice(0, 50);
+    if (missing.length === 0) return;
+    axios.get(`${API}/replies/previews`, {
+      params: { ids: missing, thread_id: threadId },
+      paramsSerializer: { indexes: null }
+    }).then(response => {
+      setPreviews(current => {
+        const next = { ...current };
+        missing.forEach(id => { next[id] = null; });
+        response.data.forEach(preview => { next[preview.id] = preview; });
+        return next;
+      });
+    }).catch(error => console.error('Error fetching quote previews:', error));
+  }, [replies]);
+
+  const previewFor = (id) => {
+    const reply = replies.find(r => r.id === id);
+    if (reply) {
+      return { author_username: reply.author_username, created_at: reply.created_at, snippet: reply.content.slice(0, 200) };
+    }
+    return previews[id];
+  };
+
+  const quoteLink = (id, key) => (
+    <a
+      key={key}
+      href={`#reply-${id}`}
+      className="quote-link"
+      onMouseEnter={(e) => setHovered({ id, x: e.clientX, y: e.clientY })}
+      onMouseLeave={() => setHovered(null)}
+    >
+      &gt;&gt;{shortId(id)}
+    </a>
+  );
+
+  const renderContent = (content) => {
+    const parts = [];
+    let last = 0;
+    for (const match of content.matchAll(QUOTE_PATTERN)) {
+      parts.push(content.slice(last, match.index));
+      parts.push(quoteLink(match[1], match.index));
+      last = match.index + match[0].length;
+    }
+    parts.push(content.slice(last));
+    return parts;
+  };
+
+  const quoteReply = (id) => {
+    setReplyContent(current => `${current}${current && !current.endsWith('\n') ? '\n' : ''}>>${id}\n`);
+  };
+
   const handleReplySubmit = async (e) => {
     e.preventDefault();
     
     try {
-      let imageData = null;
+      let imageId = null;
       let imageFilename = null;
 
       if (replyImageFile) {
         const formData = new FormData();
         formData.append('file', replyImageFile);
         const uploadResponse = await axios.post(`${API}/upload-image`, formData);
-        imageData = uploadResponse.data.image_data;
+        imageId = uploadResponse.data.image_id;
         imageFilename = uploadResponse.data.filename;
       }
 
       const replyData = {
         content: replyContent,
-        image_data: imageData,
+        image_id: imageId,
         image_filename: imageFilename
       };
 
@@ -495,11 +609,11 @@ const ThreadPage = () => {
         replyData.author_username = user.username;
       }
 
-      await axios.post(`${API}/threads/${threadId}/replies`, replyData);
+      // Another worker's event stream may never see this write
+      const response = await axios.post(`${API}/threads/${threadId}/replies`, replyData);
+      appendReply(response.data.reply);
       setReplyContent('');
       setReplyImageFile(null);
-      fetchReplies();
-      fetchThread(); // Update reply count
     } catch (error) {
       console.error('Error creating reply:', error);
     }
@@ -513,6 +627,8 @@ const ThreadPage = () => {
     return <div className="loading">Carregando...</div>;
   }
 
+  const hoveredPreview = hovered && previewFor(hovered.id);
+
   return (
     <div className="thread-page">
       <div className="thread-header">
@@ -529,9 +645,9 @@ const ThreadPage = () => {
           </div>
           <div className="post-content">
             <p>{thread.content}</p>
-            {thread.image_data && (
+            {(thread.image_id || thread.image_data) && (
               <img 
-                src={`data:image/png;base64,${thread.image_data}`} 
+                src={imageSrc(thread)} 
                 alt="Post image" 
                 className="post-image"
               />
@@ -541,64 +657,98 @@ const ThreadPage = () => {
 
         <div className="replies-section">
           {replies.map((reply, index) => (
-            <div key={reply.id} className="post reply-post">
+            <div key={reply.id} id={`reply-${reply.id}`} className="post reply-post">
               <div className="post-header">
                 <span className="author">{reply.author_username || 'Anônimo'}</span>
                 <span className="date">{formatDate(reply.created_at)}</span>
-                <span className="post-number">#{index + 2}</span>
+                <span className="post-number" title="Citar" onClick={() => quoteReply(reply.id)}>
+                  #{index + 2} · {shortId(reply.id)}
+                </span>
               </div>
               <div className="post-content">
-                <p>{reply.content}</p>
-                {reply.image_data && (
+                <p>{renderContent(reply.content)}</p>
+                {(reply.image_id || reply.image_data) && (
                   <img 
-                    src={`data:image/png;base64,${reply.image_data}`} 
+                    src={imageSrc(reply)} 
                     alt="Reply image" 
                     className="post-image"
                   />
                 )}
+                {reply.backlinks && reply.backlinks.length > 0 && (
+                  <div className="backlinks">
+                    Respostas: {reply.backlinks.map(id => quoteLink(id, id))}
+                  </div>
+                )}
               </div>
             </div>
           ))}
+          {nextRepliesCursor && (
+            <button onClick={() => fetchReplies(nextRepliesCursor)} className="btn btn-secondary">
+              Carregar mais respostas
+            </button>
+          )}
         </div>
 
-        <div className="reply-form">
-          <h3>Responder</h3>
-          <form onSubmit={handleReplySubmit}>
-            <div className="form-group">
-              <textarea
-                value={replyContent}
-                onChange={(e) => setReplyContent(e.target.value)}
-                placeholder="Digite sua resposta..."
-                rows={4}
-                required
-              />
-            </div>
-            
-            <div className="form-group">
-              <label>Imagem (opcional):</label>
-              <input
-                type="file"
-                accept="image/*"
-                onChange={(e) => setReplyImageFile(e.target.files[0])}
-              />
-            </div>
+        {hovered && (
+          <div className="quote-preview" style={{ left: hovered.x + 12, top: hovered.y + 12 }}>
+            {hoveredPreview ? (
+              <>
+                <div className="post-header">
+                  <span className="author">{hoveredPreview.author_username || 'Anônimo'}</span>
+                  <span className="date">{formatDate(hoveredPreview.created_at)}</span>
+                </div>
+                <p>{hoveredPreview.snippet}</p>
+              </>
+            ) : (
+              <p>{hovered.id in previews ? 'Resposta não encontrada' : 'Carregando...'}</p>
+            )}
+          </div>
+        )}
 
-            {user && (
+        {thread.archived ? (
+          <div className="archived-note">
+            <p>📦 Este tópico foi arquivado e não aceita novas respostas.</p>
+          </div>
+        ) : (
+          <div className="reply-form">
+            <h3>Responder</h3>
+            <form onSubmit={handleReplySubmit}>
               <div className="form-group">
-                <label className="checkbox-label">
-                  <input
-                    type="checkbox"
-                    checked={isAnonymous}
-                    onChange={(e) => setIsAnonymous(e.target.checked)}
-                  />
-                  Responder anonimamente
-                </label>
+                <textarea
+                  value={replyContent}
+                  onChange={(e) => setReplyContent(e.target.value)}
+                  placeholder="Digite sua resposta..."
+                  rows={4}
+                  required
+                />
               </div>
-            )}
-            
-            <button type="submit" className="btn btn-primary">Responder</button>
-          </form>
-        </div>
+              
+              <div className="form-group">
+                <label>Imagem (opcional):</label>
+                <input
+                  type="file"
+                  accept="image/*"
+                  onChange={(e) => setReplyImageFile(e.target.files[0])}
+                />
+              </div>
+
+              {user && (
+                <div className="form-group">
+                  <label className="checkbox-label">
+                    <input
+                      type="checkbox"
+                      checked={isAnonymous}
+                      onChange={(e) => setIsAnonymous(e.target.checked)}
+                    />
+                    Responder anonimamente
+                  </label>
+                </div>
+              )}
+              
+              <button type="submit" className="btn btn-primary">Responder</button>
+            </form>
+          </div>
+        )}
       </div>
     </div>
   );
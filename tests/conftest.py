@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# server.py reads its configuration at import time
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "brigada_test")
+os.environ.setdefault("IMAGE_STORE", "local")
+os.environ.setdefault("IMAGE_STORE_PATH", tempfile.mkdtemp())
+os.environ.setdefault("RATE_LIMIT_BACKEND", "off")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("ADMIN_USERNAMES", "admin")
+# One worker; mongomock cannot run the shared catalog's pipeline updates
+os.environ.setdefault("CATALOG_SHARED", "false")
+
+import motor.motor_asyncio
+from mongomock_motor import AsyncMongoMockClient
+
+class InMemoryMotorClient(AsyncMongoMockClient):
+    def __init__(self, *args, **kwargs):
+        # mongomock does not understand pool or monitoring options
+        super().__init__(*args, tz_aware=kwargs.get("tz_aware", False))
+
+motor.motor_asyncio.AsyncIOMotorClient = InMemoryMotorClient
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server
+from fastapi.testclient import TestClient
+
+PASSWORD = "saopaulo1932"
+
+@pytest.fixture(scope="session")
+def app_client():
+    # One app lifetime for the session: shutdown closes the executors
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+async def reset_state():
+    for name in await server.db.list_collection_names():
+        await server.db.drop_collection(name)
+    await server.ensure_indexes()
+    server.archive_reader.entries.clear()
+    server.reply_batcher.known_threads.clear()
+    # The collections are empty, so there is nothing left to migrate
+    server.finished_migrations.update({server.MIGRATION_CREATED_AT, server.MIGRATION_BUMPED_AT})
+    await server.thread_catalog.load(rebuild=True)
+
+@pytest.fixture
+def client(app_client):
+    app_client.portal.call(reset_state)
+    app_client.headers.clear()
+    return app_client
+
+@pytest.fixture
+def run(app_client):
+    # Runs a coroutine function on the app's event loop
+    def call(fn, *args):
+        return app_client.portal.call(fn, *args)
+    return call
+
+def auth_headers(client, username: str) -> dict:
+    client.post("/api/register", json={"username": username, "password": PASSWORD})
+    token = client.post("/api/login", json={"username": username, "password": PASSWORD}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def admin(client):
+    return auth_headers(client, "admin")
+
+def create_thread(client, title: str = "Tópico", content: str = "Conteúdo") -> str:
+    return client.post("/api/threads", json={"title": title, "content": content}).json()["thread_id"]
+
+def create_reply(client, thread_id: str, content: str = "Resposta") -> str:
+    response = client.post(f"/api/threads/{thread_id}/replies", json={"content": content})
+    assert response.status_code == 200, response.text
+    return response.json()["reply_id"]
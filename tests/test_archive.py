@@ -0,0 +1,65 @@
+import server
+from tests.conftest import auth_headers, create_reply, create_thread
+
+def archive(client, admin, thread_id):
+    response = client.post(f"/api/admin/threads/{thread_id}/archive", headers=admin)
+    assert response.status_code == 200, response.text
+
+def restore(client, admin, thread_id):
+    response = client.post(f"/api/admin/threads/{thread_id}/restore", headers=admin)
+    assert response.status_code == 200, response.text
+
+def test_archived_thread_stays_readable_with_its_own_tag(client, admin):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    replies = [create_reply(client, thread_id, f"r{n}") for n in range(3)]
+    hot_tag = client.get(f"/api/threads/{thread_id}").headers["etag"]
+    archive(client, admin, thread_id)
+
+    response = client.get(f"/api/threads/{thread_id}", headers={"If-None-Match": hot_tag})
+    assert response.status_code == 200
+    assert response.json()["archived"] is True
+    assert response.headers["etag"] != hot_tag
+    first = client.get(f"/api/threads/{thread_id}/replies", params={"limit": 2})
+    second = client.get(f"/api/threads/{thread_id}/replies", params={"after": first.headers["x-next-cursor"]})
+    assert [r["id"] for r in first.json() + second.json()] == replies
+    reply = client.post(f"/api/threads/{thread_id}/replies", json={"content": "Tarde demais"})
+    assert reply.status_code == 409
+
+def test_restore_brings_the_thread_back(client, admin):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    create_reply(client, thread_id)
+    archive(client, admin, thread_id)
+    restore(client, admin, thread_id)
+
+    thread = client.get(f"/api/threads/{thread_id}").json()
+    assert "archived" not in thread
+    assert thread["reply_count"] == 1
+    create_reply(client, thread_id)
+    assert len(client.get(f"/api/threads/{thread_id}/replies").json()) == 2
+
+def test_rearchive_on_another_worker_is_not_served_stale(client, admin, monkeypatch):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    create_reply(client, thread_id)
+    archive(client, admin, thread_id)
+    assert client.get(f"/api/threads/{thread_id}").json()["reply_count"] == 1
+
+    # The restore and the next archive happen elsewhere; this worker's
+    # cache keeps its decoded copy
+    monkeypatch.setattr(server.archive_reader, "forget", lambda thread_id: None)
+    restore(client, admin, thread_id)
+    create_reply(client, thread_id)
+    archive(client, admin, thread_id)
+
+    thread = client.get(f"/api/threads/{thread_id}").json()
+    assert thread["reply_count"] == 2
+    assert len(client.get(f"/api/threads/{thread_id}/replies").json()) == 2
+
+def test_events_of_archived_thread_end_cleanly(client, admin):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    archive(client, admin, thread_id)
+    assert client.get(f"/api/threads/{thread_id}/events").status_code == 204
+    assert client.get("/api/threads/nenhum/events").status_code == 404
@@ -0,0 +1,60 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import bcrypt
+import pytest
+
+import server
+from tests.conftest import PASSWORD, auth_headers
+
+def test_token_cache_stats_are_admin_only(client, admin):
+    assert client.get("/api/token-cache/stats").status_code == 401
+    assert client.get("/api/token-cache/stats", headers=auth_headers(client, "membro")).status_code == 403
+    assert "hits" in client.get("/api/token-cache/stats", headers=admin).json()
+
+def test_logged_out_token_is_refused_on_every_worker(client, admin):
+    assert client.get("/api/token-cache/stats", headers=admin).status_code == 200
+    assert client.post("/api/logout", headers=admin).status_code == 200
+    assert client.get("/api/token-cache/stats", headers=admin).status_code == 401
+    # A worker that did not handle the logout finds it in Mongo
+    server.token_cache.entries.clear()
+    server.token_cache.revoked.clear()
+    assert client.get("/api/token-cache/stats", headers=admin).status_code == 401
+    assert client.get("/api/token-cache/stats", headers=auth_headers(client, "admin")).status_code == 200
+
+def test_cached_token_is_rechecked_for_revocation(client, admin, run, monkeypatch):
+    assert client.get("/api/token-cache/stats", headers=admin).status_code == 200
+    token = admin["Authorization"][7:]
+    # Revoked by another worker while this one still has it cached
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    run(server.db.revoked_tokens.insert_one, {"_id": server.token_key(token), "expires_at": expires_at})
+    assert client.get("/api/token-cache/stats", headers=admin).status_code == 200
+    monkeypatch.setattr(server, "TOKEN_REVOCATION_CHECK_SECONDS", 0)
+    assert client.get("/api/token-cache/stats", headers=admin).status_code == 401
+
+def test_password_jobs_run_on_the_bcrypt_pool(run):
+    assert run(server.run_password_job, lambda: threading.current_thread().name).startswith("bcrypt")
+
+    def fail():
+        raise ValueError("falhou")
+    with pytest.raises(ValueError):
+        run(server.run_password_job, fail)
+    assert server.password_jobs_pending == 0
+
+def test_logins_past_the_queue_limit_are_shed(client, monkeypatch):
+    auth_headers(client, "joana")
+    monkeypatch.setattr(server, "password_jobs_pending", server.BCRYPT_MAX_PENDING)
+    response = client.post("/api/login", json={"username": "joana", "password": PASSWORD})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+def test_login_rehashes_at_the_configured_cost(client, run):
+    old_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=server.BCRYPT_ROUNDS + 1)).decode()
+    run(server.db.users.insert_one, {"id": "1", "username": "antiga", "password_hash": old_hash,
+                                     "created_at": datetime.now(timezone.utc)})
+    credentials = {"username": "antiga", "password": PASSWORD}
+    assert client.post("/api/login", json=credentials).status_code == 200
+    new_hash = run(server.db.users.find_one, {"username": "antiga"})["password_hash"]
+    assert new_hash != old_hash
+    assert not server.password_needs_rehash(new_hash)
+    assert client.post("/api/login", json=credentials).status_code == 200
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+def seed_threads(run, count: int) -> list:
+    # Distinct bump times, newest first, so board order is the list order.
+    # Ids descend as well: mongomock sorts a $push by just one of its keys.
+    now = datetime.now(timezone.utc)
+    threads = [{
+        "id": f"topico{99 - n}",
+        "title": f"Tópico {n}",
+        "content": "Conteúdo",
+        "created_at": now - timedelta(minutes=n),
+        "last_activity_at": now - timedelta(minutes=n),
+        "bumped_at": now - timedelta(minutes=n),
+        "reply_count": 0,
+        "version": 1,
+    } for n in range(count)]
+    run(server.db.threads.insert_many, threads)
+    return [thread["id"] for thread in threads]
+
+def test_shared_catalog_rebuilds_stale_document(client, run):
+    thread_ids = seed_threads(run, 3)
+    catalog = server.ThreadCatalog(10, shared=True)
+
+    async def plant_stale_document():
+        await server.db.catalog.replace_one(
+            {"_id": "front_page"}, {"_id": "front_page", "entries": [], "version": 7}, upsert=True
+        )
+        await catalog.load()
+        return await server.db.catalog.find_one({"_id": "front_page"})
+
+    doc = run(plant_stale_document)
+    assert [entry["id"] for entry in doc["entries"]] == thread_ids
+    assert doc["version"] == 8
+    assert catalog.version == 8
+    assert [entry["id"] for entry in catalog.entries] == thread_ids
+
+def test_shared_catalog_trusts_matching_document(client, run):
+    seed_threads(run, 1)
+    catalog = server.ThreadCatalog(10, shared=True)
+
+    async def load_twice():
+        await catalog.load()
+        first = catalog.version
+        await server.ThreadCatalog(10, shared=True).load()
+        return first, (await server.db.catalog.find_one({"_id": "front_page"}))["version"]
+
+    first, current = run(load_twice)
+    assert current == first
+
+def test_shared_catalog_update_inserts_missing_entry(client, run):
+    thread_ids = seed_threads(run, 3)
+    catalog = server.ThreadCatalog(10, shared=True)
+
+    async def update_trimmed_entry():
+        await catalog.load()
+        # Another worker's view of the front page lost the middle thread
+        await server.db.catalog.update_one({"_id": "front_page"}, {"$pull": {"entries": {"id": thread_ids[1]}}})
+        thread_data = await server.db.threads.find_one({"id": thread_ids[1]}, server.THREAD_LIST_PROJECTION)
+        await catalog.update_thread(server.thread_summary_from_mongo({**thread_data, "reply_count": 5}))
+        return await server.db.catalog.find_one({"_id": "front_page"})
+
+    doc = run(update_trimmed_entry)
+    assert [entry["id"] for entry in doc["entries"]] == thread_ids
+    assert doc["entries"][1]["reply_count"] == 5
+    assert catalog.version == doc["version"]
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_archiving_refills_the_front_page(client, run, admin, monkeypatch, shared):
+    thread_ids = seed_threads(run, 15)
+    monkeypatch.setattr(server, "thread_catalog", server.ThreadCatalog(10, shared=shared))
+    run(server.thread_catalog.load)
+    for thread_id in thread_ids[:8]:
+        assert client.post(f"/api/admin/threads/{thread_id}/archive", headers=admin).status_code == 200
+
+    response = client.get("/api/threads", params={"limit": 10})
+    assert [thread["id"] for thread in response.json()] == thread_ids[8:]
+    assert "X-Next-Cursor" not in response.headers
+    first_page = client.get("/api/threads", params={"limit": 5})
+    assert [thread["id"] for thread in first_page.json()] == thread_ids[8:13]
+    rest = client.get("/api/threads", params={"limit": 5, "before": first_page.headers["X-Next-Cursor"]})
+    assert [thread["id"] for thread in rest.json()] == thread_ids[13:]
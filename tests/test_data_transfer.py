@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+
+import orjson
+import pytest
+
+import forum_data
+import server
+from tests.conftest import PASSWORD, auth_headers, create_reply, create_thread, reset_state
+
+async def chunks_of(data: bytes, size: int = 64):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+async def export_bytes(name: str) -> bytes:
+    return b"".join([chunk async for chunk in server.export_ndjson_gz(name)])
+
+def thread_line(n: int) -> bytes:
+    return orjson.dumps({
+        "id": f"importado{n}", "title": f"Tópico {n}", "content": "",
+        "created_at": datetime(2024, 1, n + 1, tzinfo=timezone.utc).isoformat(), "reply_count": 0,
+    })
+
+def test_import_resumes_after_a_bad_line(client, run):
+    lines = [thread_line(n) for n in range(5)]
+    broken = b"\n".join(lines[:2] + [b"{nao e json"] + lines[3:]) + b"\n"
+    with pytest.raises(server.DataImportError) as failure:
+        run(server.import_documents, "threads", chunks_of(broken))
+    assert failure.value.line == 3
+    assert failure.value.resume_from == 2
+
+    fixed = b"\n".join(lines) + b"\n"
+    result = run(server.import_documents, "threads", chunks_of(fixed), failure.value.resume_from)
+    assert result["imported"] == 3
+    assert run(server.db.threads.count_documents, {}) == 5
+
+def test_archived_threads_come_back_archived(client, run, admin):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    replies = [create_reply(client, thread_id, f"r{n}") for n in range(2)]
+    assert client.post(f"/api/admin/threads/{thread_id}/archive", headers=admin).status_code == 200
+    dumps = {name: run(export_bytes, name) for name in ("replies", "threads")}
+
+    run(reset_state)
+    for name in server.IMPORT_ORDER:
+        if name in dumps:
+            run(server.import_documents, name, chunks_of(dumps[name]))
+            run(server.finish_import, name)
+
+    assert run(server.db.threads.count_documents, {}) == 0
+    assert run(server.db.replies.count_documents, {}) == 0
+    thread = client.get(f"/api/threads/{thread_id}").json()
+    assert thread["archived"] is True
+    assert [r["id"] for r in client.get(f"/api/threads/{thread_id}/replies").json()] == replies
+
+def test_imported_user_logs_in_after_set_password(client, run):
+    users = orjson.dumps({"username": "importada", "created_at": "2024-01-01T00:00:00+00:00"}) + b"\n"
+    run(server.import_documents, "users", chunks_of(users))
+    credentials = {"username": "importada", "password": PASSWORD}
+    assert client.post("/api/login", json=credentials).status_code == 401
+
+    assert run(forum_data.set_password, server, "importada", PASSWORD)
+    assert client.post("/api/login", json=credentials).status_code == 200
+    assert not run(forum_data.set_password, server, "ninguem", PASSWORD)
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import orjson
+
+import server
+from tests.conftest import create_reply, create_thread
+
+class EventStream:
+    # Reads a thread's event stream on another thread; the stream ends when
+    # the broker tells it that it fell behind
+    def __init__(self, client, run, thread_id: str, headers: dict = None):
+        self.run = run
+        self.thread_id = thread_id
+        self.response = None
+        self.reader = threading.Thread(
+            target=lambda: setattr(self, "response", client.get(f"/api/threads/{thread_id}/events", headers=headers or {}))
+        )
+        self.reader.start()
+        deadline = time.monotonic() + 5
+        while not server.thread_events.has_subscribers(thread_id):
+            assert time.monotonic() < deadline, "stream never subscribed"
+            time.sleep(0.01)
+
+    def close(self) -> list:
+        async def end_streams():
+            for queue in list(server.thread_events.subscribers.get(self.thread_id, ())):
+                queue.put_nowait(None)
+        self.run(end_streams)
+        self.reader.join(5)
+        assert self.response.status_code == 200
+        assert self.response.headers["content-type"].startswith("text/event-stream")
+        events = []
+        for block in self.response.text.strip().split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+            events.append((fields["id"], fields["event"], orjson.loads(fields["data"])))
+        return events
+
+def reply_cursor(client, thread_id: str, index: int) -> str:
+    reply = client.get(f"/api/threads/{thread_id}/replies").json()[index]
+    return server.encode_cursor(server.datetime.fromisoformat(reply["created_at"].replace("Z", "+00:00")), reply["id"])
+
+def test_new_replies_are_delivered_in_order(client, run):
+    thread_id = create_thread(client)
+    stream = EventStream(client, run, thread_id)
+    replies = [create_reply(client, thread_id, f"r{i}") for i in range(2)]
+    events = stream.close()
+    assert [(event, data["reply"]["id"], data["reply_count"]) for _, event, data in events] == [
+        ("reply", replies[0], 1), ("reply", replies[1], 2)
+    ]
+    assert [event_id for event_id, _, _ in events] == [reply_cursor(client, thread_id, i) for i in range(2)]
+    assert not server.thread_events.has_subscribers(thread_id)
+
+def test_resume_replays_missed_replies_once(client, run):
+    thread_id = create_thread(client)
+    replies = [create_reply(client, thread_id, f"r{i}") for i in range(3)]
+    stream = EventStream(client, run, thread_id, {"Last-Event-ID": reply_cursor(client, thread_id, 0)})
+    replies.append(create_reply(client, thread_id, "r3"))
+    assert [data["reply"]["id"] for _, _, data in stream.close()] == replies[1:]
+
+def test_events_of_archived_and_missing_threads(client, admin):
+    thread_id = create_thread(client)
+    assert client.post(f"/api/admin/threads/{thread_id}/archive", headers=admin).status_code == 200
+    assert client.get(f"/api/threads/{thread_id}/events").status_code == 204
+    assert client.get("/api/threads/sumiu/events").status_code == 404
+    assert client.get(f"/api/threads/{create_thread(client)}/events", headers={"Last-Event-ID": "x"}).status_code == 400
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+import server
+from tests.conftest import auth_headers, create_reply, create_thread
+
+@pytest.fixture
+def thread_id(client):
+    client.headers.update(auth_headers(client, "joana"))
+    return create_thread(client)
+
+def test_reply_page_revalidates_with_its_cursor(client, thread_id):
+    for n in range(3):
+        create_reply(client, thread_id, f"Resposta {n}")
+    page = client.get(f"/api/threads/{thread_id}/replies", params={"limit": 2})
+    assert "last-modified" not in page.headers
+    response = client.get(
+        f"/api/threads/{thread_id}/replies",
+        params={"limit": 2},
+        headers={"If-None-Match": page.headers["etag"]}
+    )
+    assert response.status_code == 304
+    assert response.headers["x-next-cursor"] == page.headers["x-next-cursor"]
+
+def test_reply_in_same_second_changes_the_tag(client, thread_id):
+    create_reply(client, thread_id)
+    page = client.get(f"/api/threads/{thread_id}/replies")
+    create_reply(client, thread_id)
+    response = client.get(f"/api/threads/{thread_id}/replies", headers={"If-None-Match": page.headers["etag"]})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+def test_compressed_thread_list_revalidates(client, thread_id):
+    for n in range(20):
+        create_thread(client, f"Tópico {n}", "Conteúdo comprido " * 10)
+    page = client.get("/api/threads", headers={"Accept-Encoding": "gzip"})
+    assert page.headers["content-encoding"] == "gzip"
+    assert page.headers["etag"].startswith("W/")
+    response = client.get("/api/threads", headers={"Accept-Encoding": "gzip", "If-None-Match": page.headers["etag"]})
+    assert response.status_code == 304
+
+@pytest.mark.parametrize("content_type", [b"text/event-stream", b"application/x-ndjson", b"application/gzip"])
+def test_streams_start_before_their_first_chunk(content_type):
+    sent = []
+    started_early = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+        started_early.append(bool(sent))
+        await send({"type": "http.response.body", "body": b"x" * 4096, "more_body": False})
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(server.CompressionMiddleware(app)(scope, None, send))
+    assert started_early == [True]
+    assert sent[1]["body"] == b"x" * 4096
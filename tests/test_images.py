@@ -0,0 +1,94 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import server
+
+MISSING_ID = "0" * 64
+
+def test_missing_image_is_404_even_with_matching_etag(client):
+    response = client.get(f"/api/images/{MISSING_ID}", headers={"If-None-Match": f'"{MISSING_ID}"'})
+    assert response.status_code == 404
+
+def test_stored_image_revalidates_by_hash(client):
+    png = bytes.fromhex("89504e470d0a1a0a") + b"\x00" * 64
+    image_id = client.post("/api/upload-image", files={"file": ("a.png", png, "image/png")}).json()["image_id"]
+    assert client.get(f"/api/images/{image_id}").content == png
+    response = client.get(f"/api/images/{image_id}", headers={"If-None-Match": f'"{image_id}"'})
+    assert response.status_code == 304
+
+def multipart_body(*parts) -> bytes:
+    body = b""
+    for headers, data in parts:
+        body += b"--limite\r\n" + headers + b"\r\n\r\n" + data + b"\r\n"
+    return body + b"--limite--\r\n"
+
+def test_upload_over_content_length_cap_is_refused(client, monkeypatch):
+    monkeypatch.setattr(server, "UPLOAD_MAX_BYTES", 1000)
+    response = client.post("/api/upload-image", files={"file": ("a.png", b"\x00" * 50_000, "image/png")})
+    assert response.status_code == 413
+
+def test_chunked_upload_counts_every_part(client, monkeypatch, run):
+    monkeypatch.setattr(server, "UPLOAD_MAX_BYTES", 1000)
+    body = multipart_body(
+        (b'Content-Disposition: form-data; name="file"; filename="a.png"', b"\x89PNG"),
+        (b'Content-Disposition: form-data; name="outro"', b"x" * 100_000),
+    )
+    def chunks():
+        for start in range(0, len(body), 4096):
+            yield body[start:start + 4096]
+    response = client.post(
+        "/api/upload-image", content=chunks(),
+        headers={"Content-Type": "multipart/form-data; boundary=limite"}
+    )
+    assert response.status_code == 413
+    assert run(server.db.images.count_documents, {}) == 0
+
+def png_bytes(size=(64, 48)) -> bytes:
+    output = BytesIO()
+    Image.new("RGB", size, "green").save(output, format="PNG")
+    return output.getvalue()
+
+def upload(client, data: bytes) -> str:
+    return client.post("/api/upload-image", files={"file": ("a.png", data, "image/png")}).json()["image_id"]
+
+def test_oversized_part_header_is_refused(client):
+    # Each line stays under the parser's own per-line limit
+    padding = b"".join(b"\r\nX-Enchimento-%d: " % n + b"a" * 4000 for n in range(3))
+    headers = b'Content-Disposition: form-data; name="file"; filename="a.png"' + padding
+    body = multipart_body((headers, png_bytes()))
+    response = client.post(
+        "/api/upload-image", content=body, headers={"Content-Type": "multipart/form-data; boundary=limite"}
+    )
+    assert response.status_code == 400
+    assert client.post(
+        "/api/upload-image", content=body.replace(b"a" * 4000, b"a"),
+        headers={"Content-Type": "multipart/form-data; boundary=limite"}
+    ).status_code == 200
+
+def test_variant_is_rendered_and_not_a_source(client):
+    image_id = upload(client, png_bytes())
+    response = client.get(f"/api/images/{image_id}/thumb")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    variant_id = response.headers["etag"].strip('"')
+    assert variant_id != image_id
+    assert client.get(f"/api/images/{variant_id}/thumb").status_code == 404
+
+def test_image_workers_are_not_forked(client):
+    assert client.get(f"/api/images/{upload(client, png_bytes())}/thumb").status_code == 200
+    assert server.image_pool._mp_context.get_start_method() in ("forkserver", "spawn")
+
+def test_undecodable_image_caches_failed_render(client, run):
+    png = bytes.fromhex("89504e470d0a1a0a") + b"\x00" * 64
+    image_id = upload(client, png)
+    assert client.get(f"/api/images/{image_id}/thumb").status_code == 415
+    image = run(server.db.images.find_one, {"id": image_id})
+    assert image["variants"]["thumb"] == {"error": True}
+    assert client.get(f"/api/images/{image_id}/thumb").status_code == 415
+
+def test_render_refuses_sources_over_pixel_limit(monkeypatch):
+    monkeypatch.setattr(server, "IMAGE_MAX_PIXELS", 64 * 48 - 1)
+    with pytest.raises(Image.DecompressionBombError):
+        server.render_image_variant(png_bytes(), 320, "WEBP", 75)
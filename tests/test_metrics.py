@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import server
+from tests.conftest import create_thread
+
+def sample(client, series: str) -> float:
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith(series + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+def test_requests_are_labelled_by_route_template(client):
+    ok = 'http_requests_total{method="GET",route="/api/threads/{thread_id}",status="200"}'
+    missing = 'http_requests_total{method="GET",route="/api/threads/{thread_id}",status="404"}'
+    unmatched = 'http_requests_total{method="GET",route="unmatched",status="404"}'
+    before = {series: sample(client, series) for series in (ok, missing, unmatched)}
+    for _ in range(2):
+        client.get(f"/api/threads/{create_thread(client)}")
+    client.get("/api/threads/sumiu")
+    client.get("/nada/aqui")
+
+    assert sample(client, ok) - before[ok] == 2
+    assert sample(client, missing) - before[missing] == 1
+    assert sample(client, unmatched) - before[unmatched] == 1
+    assert sample(client, 'http_request_duration_seconds_count{method="GET",route="/api/threads/{thread_id}"}') >= 3
+    assert client.get("/metrics").headers["content-type"].startswith("text/plain; version=0.0.4")
+
+def test_histogram_buckets_are_cumulative():
+    histogram = server.Histogram("demo_seconds", "Demo", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe("/x", value=value)
+    assert histogram.render()[2:] == [
+        'demo_seconds_bucket{route="/x",le="0.1"} 1',
+        'demo_seconds_bucket{route="/x",le="1.0"} 2',
+        'demo_seconds_bucket{route="/x",le="+Inf"} 3',
+        'demo_seconds_sum{route="/x"} 5.55',
+        'demo_seconds_count{route="/x"} 3',
+    ]
+
+def test_mongo_commands_are_timed_by_collection_and_command(client):
+    listener = server.MongoCommandMetrics()
+    duration = 'mongodb_command_duration_seconds_count{collection="replies",command="find"}'
+    failures = 'mongodb_command_failures_total{collection="-",command="ping"}'
+    before = sample(client, duration), sample(client, failures)
+
+    find = {"connection_id": ("db", 27017), "request_id": 1, "command_name": "find"}
+    listener.started(SimpleNamespace(**find, command={"find": "replies"}))
+    listener.succeeded(SimpleNamespace(**find, duration_micros=1500))
+    ping = {"connection_id": ("db", 27017), "request_id": 2, "command_name": "ping"}
+    listener.started(SimpleNamespace(**ping, command={"ping": 1}))
+    listener.failed(SimpleNamespace(**ping, duration_micros=10))
+
+    assert (sample(client, duration), sample(client, failures)) == (before[0] + 1, before[1] + 1)
+    assert listener.pending == {}
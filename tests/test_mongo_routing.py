@@ -0,0 +1,65 @@
+from contextlib import asynccontextmanager
+
+import pytest
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+import server
+from tests.conftest import create_reply, create_thread
+
+def test_read_preference_modes():
+    assert server.read_preference("primary") == Primary()
+    preference = server.read_preference("secondaryPreferred")
+    assert isinstance(preference, SecondaryPreferred)
+    assert preference.max_staleness == server.MONGO_MAX_STALENESS_SECONDS
+    with pytest.raises(ValueError):
+        server.read_preference("secundario")
+
+def test_public_reads_use_read_db_and_writes_stay_on_db(client, run, monkeypatch):
+    thread_id = create_thread(client)
+    # A secondary that has not replicated the thread yet
+    monkeypatch.setattr(server, "read_db", server.client["secundario"])
+    assert client.get(f"/api/threads/{thread_id}").status_code == 404
+    assert client.get(f"/api/threads/{thread_id}/replies").json() == []
+    # The reply's existence check and write go to the primary
+    reply_id = create_reply(client, thread_id)
+    assert run(server.db.replies.count_documents, {"id": reply_id, "thread_id": thread_id}) == 1
+
+class RecordingDatabase:
+    def __init__(self, read_preference=None):
+        self.read_preference = read_preference
+        self.pings = []
+
+    async def command(self, name, **kwargs):
+        self.pings.append((name, kwargs.get("read_preference")))
+
+@pytest.mark.parametrize("mode", ["primary", "nearest"])
+def test_warm_up_opens_read_connections_only_for_secondary_reads(run, monkeypatch, mode):
+    primary, reads = RecordingDatabase(), RecordingDatabase(server.read_preference(mode))
+    monkeypatch.setattr(server, "db", primary)
+    monkeypatch.setattr(server, "read_db", reads)
+    monkeypatch.setattr(server, "MONGO_READ_PREFERENCE", mode)
+    monkeypatch.setattr(server, "MONGO_WARM_CONNECTIONS", 3)
+    run(server.warm_mongo_connections)
+    assert primary.pings == [("ping", None)] * 3
+    assert reads.pings == ([] if mode == "primary" else [("ping", reads.read_preference)] * 3)
+
+def test_secondary_reads_share_a_causally_consistent_session(run, monkeypatch):
+    sessions = []
+
+    class RecordingClient:
+        async def start_session(self, causal_consistency=False):
+            @asynccontextmanager
+            async def session():
+                sessions.append(causal_consistency)
+                yield "sessao"
+            return session()
+
+    async def open_session():
+        async with server.read_session() as session:
+            return session
+
+    assert run(open_session) is None
+    monkeypatch.setattr(server, "MONGO_READ_PREFERENCE", "secondary")
+    monkeypatch.setattr(server, "client", RecordingClient())
+    assert run(open_session) == "sessao"
+    assert sessions == [True]
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta, timezone
+
+import orjson
+
+import server
+from tests.conftest import create_reply, create_thread
+
+def test_thread_pages_follow_the_cursor_without_gaps(client):
+    created = [create_thread(client, title=f"t{i}") for i in range(7)]
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, "sort": "created"}
+        if cursor:
+            params["before"] = cursor
+        response = client.get("/api/threads", params=params)
+        seen += [thread["id"] for thread in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    # Threads created within one millisecond tie on time and order by id
+    assert sorted(seen) == sorted(created)
+
+def test_reply_pages_walk_forward_and_back(client):
+    thread_id = create_thread(client)
+    replies = [create_reply(client, thread_id, f"r{i}") for i in range(5)]
+    first = client.get(f"/api/threads/{thread_id}/replies", params={"limit": 2})
+    assert [r["id"] for r in first.json()] == replies[:2]
+    second = client.get(f"/api/threads/{thread_id}/replies", params={"limit": 2, "after": first.headers["x-next-cursor"]})
+    assert [r["id"] for r in second.json()] == replies[2:4]
+    back = client.get(f"/api/threads/{thread_id}/replies", params={"limit": 2, "before": second.headers["x-prev-cursor"]})
+    assert [r["id"] for r in back.json()] == replies[:2]
+
+def test_invalid_cursor_is_rejected(client):
+    assert client.get("/api/threads", params={"before": "not-a-cursor"}).status_code == 400
+
+def test_cursor_pages_wait_for_the_date_migration(client):
+    create_thread(client)
+    cursor = server.encode_cursor(datetime.now(timezone.utc), "x")
+    server.finished_migrations.discard(server.MIGRATION_CREATED_AT)
+    try:
+        response = client.get("/api/threads", params={"before": cursor, "sort": "created"})
+        assert response.status_code == 503
+        assert "retry-after" in response.headers
+    finally:
+        server.finished_migrations.add(server.MIGRATION_CREATED_AT)
+
+def test_streamed_replies_wait_for_the_date_migration(client):
+    thread_id = create_thread(client)
+    cursor = server.encode_cursor(datetime.now(timezone.utc), "x")
+    server.finished_migrations.discard(server.MIGRATION_CREATED_AT)
+    try:
+        streamed = client.get(f"/api/threads/{thread_id}/replies", params={"after": cursor, "stream": "true"})
+        assert streamed.status_code == 503
+        resumed = client.get(f"/api/threads/{thread_id}/events", headers={"Last-Event-ID": cursor})
+        assert resumed.status_code == 503
+        assert "retry-after" in resumed.headers
+    finally:
+        server.finished_migrations.add(server.MIGRATION_CREATED_AT)
+
+def test_date_migration_skips_malformed_values(client, run):
+    now = datetime.now(timezone.utc)
+    async def seed():
+        await server.db.threads.insert_many([
+            {"id": "good", "title": "a", "content": "", "created_at": (now - timedelta(days=1)).isoformat()},
+            {"id": "bad", "title": "b", "content": "", "created_at": "ontem"},
+        ])
+        await server.migrate_created_at_to_dates()
+        return {doc["id"]: doc async for doc in server.db.threads.find({})}
+    threads = run(seed)
+    assert isinstance(threads["good"]["created_at"], datetime)
+    assert isinstance(threads["bad"]["created_at"], datetime)
+    assert threads["bad"]["created_at_raw"] == "ontem"
+
+def test_activity_cursor_waits_for_the_bumped_at_backfill(client):
+    create_thread(client)
+    cursor = server.encode_cursor(datetime.now(timezone.utc), "x")
+    server.finished_migrations.discard(server.MIGRATION_BUMPED_AT)
+    try:
+        assert client.get("/api/threads", params={"before": cursor}).status_code == 503
+        assert client.get("/api/threads", params={"before": cursor, "sort": "created"}).status_code == 200
+    finally:
+        server.finished_migrations.add(server.MIGRATION_BUMPED_AT)
+
+def test_activity_pages_include_backfilled_legacy_threads(client, run):
+    now = datetime.now(timezone.utc)
+    async def seed():
+        await server.db.threads.insert_many([
+            {"id": f"legado{i}", "title": "a", "content": "", "created_at": now - timedelta(hours=i), "reply_count": 0}
+            for i in range(5)
+        ])
+        await server.backfill_bumped_at()
+        await server.thread_catalog.load()
+    run(seed)
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"before": cursor} if cursor else {})}
+        response = client.get("/api/threads", params=params)
+        seen += [thread["id"] for thread in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert seen == [f"legado{i}" for i in range(5)]
+
+def streamed_ids(response) -> list:
+    return [orjson.loads(line)["id"] for line in response.content.splitlines()]
+
+def test_replies_stream_as_ndjson(client):
+    thread_id = create_thread(client)
+    replies = [create_reply(client, thread_id, f"r{i}") for i in range(5)]
+    response = client.get(f"/api/threads/{thread_id}/replies", params={"stream": "true"})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert streamed_ids(response) == replies
+
+    first = client.get(f"/api/threads/{thread_id}/replies", params={"limit": 2})
+    rest = client.get(
+        f"/api/threads/{thread_id}/replies",
+        params={"stream": "true", "after": first.headers["x-next-cursor"], "limit": 2}
+    )
+    assert streamed_ids(rest) == replies[2:4]
+    assert client.get(f"/api/threads/{thread_id}/replies", params={"stream": "true", "before": "x"}).status_code == 400
+
+def test_archived_replies_stream_as_ndjson(client, admin):
+    thread_id = create_thread(client)
+    replies = [create_reply(client, thread_id, f"r{i}") for i in range(3)]
+    assert client.post(f"/api/admin/threads/{thread_id}/archive", headers=admin).status_code == 200
+    response = client.get(f"/api/threads/{thread_id}/replies", params={"stream": "true"})
+    assert streamed_ids(response) == replies
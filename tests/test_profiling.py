@@ -0,0 +1,34 @@
+import asyncio
+
+from motor.frameworks import asyncio as motor_asyncio_framework
+
+import server
+from tests.conftest import auth_headers
+
+def http_scope(query_string: bytes, headers: dict) -> dict:
+    return {
+        "type": "http",
+        "query_string": query_string,
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+    }
+
+def test_profile_flag_is_an_exact_query_parameter(client, run):
+    admin = auth_headers(client, "admin")
+    assert run(server.profile_requested, http_scope(b"profile=1", admin))
+    assert run(server.profile_requested, http_scope(b"limit=5&profile=1", admin))
+    assert not run(server.profile_requested, http_scope(b"noprofile=1", admin))
+    assert not run(server.profile_requested, http_scope(b"profile=10", admin))
+    assert not run(server.profile_requested, http_scope(b"profile=1", auth_headers(client, "joana")))
+
+def test_motor_calls_see_the_request_trace(monkeypatch):
+    # Restored after the test; the wrapper is installed over the original
+    monkeypatch.setattr(motor_asyncio_framework, "run_on_executor", motor_asyncio_framework.run_on_executor)
+    assert server.propagate_context_to_motor()
+
+    async def call_from_request():
+        trace = server.RequestTrace()
+        server.request_trace.set(trace)
+        seen = await motor_asyncio_framework.run_on_executor(asyncio.get_running_loop(), server.request_trace.get)
+        return seen is trace
+
+    assert asyncio.run(call_from_request())
@@ -0,0 +1,40 @@
+import pytest
+
+import server
+from tests.conftest import auth_headers
+
+@pytest.fixture(params=["memory", "mongo"])
+def limited(request, monkeypatch):
+    # Two new threads per minute, on the limiter under test
+    monkeypatch.setattr(server, "RATE_LIMIT_BACKEND", request.param)
+    limiter = server.MongoRateLimiter() if request.param == "mongo" else server.MemoryRateLimiter(100)
+    monkeypatch.setattr(server, "rate_limiter", limiter)
+    monkeypatch.setitem(server.RATE_LIMIT_RULES, "thread", (2, 60))
+
+def post_thread(client, headers=None):
+    return client.post("/api/threads", json={"title": "Tópico", "content": "Conteúdo"}, headers=headers or {})
+
+def test_client_over_the_limit_gets_429_with_retry_after(client, limited):
+    assert [post_thread(client).status_code for _ in range(2)] == [200, 200]
+    response = post_thread(client)
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["retry-after"]) <= 60
+    # Other route classes keep their own budget
+    assert client.get("/api/threads").status_code == 200
+
+def test_users_are_limited_by_username_not_address(client, limited):
+    joana, pedro = auth_headers(client, "joana"), auth_headers(client, "pedro")
+    assert [post_thread(client, joana).status_code for _ in range(3)] == [200, 200, 429]
+    # Same address, another account
+    assert post_thread(client, pedro).status_code == 200
+    # A second session of the same account shares its budget
+    assert post_thread(client, auth_headers(client, "joana")).status_code == 429
+
+def test_anonymous_clients_are_keyed_by_address(run):
+    def client_key(address, headers=()):
+        return run(server.rate_limit_client, {"type": "http", "headers": list(headers), "client": (address, 1)})
+    assert client_key("203.0.113.7") == "ip:203.0.113.7"
+    # One subscriber usually holds a whole /64
+    assert client_key("2001:db8::1") == client_key("2001:db8::ffff") == "ip:2001:db8::/64"
+    # Invalid tokens fall back to the address
+    assert client_key("203.0.113.7", [(b"authorization", b"Bearer nada")]) == "ip:203.0.113.7"
@@ -0,0 +1,57 @@
+from pymongo.errors import OperationFailure
+
+import server
+from tests.conftest import auth_headers, create_reply, create_thread
+
+def test_created_reply_is_returned(client):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    response = client.post(f"/api/threads/{thread_id}/replies", json={"content": "Presente"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["reply"]["id"] == body["reply_id"]
+    assert body["reply"]["content"] == "Presente"
+    assert body["reply"]["author_username"] == "joana"
+
+def replies_by_id(client, thread_id: str) -> dict:
+    return {reply["id"]: reply for reply in client.get(f"/api/threads/{thread_id}/replies").json()}
+
+def test_quotes_link_both_ways(client):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    first, second = create_reply(client, thread_id, "primeira"), create_reply(client, thread_id, "segunda")
+    quoting = create_reply(client, thread_id, f">>{second} concordo\n>>{first} e >>{second} de novo")
+    replies = replies_by_id(client, thread_id)
+    assert replies[quoting]["quotes"] == [second, first]
+    assert replies[first]["backlinks"] == [quoting]
+    assert replies[second]["backlinks"] == [quoting]
+
+def test_quotes_are_capped(client):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    quoted = [create_reply(client, thread_id, str(n)) for n in range(server.MAX_QUOTES_PER_REPLY + 2)]
+    quoting = create_reply(client, thread_id, " ".join(f">>{reply_id}" for reply_id in quoted))
+    replies = replies_by_id(client, thread_id)
+    assert replies[quoting]["quotes"] == quoted[:server.MAX_QUOTES_PER_REPLY]
+    assert replies[quoted[-1]]["backlinks"] == []
+
+def test_quotes_of_other_threads_are_ignored(client):
+    client.headers.update(auth_headers(client, "joana"))
+    other_thread_id = create_thread(client, "Outro")
+    elsewhere = create_reply(client, other_thread_id)
+    thread_id = create_thread(client)
+    quoting = create_reply(client, thread_id, f">>{elsewhere}")
+    assert replies_by_id(client, thread_id)[quoting]["quotes"] == []
+    assert replies_by_id(client, other_thread_id)[elsewhere]["backlinks"] == []
+
+def test_failed_backlinks_do_not_fail_the_reply(client, monkeypatch):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    quoted = create_reply(client, thread_id)
+
+    async def unavailable(*args, **kwargs):
+        raise OperationFailure("indisponível")
+    monkeypatch.setattr(type(server.db.replies), "bulk_write", unavailable)
+    quoting = create_reply(client, thread_id, f">>{quoted}")
+    assert client.get(f"/api/threads/{thread_id}").json()["reply_count"] == 2
+    assert replies_by_id(client, thread_id)[quoting]["quotes"] == [quoted]
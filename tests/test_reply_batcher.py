@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+import server
+from tests.conftest import auth_headers, create_thread
+
+@pytest.fixture
+def batcher():
+    return server.ReplyWriteBatcher(window_ms=1000, max_size=100)
+
+def test_partial_batch_failure_fails_only_rejected_replies(client, run, batcher):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+
+    async def write_batch():
+        duplicate = server.Reply(thread_id=thread_id, content="Já existe")
+        await server.db.replies.insert_one(duplicate.dict())
+        fresh = server.Reply(thread_id=thread_id, content="Nova")
+        futures = [batcher.submit(duplicate), batcher.submit(fresh)]
+        await batcher.flush()
+        return futures
+
+    rejected, written = run(write_batch)
+    assert isinstance(rejected.exception(), BulkWriteError)
+    assert written.result() is None
+    assert client.get(f"/api/threads/{thread_id}").json()["reply_count"] == 1
+
+def test_batch_to_missing_thread_fails_with_404(client, run, batcher):
+    async def write_batch():
+        future = batcher.submit(server.Reply(thread_id="sumiu", content="Olá"))
+        await batcher.flush()
+        return future, await server.db.replies.count_documents({})
+
+    future, remaining = run(write_batch)
+    assert future.exception().status_code == 404
+    assert remaining == 0
+
+def test_full_batch_flushes_in_tracked_task(client, run):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    batcher = server.ReplyWriteBatcher(window_ms=1000, max_size=2)
+
+    async def fill_batch():
+        futures = [batcher.submit(server.Reply(thread_id=thread_id, content=str(n))) for n in range(2)]
+        assert len(batcher.flushes) == 1
+        await asyncio.gather(*batcher.flushes)
+        await asyncio.gather(*futures)
+        await asyncio.sleep(0)
+        return batcher.flushes
+
+    assert run(fill_batch) == set()
+    assert client.get(f"/api/threads/{thread_id}").json()["reply_count"] == 2
+
+def test_orphaned_replies_take_their_backlinks_back(client, run, batcher):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    quoted = client.post(f"/api/threads/{thread_id}/replies", json={"content": "Citada"}).json()["reply_id"]
+
+    async def write_batch():
+        # The thread goes away after thread_exists would have cached it
+        await server.db.threads.delete_one({"id": thread_id})
+        future = batcher.submit(server.Reply(thread_id=thread_id, content=f">>{quoted}", quotes=[quoted]))
+        await batcher.flush()
+        return future, await server.db.replies.find_one({"id": quoted})
+
+    future, quoted_data = run(write_batch)
+    assert future.exception().status_code == 404
+    assert quoted_data["backlinks"] == []
@@ -0,0 +1,64 @@
+from datetime import datetime, timezone
+
+import server
+
+# mongomock has no $text, so the built pipeline is checked on its own and the
+# route runs over canned hits
+class RecordingCollection:
+    def __init__(self):
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return self
+
+    async def to_list(self, length):
+        return []
+
+def test_search_pipeline_ranks_by_text_score_and_seeks_past_the_cursor(run):
+    collection = RecordingCollection()
+    run(server.search_collection, collection, "revolução -1932", (1.5, "abc"), 10, {"_id": 0, "id": 1})
+    assert collection.pipelines[0] == [
+        {"$match": {"$text": {"$search": "revolução -1932"}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+        {"$match": {"$or": [{"score": {"$lt": 1.5}}, {"score": 1.5, "id": {"$lt": "abc"}}]}},
+        {"$sort": {"score": -1, "id": -1}},
+        {"$limit": 10},
+        {"$project": {"_id": 0, "id": 1}},
+    ]
+
+def test_text_index_covers_reply_content_in_portuguese():
+    index = next(model.document for model in server.INDEXES["replies"] if model.document["name"] == "text_search")
+    assert dict(index["key"]) == {"content": "text"}
+    assert index["default_language"] == "portuguese"
+
+def hit(item_id: str, score: float, content: str, **fields) -> dict:
+    return {"id": item_id, "score": score, "content": content, "author_username": None,
+            "created_at": datetime(2024, 1, 1, tzinfo=timezone.utc), **fields}
+
+def test_results_merge_threads_and_replies_by_score(client, monkeypatch):
+    calls = []
+
+    async def canned(collection, q, cursor, limit, projection):
+        calls.append((collection.name, cursor, limit))
+        if collection.name == "threads":
+            return [hit("t1", 3.0, "A Revolução Constitucionalista", title="Revolução")]
+        return [hit("r2", 4.0, "viva a revolucao", thread_id="t1"), hit("r1", 1.0, "outra coisa", thread_id="t1")]
+    monkeypatch.setattr(server, "search_collection", canned)
+
+    body = client.get("/api/search", params={"q": "Revolução -paulista", "limit": 2}).json()
+    assert [(result["type"], result["id"], result["thread_id"]) for result in body["results"]] == [
+        ("reply", "r2", "t1"), ("thread", "t1", "t1")
+    ]
+    assert body["results"][0]["snippet"] == "viva a revolucao"
+    assert body["results"][0]["highlights"] == [[7, 16]]
+    assert server.decode_search_cursor(body["next_cursor"]) == (3.0, "t1")
+
+    client.get("/api/search", params={"q": "revolução", "limit": 2, "cursor": body["next_cursor"]})
+    assert calls[-1][1:] == ((3.0, "t1"), 2)
+    assert client.get("/api/search", params={"q": "x", "cursor": "nada"}).status_code == 400
+
+def test_search_terms_fold_accents_and_drop_negations():
+    assert server.search_terms("Revolução -paulista São") == ["revolucao", "sao"]
+    snippet, highlights = server.highlight_snippet("As revoluções de São Paulo", ["revolucao"])
+    assert snippet[highlights[0][0]:highlights[0][1]] == "revoluções"
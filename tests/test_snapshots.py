@@ -0,0 +1,91 @@
+import asyncio
+import gzip
+
+import orjson
+import pytest
+
+import server
+from tests.conftest import auth_headers, create_reply, create_thread
+
+@pytest.fixture
+def snapshots(monkeypatch, tmp_path, run):
+    monkeypatch.setattr(server, "SNAPSHOTS_ENABLED", True)
+    monkeypatch.setattr(server.snapshot_writer, "directory", tmp_path)
+    yield server.snapshot_writer
+
+    # Renders scheduled by the test's writes must not outlive tmp_path
+    async def cancel_pending():
+        server.snapshot_writer.cancel()
+    run(cancel_pending)
+
+def test_page_is_sent_from_the_snapshot_of_its_version(client, run, snapshots):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    create_reply(client, thread_id, "Primeira")
+    run(snapshots.write_thread, thread_id)
+
+    response = client.get(f"/api/threads/{thread_id}/page", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == f'W/"{thread_id}.2"'
+    assert [reply["content"] for reply in response.json()["replies"]] == ["Primeira"]
+    revalidated = client.get(
+        f"/api/threads/{thread_id}/page",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]}
+    )
+    assert revalidated.status_code == 304
+
+def test_snapshot_of_an_older_version_is_not_served(client, run, snapshots):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    run(snapshots.write_thread, thread_id)
+    # Written through another worker: this one never hears about it
+    reply = server.Reply(thread_id=thread_id, content="De outro processo")
+    async def write_elsewhere():
+        await server.db.replies.insert_one(reply.dict())
+        await server.db.threads.update_one({"id": thread_id}, server.reply_counter_update(1, reply.created_at))
+    run(write_elsewhere)
+
+    page = client.get(f"/api/threads/{thread_id}/page").json()
+    assert [reply["content"] for reply in page["replies"]] == ["De outro processo"]
+
+def test_old_versions_are_pruned(client, run, snapshots):
+    client.headers.update(auth_headers(client, "joana"))
+    thread_id = create_thread(client)
+    for n in range(3):
+        create_reply(client, thread_id, f"r{n}")
+        run(snapshots.write_thread, thread_id)
+    paths = snapshots.version_paths(thread_id)
+    assert [path.name for path in paths] == [f"{thread_id}.3.json.gz", f"{thread_id}.4.json.gz"]
+    page = orjson.loads(gzip.decompress(paths[-1].read_bytes()))
+    assert page["thread"]["reply_count"] == 3
+
+def test_debounced_flush_runs_as_a_tracked_task(client, run, snapshots, monkeypatch):
+    monkeypatch.setattr(snapshots, "debounce", 0)
+    release = asyncio.Event()
+
+    async def blocked_flush():
+        snapshots.timer = None
+        await release.wait()
+    monkeypatch.setattr(snapshots, "flush", blocked_flush)
+
+    async def schedule_and_finish():
+        before = set(server.background_tasks)
+        snapshots.schedule(server.SNAPSHOT_FRONT)
+        await asyncio.sleep(0.01)
+        started = server.background_tasks - before
+        release.set()
+        await asyncio.gather(*started)
+        return len(started), started & server.background_tasks
+
+    started, still_tracked = run(schedule_and_finish)
+    assert started == 1
+    assert not still_tracked
+
+def test_cancel_drops_the_pending_render(client, run, snapshots):
+    async def schedule_and_cancel():
+        snapshots.schedule(server.SNAPSHOT_FRONT)
+        timer = snapshots.timer
+        snapshots.cancel()
+        return timer.cancelled(), snapshots.timer, snapshots.pending
+
+    assert run(schedule_and_cancel) == (True, None, set())
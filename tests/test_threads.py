@@ -0,0 +1,19 @@
+from datetime import datetime, timezone
+
+import server
+
+def test_thread_has_public_shape_and_model_datetimes(client, run):
+    legacy = {
+        "id": "legado",
+        "title": "Tópico antigo",
+        "content": "Sem campos novos",
+        "created_at": datetime(2020, 7, 9, tzinfo=timezone.utc),
+        "created_at_raw": "2020-07-09",
+        "reply_count": 0,
+    }
+    run(server.db.threads.insert_one, legacy)
+    thread = client.get("/api/threads/legado").json()
+    assert set(thread) == set(server.THREAD_FIELDS)
+    assert thread["created_at"] == "2020-07-09T00:00:00Z"
+    assert thread["author_username"] is None
+    assert thread["version"] == 1